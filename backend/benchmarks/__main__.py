@@ -0,0 +1,50 @@
+import argparse
+import json
+import logging
+import sys
+
+from benchmarks import suite  # pylint: disable=unused-import # registers the benchmarks
+from benchmarks.harness import (DEFAULT_THRESHOLD, MIN_ROUND_TIME, REGISTRY, ROUNDS, compare, format_comparison,
+                                load_results, run, select, to_json)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the configurator backend")
+    parser.add_argument('-k', '--filter', help="Run only benchmarks whose id contains this text.")
+    parser.add_argument('-o', '--output', help="Write the results as JSON to this file.")
+    parser.add_argument('--compare', metavar="BASELINE", help="Compare with the results stored in this JSON file.")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Relative slowdown reported as regression, default: {DEFAULT_THRESHOLD}")
+    parser.add_argument('--rounds', type=int, default=ROUNDS, help=f"Rounds per benchmark, default: {ROUNDS}")
+    parser.add_argument('--min-round-time', type=float, default=MIN_ROUND_TIME,
+                        help=f"Minimal duration of a round in seconds, default: {MIN_ROUND_TIME}")
+    parser.add_argument('--list', action='store_true', help="List the benchmarks and exit.")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_arguments()
+    # the expected warnings (e.g. failed authentications) would garble the report
+    logging.getLogger("uvicorn.error").setLevel(logging.ERROR)
+    benchmarks = select(REGISTRY, args.filter)
+    if args.list:
+        print("\n".join(bench.id for bench in benchmarks))
+        return 0
+
+    results = run(benchmarks, args.rounds, args.min_round_time)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(to_json(results), file, indent=2)
+
+    if args.compare:
+        comparisons = compare(load_results(args.compare), results)
+        print(format_comparison(comparisons, args.threshold))
+        regressions = [comp for comp in comparisons if comp.is_regression(args.threshold)]
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) slower than {1 + args.threshold:.2f}x the baseline.")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
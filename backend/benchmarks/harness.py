@@ -0,0 +1,138 @@
+import asyncio
+import inspect
+import json
+import platform
+import statistics
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+Operation = Callable[[], Union[Any, Awaitable[Any]]]
+# A setup function takes the size parameter and returns the operation to measure and a cleanup function.
+Setup = Callable[[int], Tuple[Operation, Callable[[], None]]]
+
+ROUNDS = 5
+MIN_ROUND_TIME = 0.05
+DEFAULT_THRESHOLD = 0.2
+
+
+@dataclass(frozen=True)
+class Benchmark:
+    name: str
+    size: int
+    setup: Setup
+
+    @property
+    def id(self) -> str:
+        return f"{self.name}[{self.size}]"
+
+
+@dataclass(frozen=True)
+class Result:
+    loops: int
+    rounds: int
+    # seconds per operation
+    min: float
+    median: float
+
+    @property
+    def ops_per_second(self) -> float:
+        return 1.0 / self.median if self.median else float("inf")
+
+
+@dataclass(frozen=True)
+class Comparison:
+    id: str
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline if self.baseline else float("inf")
+
+    def is_regression(self, threshold: float) -> bool:
+        return self.ratio > 1.0 + threshold
+
+
+REGISTRY: List[Benchmark] = []
+
+
+def benchmark(name: str, sizes: Iterable[int] = (1,)):
+    """Registers a setup function as benchmark, once per size."""
+    def register(setup: Setup) -> Setup:
+        REGISTRY.extend(Benchmark(name, size, setup) for size in sizes)
+        return setup
+    return register
+
+
+async def _time_loops(operation: Operation, loops: int) -> float:
+    if inspect.iscoroutinefunction(operation):
+        start = time.perf_counter()
+        for _ in range(loops):
+            await operation()
+        return time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(loops):
+        operation()
+    return time.perf_counter() - start
+
+
+async def measure(operation: Operation, rounds: int = ROUNDS, min_round_time: float = MIN_ROUND_TIME) -> Result:
+    """Calibrates the loop count to take at least min_round_time and returns the per operation timings."""
+    loops = 1
+    while (duration := await _time_loops(operation, loops)) < min_round_time:
+        loops = max(loops * 2, int(loops * min_round_time / max(duration, 1e-9)))
+    timings = [duration / loops] + [await _time_loops(operation, loops) / loops for _ in range(rounds - 1)]
+    return Result(loops, rounds, min(timings), statistics.median(timings))
+
+
+def run(benchmarks: Iterable[Benchmark], rounds: int = ROUNDS, min_round_time: float = MIN_ROUND_TIME,
+        report: Callable[[str], None] = print) -> Dict[str, Result]:
+    async def run_all() -> Dict[str, Result]:
+        results = {}
+        for bench in benchmarks:
+            operation, cleanup = bench.setup(bench.size)
+            try:
+                results[bench.id] = result = await measure(operation, rounds, min_round_time)
+            finally:
+                cleanup()
+            report(f"{bench.id:<45} {result.median * 1e6:12.1f} us {result.ops_per_second:12.0f} ops/s")
+        return results
+
+    return asyncio.run(run_all())
+
+
+def to_json(results: Dict[str, Result]) -> Dict[str, Any]:
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "results": {bench_id: asdict(result) for bench_id, result in results.items()},
+    }
+
+
+def load_results(path: str) -> Dict[str, Result]:
+    with open(path, "r", encoding="utf-8") as file:
+        data = json.load(file)
+    return {bench_id: Result(**result) for bench_id, result in data["results"].items()}
+
+
+def compare(baseline: Dict[str, Result], current: Dict[str, Result]) -> List[Comparison]:
+    """Compares the median timings of the benchmarks present in both result sets."""
+    return [Comparison(bench_id, baseline[bench_id].median, result.median)
+            for bench_id, result in current.items() if bench_id in baseline]
+
+
+def format_comparison(comparisons: List[Comparison], threshold: float) -> str:
+    lines = []
+    for comp in comparisons:
+        flag = "REGRESSION" if comp.is_regression(threshold) else ""
+        lines.append(f"{comp.id:<45} {comp.baseline * 1e6:12.1f} us -> {comp.current * 1e6:12.1f} us"
+                     f" {comp.ratio:6.2f}x {flag}".rstrip())
+    return "\n".join(lines)
+
+
+def select(benchmarks: Iterable[Benchmark], pattern: Optional[str]) -> List[Benchmark]:
+    return [bench for bench in benchmarks if not pattern or pattern in bench.id]
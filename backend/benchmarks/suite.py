@@ -0,0 +1,175 @@
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict
+
+from starlette.applications import Starlette
+from starlette.requests import HTTPConnection
+
+from benchmarks.harness import benchmark
+from smartmeter_datacollector_configurator import configurator, system
+from smartmeter_datacollector_configurator.app import build_app
+from smartmeter_datacollector_configurator.asgi_client import basic_auth, request
+from smartmeter_datacollector_configurator.authentication import AuthManager, SessionAuthBackend
+from smartmeter_datacollector_configurator.dto import ConfigDto
+from smartmeter_datacollector_configurator.services import FakeServiceManager
+from smartmeter_datacollector_configurator.status import StatusMonitor
+
+CONFIG_SIZES = (1, 10, 100, 1000)
+HTTP_SIZES = (1, 100)
+METER_TYPES = ("lge450", "lge360", "iskraam550", "kamstrup_han")
+
+
+def config_dict(meters: int) -> Dict[str, Any]:
+    """Configuration in its API representation with the given number of reader sections."""
+    return {
+        "log_level": "INFO",
+        "meters": [{"type": METER_TYPES[i % len(METER_TYPES)], "port": f"/dev/ttyUSB{i}",
+                    "key": "0" * 32 if i % 2 else None} for i in range(meters)],
+        "mqtt_sink": {"type": "mqtt", "host": "localhost", "port": 8883, "tls": True,
+                      "username": "user", "password": "secret", "topic_group": "meters"},
+        "logger_sink": {"type": "logger", "name": "DataLogger"},
+    }
+
+
+def config_dir(meters: int):
+    directory = tempfile.TemporaryDirectory(prefix="configurator-bench-")
+    configurator.write_config_from_dto(directory.name, ConfigDto.parse_obj(config_dict(meters)))
+    return directory
+
+
+def _cleanup(directory):
+    def cleanup():
+        configurator.invalidate_config_cache(directory.name)
+        directory.cleanup()
+    return cleanup
+
+
+@benchmark("config.retrieve_cold", CONFIG_SIZES)
+def retrieve_config_cold(size: int):
+    directory = config_dir(size)
+
+    def operation():
+        configurator.invalidate_config_cache(directory.name)
+        configurator.retrieve_config(directory.name)
+    return operation, _cleanup(directory)
+
+
+@benchmark("config.retrieve_cached", CONFIG_SIZES)
+def retrieve_config_cached(size: int):
+    directory = config_dir(size)
+    return (lambda: configurator.retrieve_config(directory.name)), _cleanup(directory)
+
+
+@benchmark("config.write", CONFIG_SIZES)
+def write_config(size: int):
+    directory = config_dir(size)
+    dto = ConfigDto.parse_obj(config_dict(size))
+    return (lambda: configurator.write_config_from_dto(directory.name, dto)), _cleanup(directory)
+
+
+@benchmark("dto.parse_obj", CONFIG_SIZES)
+def dto_parse_obj(size: int):
+    raw = config_dict(size)
+    return (lambda: ConfigDto.parse_obj(raw)), lambda: None
+
+
+@benchmark("dto.json", CONFIG_SIZES)
+def dto_json(size: int):
+    dto = ConfigDto.parse_obj(config_dict(size))
+    return dto.json, lambda: None
+
+
+def _app(meters: int):
+    directory = config_dir(meters)
+    static_dir = Path(directory.name) / "static"
+    static_dir.mkdir()
+    (static_dir / "index.html").write_text("<html></html>", encoding="utf-8")
+    app = build_app(directory.name, static_dir, serial_dir=str(Path(directory.name) / "serial"))
+    app.state.static_files.preload()
+    return app, directory
+
+
+def _authenticate(headers: Callable[[Starlette], Dict[str, str]]):
+    app, directory = _app(1)
+    backend = SessionAuthBackend()
+    scope = {"type": "http", "app": app, "headers": [
+        (key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in headers(app).items()]}
+
+    async def operation():
+        await backend.authenticate(HTTPConnection(scope))
+    return operation, _cleanup(directory)
+
+
+def _bearer(app: Starlette) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {app.state.auth_manager.sessions.create(AuthManager.USERNAME)}"}
+
+
+@benchmark("auth.basic_verified")
+def auth_basic_verified(_size: int):
+    return _authenticate(lambda app: basic_auth())
+
+
+@benchmark("auth.basic_invalid")
+def auth_basic_invalid(_size: int):
+    return _authenticate(lambda app: basic_auth("wrong_password"))
+
+
+@benchmark("auth.session_token")
+def auth_session_token(_size: int):
+    return _authenticate(_bearer)
+
+
+def _http(size: int, method: str, url: str, headers=None, body: bytes = b"", conditional: bool = False):
+    app, directory = _app(size)
+    headers = dict(headers or {})
+    headers = {**_bearer(app), **headers}
+    if conditional:
+        headers["If-None-Match"] = configurator.retrieve_cached_config(directory.name).etag
+
+    async def operation():
+        response = await request(app, method, url, headers=headers, body=body)
+        assert response.status in (200, 304), response
+    return operation, _cleanup(directory)
+
+
+@benchmark("http.get_config", HTTP_SIZES)
+def http_get_config(size: int):
+    return _http(size, "GET", "/api/config")
+
+
+@benchmark("http.get_config_not_modified", HTTP_SIZES)
+def http_get_config_not_modified(size: int):
+    return _http(size, "GET", "/api/config", conditional=True)
+
+
+@benchmark("http.post_config", HTTP_SIZES)
+def http_post_config(size: int):
+    return _http(size, "POST", "/api/config", {"Content-Type": "application/json"},
+                 ConfigDto.parse_obj(config_dict(size)).json().encode("utf-8"))
+
+
+@benchmark("http.static_index")
+def http_static_index(_size: int):
+    return _http(1, "GET", "/", {"Accept-Encoding": "gzip"})
+
+
+def _fake_services():
+    previous = system.set_service_manager(FakeServiceManager([system.DATACOL_SERVICE, *system.DEMO_SERVICES]))
+    return lambda: system.set_service_manager(previous)
+
+
+@benchmark("services.demo_restart")
+def services_demo_restart(_size: int):
+    # the restart flow (dependency ordering, job progress) without the cost of systemd
+    restore = _fake_services()
+
+    async def operation():
+        job = system.Job(system.DEMO_RESTART_JOB)
+        await system.restart_demo(system.DEMO_SERVICES, job)
+    return operation, restore
+
+
+@benchmark("services.status_refresh")
+def services_status_refresh(_size: int):
+    restore = _fake_services()
+    return StatusMonitor().refresh, restore
@@ -28,6 +28,18 @@ echo "..done"
 # copy the built frontend to the static directory
 mkdir -p "${BACKEND_STATIC_DIR}"
 cp -R "${FRONTEND_DIST_DIR}/"* "${BACKEND_STATIC_DIR}/"
+
+# precompress the text assets, the backend serves these variants to clients accepting them
+echo -n "Precompressing static files.."
+COMPRESSIBLE=( -name '*.html' -o -name '*.js' -o -name '*.css' -o -name '*.svg' -o -name '*.json' -o -name '*.txt' )
+find "${BACKEND_STATIC_DIR}" -type f \( "${COMPRESSIBLE[@]}" \) -exec gzip -9 -k -n -f {} \;
+if command -v brotli &> /dev/null; then
+    find "${BACKEND_STATIC_DIR}" -type f \( "${COMPRESSIBLE[@]}" \) -exec brotli -q 11 -k -f {} \;
+else
+    echo -n "brotli not found, skipping .br variants.."
+fi
+echo "..done"
+
 cp "${ROOT_DIR}/LICENSE" "${BACKEND_DIR}"
 
 # build the Python package
@@ -1,4 +1,4 @@
-from smartmeter_datacollector_configurator.app import main
+from smartmeter_datacollector_configurator.cli import main
 
 if __name__ == '__main__':
     main()
@@ -1,10 +1,11 @@
 import argparse
+import contextlib
 import logging
 import os
+import shlex
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, Optional
 
-import uvicorn
 from pydantic.error_wrappers import ValidationError
 from starlette.applications import Starlette
 from starlette.authentication import requires
@@ -14,27 +15,47 @@ from starlette.middleware import Middleware
 from starlette.middleware.authentication import AuthenticationMiddleware
 from starlette.middleware.cors import CORSMiddleware
 from starlette.requests import Request
-from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.responses import JSONResponse, PlainTextResponse, Response
 from starlette.routing import Mount, Route
 from starlette.staticfiles import StaticFiles
 from starlette.types import ASGIApp
 
-from smartmeter_datacollector_configurator import configurator, system
-from smartmeter_datacollector_configurator.authentication import AuthManager, BasicAuthBackend, SetPasswordError
-from smartmeter_datacollector_configurator.dto import ConfigDto, CredentialsDto
+from smartmeter_datacollector_configurator import apply, configurator, metrics, services, system
+from smartmeter_datacollector_configurator.authentication import AuthManager, SessionAuthBackend, SetPasswordError
+from smartmeter_datacollector_configurator.cli import load_arguments
+from smartmeter_datacollector_configurator.config_watch import ConfigWatch
+from smartmeter_datacollector_configurator.devices import SERIAL_BY_ID_DIR, SerialDeviceIndex
+from smartmeter_datacollector_configurator.dto import (ConfigDto, CredentialsDto, MeterDto, ProbeRequestDto,
+                                                       ProfilingSettingsDto)
+from smartmeter_datacollector_configurator.events import TooManySubscribersError, sse_response
+from smartmeter_datacollector_configurator.history import ConfigHistory, SnapshotNotFoundError
+from smartmeter_datacollector_configurator.io_executor import run_io, shutdown_io_executor
+from smartmeter_datacollector_configurator.journal import LEVELS, JournalTail
+from smartmeter_datacollector_configurator.limits import CREDENTIALS_BODY_LIMIT, JSON_BODY_LIMIT, BodyLimitMiddleware
+from smartmeter_datacollector_configurator.metrics import MetricsMiddleware
+from smartmeter_datacollector_configurator.profiling import Capture, ProfilingMiddleware, RequestProfiler
+from smartmeter_datacollector_configurator.static import PrecompressedStaticFiles
+from smartmeter_datacollector_configurator.status import StatusMonitor
+from smartmeter_datacollector_configurator.writer import ConfigWriter
 
 LOGGER = logging.getLogger("uvicorn.error")
 
 STATIC_DIR = 'static'
 
+# Upper limit in seconds a long-poll request waits for a job change.
+MAX_LONG_POLL = 30.0
+
 # Endpoints
 
 
 class Configuration(HTTPEndpoint):
     @requires("authenticated")
-    async def get(self, request):
-        dto = configurator.retrieve_config(request.app.state.config_path)
-        return JSONResponse(dto.json())
+    async def get(self, request: Request):
+        config = await configurator.retrieve_cached_config_async(request.app.state.config_path)
+        headers = {"ETag": config.etag, "Cache-Control": "private, no-cache"}
+        if configurator.etag_matches(request.headers.get("If-None-Match"), config.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(config.body, media_type="application/json", headers=headers)
 
     @requires("authenticated")
     async def post(self, request: Request):
@@ -44,39 +65,254 @@ class Configuration(HTTPEndpoint):
             LOGGER.warning("Validation failure: '%s'", ex)
             raise HTTPException(status_code=400, detail="Validation of configuration failed.") from ex
         try:
-            configurator.write_config_from_dto(request.app.state.config_path, config)
+            etag = await request.app.state.config_writer.write(config, request.headers.get("If-Match"))
+        except configurator.ConfigConflictError as ex:
+            raise _precondition_failed(ex) from ex
         except configurator.ConfigWriteError as ex:
             LOGGER.warning("Config write failed: '%s'", ex)
             raise HTTPException(status_code=500, detail="Failed to write configuration.") from ex
 
         LOGGER.info("Configuration updated.")
         LOGGER.debug("Config: %s", config)
-        return PlainTextResponse()
+        return PlainTextResponse(headers={"ETag": etag})
+
+
+@requires("authenticated")
+async def get_config_events(request: Request):
+    config_watch: ConfigWatch = request.app.state.config_watch
+    if config_watch.events.full:
+        raise HTTPException(status_code=503, detail="Too many clients are following the configuration.")
+    return sse_response(config_watch.stream())
+
+
+@requires("authenticated")
+async def apply_config(request: Request):
+    config = _parse_dto(ConfigDto, await _read_json_object(request))
+    if_match = request.headers.get("If-Match")
+    current = await configurator.retrieve_cached_config_async(request.app.state.config_path)
+    if if_match is not None and not configurator.etag_matches(if_match, current.etag):
+        raise _precondition_failed(configurator.ConfigConflictError(current.etag))
+    job, created = apply.trigger_apply(request.app.state.jobs, request.app.state.config_path, config, if_match,
+                                       request.app.state.history)
+    if not created:
+        raise HTTPException(status_code=503, detail="Applying a configuration is already in progress.")
+    request.app.state.status.boost()
+    return JSONResponse(job.to_dict(), status_code=202, headers={"Location": f"/api/jobs/{job.id}"})
+
+
+@requires("authenticated")
+async def get_config_history(request: Request):
+    history: ConfigHistory = request.app.state.history
+    return JSONResponse([entry.to_dict() for entry in await run_io(history.entries)])
+
+
+@requires("authenticated")
+async def diff_config_snapshot(request: Request):
+    """Changes from the current configuration (or the snapshot of query parameter 'base') to the snapshot."""
+    history: ConfigHistory = request.app.state.history
+    snapshot = await _load_snapshot(history, request.path_params["snapshot"])
+    base_id = request.query_params.get("base")
+    if base_id:
+        base = await _load_snapshot(history, base_id)
+    else:
+        base = (await configurator.retrieve_cached_config_async(request.app.state.config_path)).dto
+    return JSONResponse([change.to_dict() for change in configurator.diff_config(base, snapshot)])
+
+
+@requires("authenticated")
+async def rollback_config(request: Request):
+    history: ConfigHistory = request.app.state.history
+    try:
+        cached = await run_io(history.rollback, request.path_params["snapshot"], request.headers.get("If-Match"))
+    except SnapshotNotFoundError as ex:
+        raise HTTPException(status_code=404, detail=str(ex)) from ex
+    except configurator.ConfigConflictError as ex:
+        raise _precondition_failed(ex) from ex
+    except configurator.ConfigWriteError as ex:
+        LOGGER.warning("Config rollback failed: '%s'", ex)
+        raise HTTPException(status_code=500, detail="Failed to write configuration.") from ex
+    return PlainTextResponse(headers={"ETag": cached.etag})
+
+
+async def _load_snapshot(history: ConfigHistory, snapshot: str) -> ConfigDto:
+    try:
+        return await run_io(history.load, snapshot)
+    except SnapshotNotFoundError as ex:
+        raise HTTPException(status_code=404, detail=str(ex)) from ex
+
+
+class ConfigMeter(HTTPEndpoint):
+    @requires("authenticated")
+    async def put(self, request: Request):
+        meter = _parse_dto(MeterDto, await _read_json_object(request))
+        return await _update_config(request, configurator.update_meter, request.path_params["index"], meter)
+
+    @requires("authenticated")
+    async def patch(self, request: Request):
+        return await _update_config(request, configurator.patch_meter, request.path_params["index"],
+                                    await _read_json_object(request))
+
+    @requires("authenticated")
+    async def delete(self, request: Request):
+        return await _update_config(request, configurator.update_meter, request.path_params["index"], None)
+
+
+class ConfigSink(HTTPEndpoint):
+    @requires("authenticated")
+    async def put(self, request: Request):
+        kind = _sink_kind(request)
+        sink = _parse_dto(configurator.SINK_KINDS[kind][1], await _read_json_object(request))
+        return await _update_config(request, configurator.update_sink, kind, sink)
+
+    @requires("authenticated")
+    async def patch(self, request: Request):
+        kind = _sink_kind(request)
+        return await _update_config(request, configurator.patch_sink, kind, await _read_json_object(request))
+
+    @requires("authenticated")
+    async def delete(self, request: Request):
+        return await _update_config(request, configurator.update_sink, _sink_kind(request), None)
+
+
+async def _read_json_object(request: Request) -> Dict[str, Any]:
+    try:
+        data = await request.json()
+    except ValueError as ex:
+        raise HTTPException(status_code=400, detail="Invalid JSON.") from ex
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="JSON object expected.")
+    return data
+
+
+def _parse_dto(dto_type, data: Dict[str, Any]):
+    try:
+        return dto_type.parse_obj(data)
+    except ValidationError as ex:
+        LOGGER.warning("Validation failure: '%s'", ex)
+        raise HTTPException(status_code=400, detail="Validation of configuration failed.") from ex
+
+
+def _sink_kind(request: Request) -> str:
+    kind = request.path_params["kind"]
+    if kind not in configurator.SINK_KINDS:
+        raise HTTPException(status_code=404, detail=f"Unknown sink '{kind}'.")
+    return kind
+
+
+async def _update_config(request: Request, update, *args) -> Response:
+    try:
+        cached = await run_io(update, request.app.state.config_path, *args, request.headers.get("If-Match"))
+    except configurator.ConfigConflictError as ex:
+        raise _precondition_failed(ex) from ex
+    except ValidationError as ex:
+        LOGGER.warning("Validation failure: '%s'", ex)
+        raise HTTPException(status_code=400, detail="Validation of configuration failed.") from ex
+    except configurator.ConfigSectionNotFoundError as ex:
+        raise HTTPException(status_code=404, detail=str(ex)) from ex
+    except configurator.ConfigWriteError as ex:
+        LOGGER.warning("Config write failed: '%s'", ex)
+        raise HTTPException(status_code=500, detail="Failed to write configuration.") from ex
+
+    LOGGER.info("Configuration section updated.")
+    await request.app.state.history.record_async(cached)
+    return PlainTextResponse(headers={"ETag": cached.etag})
+
+
+def _precondition_failed(ex: configurator.ConfigConflictError) -> HTTPException:
+    return HTTPException(status_code=412, detail="Configuration has been changed meanwhile, reload it first.",
+                         headers={"ETag": ex.etag})
 
 
 @requires("authenticated")
 async def restart_datacollector(request):
-    # pylint: disable=unused-argument
     try:
         await system.restart_datacollector()
     except (system.NoPermissionError, system.NotInstalledError, system.GeneralSystemError) as ex:
         raise HTTPException(status_code=503, detail=str(ex)) from ex
+    finally:
+        request.app.state.status.boost()
     return PlainTextResponse()
 
 
 @requires("authenticated")
 async def restart_demo(request):
-    # pylint: disable=unused-argument
     installed_services = await system.get_installed_demo_services()
     if not installed_services:
         raise HTTPException(status_code=503, detail="No demo services are installed.")
 
-    if await system.trigger_demo_restart(installed_services):
-        return PlainTextResponse(content="Trying to restart following demo services: " + ", ".join(installed_services))
+    job, created = system.trigger_demo_restart(request.app.state.jobs, installed_services)
+    if created:
+        request.app.state.status.boost()
+        return PlainTextResponse(content="Trying to restart following demo services: " + ", ".join(installed_services),
+                                 headers={"Location": f"/api/jobs/{job.id}"})
 
     raise HTTPException(status_code=503, detail="Demo restart already in progress. Please wait until it is finished.")
 
 
+@requires("authenticated")
+async def get_status(request: Request):
+    return Response(request.app.state.status.snapshot(), media_type="application/json")
+
+
+@requires("authenticated")
+async def get_logs(request: Request):
+    level = request.query_params.get("level", "info")
+    if level not in LEVELS:
+        raise HTTPException(status_code=400, detail=f"Unknown level '{level}', expected one of {', '.join(LEVELS)}.")
+    return sse_response(request.app.state.journal.stream(LEVELS[level]))
+
+
+@requires("authenticated")
+async def demo_restart_progress(request):
+    job = await request.app.state.jobs.latest_async(system.DEMO_RESTART_JOB)
+    if not job:
+        raise HTTPException(status_code=404, detail="No demo restart has been triggered.")
+    return sse_response(request.app.state.jobs.events(job))
+
+
+@requires("authenticated")
+async def get_job(request: Request):
+    job = await _get_job_or_404(request)
+    try:
+        wait = min(float(request.query_params.get("wait", 0)), MAX_LONG_POLL)
+        since = int(request.query_params.get("since", job.version))
+    except ValueError as ex:
+        raise HTTPException(status_code=400, detail="Invalid long-poll parameters.") from ex
+    if wait > 0:
+        job = await request.app.state.jobs.wait_for_change(job, since, wait)
+    return JSONResponse(job.to_dict())
+
+
+@requires("authenticated")
+async def get_job_events(request: Request):
+    return sse_response(request.app.state.jobs.events(await _get_job_or_404(request)))
+
+
+async def _get_job_or_404(request: Request) -> system.Job:
+    job = await request.app.state.jobs.get_async(request.path_params["job_id"])
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+
+@requires("authenticated")
+async def login(request: Request):
+    if "session" in request.auth.scopes:
+        # a token must not renew itself, that would lift the absolute session lifetime
+        raise HTTPException(status_code=403, detail="Login requires the user's credentials.")
+    auth_manager: AuthManager = request.app.state.auth_manager
+    token = await auth_manager.sessions.create_async(request.user.username)
+    LOGGER.debug("Session created for user %s.", request.user.username)
+    return JSONResponse({"token": token, "expires_in": int(auth_manager.sessions.lifetime)})
+
+
+@requires(["authenticated", "session"])
+async def logout(request: Request):
+    _, _, token = request.headers["Authorization"].partition(" ")
+    await request.app.state.auth_manager.sessions.revoke_async(token.strip())
+    return PlainTextResponse()
+
+
 @requires("authenticated")
 async def set_credentials(request: Request):
     try:
@@ -86,7 +322,7 @@ async def set_credentials(request: Request):
         LOGGER.warning("Credential validation error: %s", ex)
         raise HTTPException(status_code=400, detail="New credentials are invalid.") from ex
     try:
-        request.app.state.auth_manager.set_new_credentials(credential_dto)
+        await request.app.state.auth_manager.set_new_credentials_async(credential_dto)
     except SetPasswordError as ex:
         LOGGER.warning("Credential write error: '%s'", ex)
         raise HTTPException(status_code=500, detail="Failed to write new credentials.") from ex
@@ -94,23 +330,154 @@ async def set_credentials(request: Request):
     return PlainTextResponse()
 
 
-async def get_tty_devices(request):
+async def get_tty_devices(request: Request):
+    device_index: SerialDeviceIndex = request.app.state.tty_devices
+    if request.query_params.get("details", "").lower() in ("1", "true"):
+        # the USB serial numbers identify the devices, only the paths are public
+        if not request.user.is_authenticated:
+            raise HTTPException(status_code=403)
+        return JSONResponse([device.to_dict() for device in device_index.devices()])
+    return JSONResponse(device_index.paths())
+
+
+@requires("authenticated")
+async def probe_tty_devices(request: Request):
+    device_index: SerialDeviceIndex = request.app.state.tty_devices
+    try:
+        body = await request.body()
+        probe_request = ProbeRequestDto.parse_raw(body) if body else ProbeRequestDto()
+    except ValidationError as ex:
+        LOGGER.warning("Validation failure: '%s'", ex)
+        raise HTTPException(status_code=400, detail="Validation of probe request failed.") from ex
+
+    ports = probe_request.ports if probe_request.ports is not None else device_index.paths()
+    unknown = set(ports) - set(device_index.paths())
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown serial devices: {', '.join(sorted(unknown))}")
+
+    config = await configurator.retrieve_cached_config_async(request.app.state.config_path)
+    # probing is rare, its serial port machinery is loaded on first use to keep the startup short
+    from smartmeter_datacollector_configurator import probe  # pylint: disable=import-outside-toplevel
+    results = await probe.probe_ports(ports, probe_request.budget or probe.PROBE_BUDGET,
+                                      skip=[meter.port for meter in config.dto.meters])
+    return JSONResponse([result.to_dict() for result in results])
+
+
+@requires("authenticated")
+async def get_tty_device_events(request: Request):
+    device_index: SerialDeviceIndex = request.app.state.tty_devices
+    if device_index.events.full:
+        raise HTTPException(status_code=503, detail="Too many clients are following the serial devices.")
+
+    async def device_events():
+        try:
+            with device_index.events.subscribe() as updates:
+                yield "snapshot", [device.to_dict() for device in device_index.devices()]
+                while (update := await updates.get()) is not None:
+                    yield update
+        except TooManySubscribersError:
+            # lost the race for the last free place, the client reconnects
+            LOGGER.debug("Serial device event stream rejected, too many subscribers.")
+
+    return sse_response(device_events())
+
+
+@requires("authenticated")
+async def get_profiling(request: Request):
+    return JSONResponse(request.app.state.profiler.settings())
+
+
+@requires("authenticated")
+async def set_profiling(request: Request):
+    settings = _parse_dto(ProfilingSettingsDto, await _read_json_object(request))
+    profiler: RequestProfiler = request.app.state.profiler
+    profiler.configure(**settings.dict())
+    profiler.start()
+    LOGGER.info("Request profiling %s.", "enabled" if settings.enabled else "disabled")
+    return JSONResponse(profiler.settings())
+
+
+@requires("authenticated")
+async def get_captures(request: Request):
+    return JSONResponse([capture.to_dict() for capture in request.app.state.profiler.captures()])
+
+
+@requires("authenticated")
+async def get_capture(request: Request):
+    capture = _get_capture_or_404(request)
+    return PlainTextResponse(await run_io(capture.summary))
+
+
+@requires("authenticated")
+async def download_capture_profile(request: Request):
+    capture = _get_capture_or_404(request)
+    if capture.profile is None:
+        raise HTTPException(status_code=404, detail="Capture has no profile.")
+    return Response(capture.profile, media_type="application/octet-stream",
+                    headers={"Content-Disposition": f'attachment; filename="capture-{capture.id}.prof"'})
+
+
+def _get_capture_or_404(request: Request) -> Capture:
+    capture = request.app.state.profiler.get(request.path_params["capture_id"])
+    if not capture:
+        raise HTTPException(status_code=404, detail="Capture not found.")
+    return capture
+
+
+@requires("authenticated")
+async def get_metrics(request: Request):
     # pylint: disable=unused-argument
-    devices = system.retrieve_tty_devices()
-    return JSONResponse(devices)
+    return PlainTextResponse(metrics.REGISTRY.expose(), media_type=metrics.CONTENT_TYPE)
 
 
-def build_routes(static_file_path: Optional[Path]):
+def build_static_files(static_file_path: Optional[Path]) -> PrecompressedStaticFiles:
     if static_file_path:
-        static_files = StaticFiles(directory=static_file_path, html=True)
-    else:
-        static_files = StaticFiles(packages=[(__name__, STATIC_DIR)], html=True)
+        return PrecompressedStaticFiles(directory=static_file_path, html=True)
+    return PrecompressedStaticFiles(packages=[(__name__, STATIC_DIR)], html=True)
+
+
+def build_api_routes():
+    # bodies are bounded while they are received, before an endpoint buffers them
+    json_body = [Middleware(BodyLimitMiddleware, max_size=JSON_BODY_LIMIT, content_types=["application/json"])]
+    credentials_body = [Middleware(BodyLimitMiddleware, max_size=CREDENTIALS_BODY_LIMIT,
+                                   content_types=["text/plain"])]
     return [
-        Route('/api/config', Configuration, methods=['GET', 'POST']),
-        Route('/api/restart', restart_datacollector, methods=['POST']),
-        Route('/api/restart-demo', restart_demo, methods=['POST']),
-        Route('/api/credentials', set_credentials, methods=['POST']),
-        Route('/api/ttydevices', get_tty_devices, methods=['GET']),
+        Route('/config', Configuration, methods=['GET', 'POST'], middleware=json_body),
+        Route('/config/apply', apply_config, methods=['POST'], middleware=json_body),
+        Route('/config/events', get_config_events, methods=['GET']),
+        Route('/config/history', get_config_history, methods=['GET']),
+        Route('/config/history/{snapshot}/diff', diff_config_snapshot, methods=['GET']),
+        Route('/config/history/{snapshot}/rollback', rollback_config, methods=['POST']),
+        Route('/config/meters/{index:int}', ConfigMeter, methods=['PUT', 'PATCH', 'DELETE'], middleware=json_body),
+        Route('/config/sinks/{kind}', ConfigSink, methods=['PUT', 'PATCH', 'DELETE'], middleware=json_body),
+        Route('/restart', restart_datacollector, methods=['POST']),
+        Route('/restart-demo', restart_demo, methods=['POST']),
+        Route('/restart-demo/progress', demo_restart_progress, methods=['GET']),
+        Route('/status', get_status, methods=['GET']),
+        Route('/logs', get_logs, methods=['GET']),
+        Route('/jobs/{job_id}', get_job, methods=['GET']),
+        Route('/jobs/{job_id}/events', get_job_events, methods=['GET']),
+        Route('/credentials', set_credentials, methods=['POST'], middleware=credentials_body),
+        Route('/login', login, methods=['POST']),
+        Route('/logout', logout, methods=['POST']),
+        Route('/debug/profiling', get_profiling, methods=['GET']),
+        Route('/debug/profiling', set_profiling, methods=['PUT'], middleware=json_body),
+        Route('/debug/captures', get_captures, methods=['GET']),
+        Route('/debug/captures/{capture_id:int}', get_capture, methods=['GET']),
+        Route('/debug/captures/{capture_id:int}/profile', download_capture_profile, methods=['GET']),
+        Route('/ttydevices', get_tty_devices, methods=['GET']),
+        Route('/ttydevices/events', get_tty_device_events, methods=['GET']),
+        Route('/ttydevices/probe', probe_tty_devices, methods=['POST'], middleware=json_body),
+    ]
+
+
+def build_routes(static_files: StaticFiles):
+    # only the API passes CORS, the public frontend bundle is served directly
+    return [
+        Mount('/api', routes=build_api_routes(), middleware=build_middleware()),
+        # reveals the authentication failures and timings of the routes, scraped with the configurator's credentials
+        Route('/metrics', get_metrics, methods=['GET'],
+              middleware=[Middleware(AuthenticationMiddleware, backend=SessionAuthBackend())]),
         Mount('/', app=static_files)
     ]
 
@@ -119,28 +486,13 @@ def build_middleware():
     return [
         Middleware(CORSMiddleware,
                    allow_origins=['*'],
-                   allow_headers=["Authorization"],
-                   allow_methods=["GET", "POST"]),
-        Middleware(AuthenticationMiddleware, backend=BasicAuthBackend())
+                   allow_headers=["Authorization", "If-Match", "If-None-Match"],
+                   allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE"],
+                   expose_headers=["ETag"]),
+        Middleware(AuthenticationMiddleware, backend=SessionAuthBackend())
     ]
 
 
-def parse_arguments():
-    parser = argparse.ArgumentParser(
-        description="Smart Meter Data Collector Configurator Backend", add_help=True)
-    parser.add_argument(
-        '-c', '--config', help="Directory path where config files should be deployed.", default=".")
-    parser.add_argument(
-        '-s', '--static', help="Director path with the static files.", default="")
-    parser.add_argument(
-        '--host', help="Host IP, default: 127.0.0.1", default="127.0.0.1")
-    parser.add_argument(
-        '--port', help="Port, default: 8000", type=int, default=8000)
-    parser.add_argument(
-        '-d', '--dev', help="Development mode: debug log, reloading", action='store_true')
-    return parser.parse_args()
-
-
 def resolve_static(static_file_path: str) -> Optional[Path]:
     static_path = None
     if static_file_path:
@@ -150,29 +502,63 @@ def resolve_static(static_file_path: str) -> Optional[Path]:
     return static_path
 
 
-def web_app() -> ASGIApp:
-    args = parse_arguments()
-    static_path = resolve_static(args.static)
-    config_path = os.path.normpath(args.config)
-
+@contextlib.asynccontextmanager
+async def lifespan(app: Starlette):
+    await run_io(app.state.static_files.preload)
+    await app.state.tty_devices.start()
+    app.state.profiler.start()
+    app.state.status.start()
+    await app.state.config_watch.start()
+    yield
+    app.state.config_watch.stop()
+    await app.state.status.stop()
+    await system.get_service_manager().close()
+    app.state.profiler.stop()
+    app.state.tty_devices.stop()
+    await app.state.config_writer.close()
+    shutdown_io_executor()
+
+
+def build_app(config_path: str, static_path: Optional[Path] = None, debug: bool = False,
+              serial_dir: str = SERIAL_BY_ID_DIR, state_dir: Optional[str] = None) -> Starlette:
+    """With a state directory the app runs as one of multiple worker processes sharing it."""
+    static_files = build_static_files(static_path)
     app = Starlette(
-        debug=bool(args.dev),
-        routes=build_routes(static_path),
-        middleware=build_middleware())
+        debug=debug,
+        routes=build_routes(static_files),
+        middleware=[Middleware(MetricsMiddleware), Middleware(ProfilingMiddleware)],
+        lifespan=lifespan)
 
+    app.state.static_files = static_files
     app.state.config_path = config_path
-    app.state.auth_manager = AuthManager(config_path)
+    if state_dir:
+        configurator.share_between_processes(config_path, f"{state_dir}/config.lock")
+    app.state.history = ConfigHistory(config_path, lock_path=f"{state_dir}/history.lock" if state_dir else None)
+    app.state.config_writer = ConfigWriter(config_path, app.state.history)
+    app.state.auth_manager = AuthManager(config_path, state_dir)
+    app.state.jobs = system.JobRegistry(state_dir=f"{state_dir}/jobs" if state_dir else None)
+    app.state.tty_devices = SerialDeviceIndex(serial_dir)
+    app.state.profiler = RequestProfiler()
+    app.state.status = StatusMonitor()
+    app.state.journal = JournalTail()
+    app.state.config_watch = ConfigWatch(config_path)
     return app
 
 
-def main():
-    args = parse_arguments()
-    debug_mode = bool(args.dev)
-    logger_level = "debug" if args.dev else "info"
+def create_app(args: argparse.Namespace) -> Starlette:
+    static_path = resolve_static(args.static)
+    config_path = os.path.normpath(args.config)
+    app = build_app(config_path, static_path, bool(args.dev), args.serial_dir or SERIAL_BY_ID_DIR,
+                    args.state_dir)
+    app.state.profiler.configure(args.profile_requests, args.profile_sample_rate, args.slow_request_ms,
+                                 args.loop_block_ms)
+    app.state.status.interval = args.status_interval
+    if args.journal_command:
+        app.state.journal.command = shlex.split(args.journal_command)
+    system.set_service_manager(services.create_service_manager(args.service_manager,
+                                                               [system.DATACOL_SERVICE, *system.DEMO_SERVICES]))
+    return app
+
 
-    uvicorn.run("smartmeter_datacollector_configurator.app:web_app",
-                host=args.host,
-                port=args.port,
-                log_level=logger_level,
-                reload=debug_mode,
-                factory=True)
+def web_app() -> ASGIApp:
+    return create_app(load_arguments())
@@ -0,0 +1,79 @@
+import functools
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from smartmeter_datacollector_configurator import configurator, system
+from smartmeter_datacollector_configurator.dto import ConfigDto
+from smartmeter_datacollector_configurator.history import ConfigHistory
+from smartmeter_datacollector_configurator.system import Job, JobRegistry
+
+LOGGER = logging.getLogger("uvicorn.error")
+
+APPLY_JOB = "config-apply"
+
+STEP_DIFF = "diff"
+STEP_WRITE = "write"
+STEP_RESTART = "restart"
+RUNNING = "running"
+DONE = "done"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+
+def trigger_apply(jobs: JobRegistry, config_dir: str, config: ConfigDto, if_match: Optional[str] = None,
+                  history: Optional[ConfigHistory] = None) -> Tuple[Job, bool]:
+    job, created = jobs.submit(APPLY_JOB, functools.partial(apply_config, config_dir, config, if_match=if_match,
+                                                            history=history))
+    if not created:
+        LOGGER.warning("Configuration apply already in progress.")
+    return job, created
+
+
+async def apply_config(config_dir: str, config: ConfigDto, job: Job, if_match: Optional[str] = None,
+                       history: Optional[ConfigHistory] = None) -> Dict[str, Any]:
+    """Writes the configuration and restarts the datacollector, each only if the configuration changed.
+
+    smartmeter-datacollector reads all of its settings at startup only, so any change needs a restart.
+    If if_match is given the configuration is only written if its current ETag matches.
+    """
+    for step in (STEP_DIFF, STEP_WRITE, STEP_RESTART):
+        job.set_step(step, "pending")
+
+    job.set_step(STEP_DIFF, RUNNING)
+    current = await configurator.retrieve_cached_config_async(config_dir)
+    changes = configurator.diff_config(current.dto, config)
+    job.set_step(STEP_DIFF, DONE)
+    result = {"changes": [change.to_dict() for change in changes], "written": False, "restarted": False,
+              "etag": current.etag}
+
+    if not changes:
+        LOGGER.info("Configuration unchanged, nothing to apply.")
+        job.set_step(STEP_WRITE, SKIPPED)
+        job.set_step(STEP_RESTART, SKIPPED)
+        return result
+
+    job.set_step(STEP_WRITE, RUNNING)
+    try:
+        written = await configurator.write_config_from_dto_async(config_dir, config, if_match)
+    except (configurator.ConfigWriteError, configurator.ConfigConflictError) as ex:
+        job.set_step(STEP_WRITE, FAILED, str(ex))
+        job.set_step(STEP_RESTART, SKIPPED)
+        raise
+    job.set_step(STEP_WRITE, DONE)
+    result["written"] = True
+    result["etag"] = written.etag
+    if history:
+        await history.record_async(written)
+    # the partial result is kept if the restart fails
+    job.result = result
+    LOGGER.info("Configuration applied with %d change(s).", len(changes))
+
+    job.set_step(STEP_RESTART, RUNNING)
+    try:
+        await system.restart_datacollector()
+    except (system.NoPermissionError, system.NotInstalledError, system.GeneralSystemError) as ex:
+        job.set_step(STEP_RESTART, FAILED, str(ex))
+        raise
+    job.set_step(STEP_RESTART, DONE)
+    result["restarted"] = True
+    return result
@@ -0,0 +1,92 @@
+import asyncio
+import base64
+import contextlib
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, Iterable, Optional
+from urllib.parse import urlsplit
+
+from starlette.types import ASGIApp, Message
+
+from smartmeter_datacollector_configurator.authentication import AuthManager
+
+
+@dataclass
+class AsgiResponse:
+    status: int
+    headers: Dict[str, str] = field(default_factory=dict)
+    body: bytes = b""
+
+    @property
+    def text(self) -> str:
+        return self.body.decode("utf-8")
+
+
+def basic_auth(password: str = AuthManager.DEFAULT_PASSWORD, username: str = AuthManager.USERNAME) -> Dict[str, str]:
+    encoded = base64.b64encode(f"{username}:{password}".encode("utf-8")).decode("ascii")
+    return {"Authorization": f"Basic {encoded}"}
+
+
+async def request(app: ASGIApp, method: str, url: str, headers: Optional[Dict[str, str]] = None,
+                  body: bytes = b"", chunks: Optional[Iterable[bytes]] = None) -> AsgiResponse:
+    """Send one HTTP request to the ASGI app in-process and collect the complete response."""
+    parts = urlsplit(url)
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": parts.path,
+        "raw_path": parts.path.encode("utf-8"),
+        "root_path": "",
+        "query_string": parts.query.encode("utf-8"),
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in (headers or {}).items()],
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }
+    messages = [{"type": "http.request", "body": chunk, "more_body": True} for chunk in (chunks or [])]
+    messages.append({"type": "http.request", "body": body, "more_body": False})
+    response = AsgiResponse(status=0)
+    finished = asyncio.Event()
+
+    async def receive() -> Message:
+        if messages:
+            return messages.pop(0)
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Message) -> None:
+        if message["type"] == "http.response.start":
+            response.status = message["status"]
+            response.headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in message.get("headers", [])}
+        elif message["type"] == "http.response.body":
+            response.body += message.get("body", b"")
+            if not message.get("more_body", False):
+                finished.set()
+
+    await app(scope, receive, send)
+    finished.set()
+    return response
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: ASGIApp) -> AsyncIterator[None]:
+    """Runs the startup of the ASGI app before and its shutdown after the block."""
+    messages: "asyncio.Queue[Message]" = asyncio.Queue()
+    responses: "asyncio.Queue[Message]" = asyncio.Queue()
+    await messages.put({"type": "lifespan.startup"})
+    task = asyncio.create_task(app({"type": "lifespan", "asgi": {"version": "3.0"}, "state": {}},
+                                   messages.get, responses.put))
+    response = await responses.get()
+    if response["type"] != "lifespan.startup.complete":
+        # the app re-raises the error of its startup after reporting it
+        await asyncio.gather(task, return_exceptions=True)
+        raise RuntimeError(f"Startup of the app failed: {response}")
+    try:
+        yield
+    finally:
+        await messages.put({"type": "lifespan.shutdown"})
+        response = await responses.get()
+        if response["type"] != "lifespan.shutdown.complete":
+            raise RuntimeError(f"Shutdown of the app failed: {response}")
+        await task
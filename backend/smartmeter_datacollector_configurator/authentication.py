@@ -1,11 +1,21 @@
 import base64
 import binascii
+import contextlib
+import hashlib
+import hmac
 import logging
+import os
+import secrets
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
 
 from starlette.authentication import AuthCredentials, AuthenticationBackend, AuthenticationError, SimpleUser
 from starlette.requests import HTTPConnection
 
+from smartmeter_datacollector_configurator import metrics, shared
 from smartmeter_datacollector_configurator.dto import CredentialsDto
+from smartmeter_datacollector_configurator.io_executor import run_hashing, run_io
 
 LOGGER = logging.getLogger("uvicorn.error")
 
@@ -14,44 +24,365 @@ class SetPasswordError(Exception):
     pass
 
 
+class VerifiedCredentialsCache:
+    """Bounded LRU set of digests of recently verified credentials, each valid for ttl seconds."""
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self._entries: "OrderedDict[bytes, Tuple[str, float]]" = OrderedDict()
+        self._max_size = max_size
+        self._ttl = ttl
+
+    def get(self, digest: bytes) -> Optional[str]:
+        entry = self._entries.get(digest)
+        if entry is None:
+            return None
+        username, expires = entry
+        if expires < time.monotonic():
+            self._entries.pop(digest, None)
+            return None
+        self._entries.move_to_end(digest)
+        return username
+
+    def put(self, digest: bytes, username: str) -> None:
+        self._entries[digest] = (username, time.monotonic() + self._ttl)
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+
+class SessionStore:
+    """Signed session tokens with absolute expiry, backed by an in-memory LRU store with idle timeout.
+
+    A token has the form "<session id>.<expiry>.<signature>" where the signature is an
+    HMAC-SHA256 over session id and expiry with a secret known to this process only.
+    """
+
+    def __init__(self, max_sessions: int, lifetime: float, idle_timeout: float) -> None:
+        self._sessions: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._secret = secrets.token_bytes(32)
+        self._max_sessions = max_sessions
+        self._lifetime = lifetime
+        self._idle_timeout = idle_timeout
+
+    @property
+    def lifetime(self) -> float:
+        return self._lifetime
+
+    def create(self, username: str) -> str:
+        session_id = secrets.token_urlsafe(16)
+        expiry = int(time.time() + self._lifetime)
+        self._sessions[session_id] = (username, time.monotonic())
+        while len(self._sessions) > self._max_sessions:
+            self._sessions.popitem(last=False)
+        return f"{session_id}.{expiry}.{self._sign(session_id, expiry)}"
+
+    def validate(self, token: str) -> Optional[str]:
+        """Returns the user of a valid token and refreshes its idle timeout, None otherwise."""
+        session_id = self._verify(token)
+        if session_id is None:
+            return None
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        username, last_seen = session
+        now = time.monotonic()
+        if now - last_seen > self._idle_timeout:
+            self._sessions.pop(session_id, None)
+            return None
+        self._sessions[session_id] = (username, now)
+        self._sessions.move_to_end(session_id)
+        return username
+
+    def revoke(self, token: str) -> None:
+        self._sessions.pop(token.split(".")[0], None)
+
+    def revoke_all(self) -> None:
+        # a new secret invalidates all signatures even of sessions created concurrently
+        self._secret = secrets.token_bytes(32)
+        self._sessions = OrderedDict()
+
+    # The async variants are called on the event loop, stores doing file I/O run them on the I/O threads.
+
+    async def create_async(self, username: str) -> str:
+        return self.create(username)
+
+    async def validate_async(self, token: str) -> Optional[str]:
+        return self.validate(token)
+
+    async def revoke_async(self, token: str) -> None:
+        self.revoke(token)
+
+    def _verify(self, token: str) -> Optional[str]:
+        """Returns the session id of a correctly signed, unexpired token."""
+        try:
+            session_id, expiry, signature = token.split(".")
+            expiry_time = int(expiry)
+        except ValueError:
+            return None
+        expected = self._sign(session_id, expiry_time).encode("ascii")
+        if not hmac.compare_digest(signature.encode("utf-8"), expected) or expiry_time < time.time():
+            return None
+        return session_id
+
+    def _sign(self, session_id: str, expiry: int) -> str:
+        mac = hmac.new(self._secret, f"{session_id}.{expiry}".encode("ascii"), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(mac).decode("ascii").rstrip("=")
+
+
+class SharedSessionStore(SessionStore):
+    """Session store of multiple worker processes, kept in a state directory shared by them.
+
+    The secret is in a file, every session in a file named by its id with the user as content. The modification
+    time of a session file is its last use, it is refreshed at most every TOUCH_INTERVAL seconds.
+    """
+    TOUCH_INTERVAL = 30.0
+
+    def __init__(self, max_sessions: int, lifetime: float, idle_timeout: float, state_dir: str) -> None:
+        super().__init__(max_sessions, lifetime, idle_timeout)
+        self._sessions_dir = f"{state_dir}/sessions"
+        os.makedirs(self._sessions_dir, exist_ok=True)
+        self._secret_path = f"{state_dir}/session.key"
+        self._secret = shared.create_once(self._secret_path, self._secret)
+        self._secret_watch = shared.FileWatch(self._secret_path)
+
+    def create(self, username: str) -> str:
+        self._sync()
+        session_id = secrets.token_urlsafe(16)
+        expiry = int(time.time() + self._lifetime)
+        shared.write_atomically(self._session_path(session_id), username.encode("utf-8"))
+        self._prune()
+        return f"{session_id}.{expiry}.{self._sign(session_id, expiry)}"
+
+    def validate(self, token: str) -> Optional[str]:
+        self._sync()
+        session_id = self._verify(token)
+        if session_id is None:
+            return None
+        path = self._session_path(session_id)
+        try:
+            last_seen = os.stat(path).st_mtime
+            with open(path, "r", encoding="utf-8") as file:
+                username = file.read()
+        except OSError:
+            # revoked, by this or another worker
+            return None
+        now = time.time()
+        if now - last_seen > self._idle_timeout:
+            self._remove(session_id)
+            return None
+        if now - last_seen > self.TOUCH_INTERVAL:
+            with contextlib.suppress(OSError):
+                os.utime(path)
+        return username
+
+    def revoke(self, token: str) -> None:
+        session_id = self._verify(token)
+        if session_id is not None:
+            self._remove(session_id)
+
+    def revoke_all(self) -> None:
+        self._secret = secrets.token_bytes(32)
+        shared.write_atomically(self._secret_path, self._secret)
+        self._secret_watch.reset()
+        for session_id in os.listdir(self._sessions_dir):
+            self._remove(session_id)
+
+    async def create_async(self, username: str) -> str:
+        return await run_io(self.create, username)
+
+    async def validate_async(self, token: str) -> Optional[str]:
+        return await run_io(self.validate, token)
+
+    async def revoke_async(self, token: str) -> None:
+        await run_io(self.revoke, token)
+
+    def _sync(self) -> None:
+        if self._secret_watch.changed():
+            # another worker rotated the secret
+            secret = shared.read_file(self._secret_path)
+            if secret:
+                self._secret = secret
+                self._secret_watch.mark_seen()
+
+    def _session_path(self, session_id: str) -> str:
+        return f"{self._sessions_dir}/{session_id}"
+
+    def _remove(self, session_id: str) -> None:
+        with contextlib.suppress(OSError):
+            os.remove(self._session_path(session_id))
+
+    def _prune(self) -> None:
+        """Removes idle sessions and the least recently used ones exceeding the maximum."""
+        sessions = []
+        for session_id in os.listdir(self._sessions_dir):
+            with contextlib.suppress(OSError):
+                sessions.append((os.stat(self._session_path(session_id)).st_mtime, session_id))
+        sessions.sort(reverse=True)
+        now = time.time()
+        for index, (last_seen, session_id) in enumerate(sessions):
+            if index >= self._max_sessions or now - last_seen > self._idle_timeout:
+                self._remove(session_id)
+
+
 class AuthManager:
     USERNAME = "admin"
     DEFAULT_PASSWORD = "smartmeter"
     PWD_FILE_NAME = "password.txt"
+    # scrypt cost parameters of newly hashed passwords (16 MiB of memory)
+    SCRYPT_N = 2**14
+    SCRYPT_R = 8
+    SCRYPT_P = 1
+    HASH_PREFIX = "scrypt"
+    VERIFIED_CACHE_SIZE = 32
+    VERIFIED_CACHE_TTL = 300.0
+    MAX_SESSIONS = 32
+    SESSION_LIFETIME = 12 * 3600.0
+    SESSION_IDLE_TIMEOUT = 1800.0
+    # seconds between two checks of the password file for changes by other workers or by hand
+    PASSWORD_CHECK_INTERVAL = 1.0
+
+    def __init__(self, config_dir_path: str, state_dir: Optional[str] = None) -> None:
+        """With a state directory the sessions are shared with the other worker processes using it."""
+        self._pwd_path = f"{config_dir_path}/{self.PWD_FILE_NAME}"
+        self._password_hash = self._read_pwd_file(self._pwd_path)
+        # a password changed by another worker (or by hand) is reloaded with the next check
+        self._pwd_watch = shared.FileWatch(self._pwd_path)
+        self._pwd_checked = time.monotonic()
+        self._verified = VerifiedCredentialsCache(self.VERIFIED_CACHE_SIZE, self.VERIFIED_CACHE_TTL)
+        if state_dir:
+            self.sessions: SessionStore = SharedSessionStore(
+                self.MAX_SESSIONS, self.SESSION_LIFETIME, self.SESSION_IDLE_TIMEOUT, state_dir)
+        else:
+            self.sessions = SessionStore(self.MAX_SESSIONS, self.SESSION_LIFETIME, self.SESSION_IDLE_TIMEOUT)
 
-    def __init__(self, config_dir_path: str) -> None:
-        self._password = self._read_pwd_file(f"{config_dir_path}/{self.PWD_FILE_NAME}")
-        self._config_path = config_dir_path
+    def check_credentials(self, username: str, password: str, cache_key: Optional[bytes] = None) -> bool:
+        """Verifies the credentials, successfully verified ones are cached by cache_key.
 
-    def check_credentials(self, username: str, password: str) -> bool:
-        if username == self.USERNAME and password == self._password:
+        The cache key defaults to the digest of username and password.
+        """
+        cache_key = cache_key or self.credentials_digest(f"{username}:{password}")
+        self._reload_changed_password()
+        # take the cache before the hash, a cache replaced by a password change meanwhile is discarded
+        verified = self._verified
+        if verified.get(cache_key) is not None:
+            return True
+        username_valid = hmac.compare_digest(username.encode("utf-8"), self.USERNAME.encode("utf-8"))
+        if self.verify_password(password, self._password_hash) and username_valid:
             LOGGER.debug("User %s successfully authenticated.", username)
+            verified.put(cache_key, username)
             return True
         LOGGER.warning("User %s failed to authenticate.", username)
         return False
 
+    async def check_credentials_async(self, username: str, password: str, cache_key: Optional[bytes] = None) -> bool:
+        # the hash verification takes tens of milliseconds, it must neither block the event loop nor the file I/O
+        return await run_hashing(self.check_credentials, username, password, cache_key)
+
+    def cached_user(self, cache_key: bytes) -> Optional[str]:
+        """Returns the user of recently verified credentials with the cache key or None."""
+        return self._verified.get(cache_key)
+
+    async def reload_changed_password_async(self) -> None:
+        """Reloads the password file if it changed, checked at most every PASSWORD_CHECK_INTERVAL seconds."""
+        now = time.monotonic()
+        if now - self._pwd_checked < self.PASSWORD_CHECK_INTERVAL:
+            return
+        self._pwd_checked = now
+        pwd = await run_io(self._read_changed_password)
+        if pwd is not None:
+            await run_hashing(self._use_password, pwd)
+
     def set_new_credentials(self, new_credentials: CredentialsDto) -> None:
-        self._password = new_credentials.password
-        self._write_pwd_file(self._password, f"{self._config_path}/{self.PWD_FILE_NAME}")
+        password_hash = self.hash_password(new_credentials.password)
+        self._write_pwd_file(password_hash, self._pwd_path)
+        self._pwd_watch.reset()
+        self._password_hash = password_hash
+        self._verified = VerifiedCredentialsCache(self.VERIFIED_CACHE_SIZE, self.VERIFIED_CACHE_TTL)
+        self.sessions.revoke_all()
+
+    async def set_new_credentials_async(self, new_credentials: CredentialsDto) -> None:
+        await run_hashing(self.set_new_credentials, new_credentials)
+
+    def _reload_changed_password(self) -> None:
+        pwd = self._read_changed_password()
+        if pwd is not None:
+            self._use_password(pwd)
+
+    def _read_changed_password(self) -> Optional[str]:
+        if not self._pwd_watch.changed():
+            return None
+        try:
+            with open(self._pwd_path, "r", encoding="utf-8") as file:
+                pwd = file.readline().strip()
+        except OSError as ex:
+            # not marked as seen, retried with the next check
+            LOGGER.warning("Unable to reload password file, keeping the current password. '%s'", ex)
+            return None
+        self._pwd_watch.mark_seen()
+        return pwd
+
+    def _use_password(self, pwd: str) -> None:
+        if not pwd.startswith(f"{self.HASH_PREFIX}$"):
+            pwd = self.hash_password(pwd) if pwd else self._password_hash
+        LOGGER.info("Password file changed, reloading it.")
+        self._password_hash = pwd
+        self._verified = VerifiedCredentialsCache(self.VERIFIED_CACHE_SIZE, self.VERIFIED_CACHE_TTL)
+
+    @staticmethod
+    def credentials_digest(credentials: str) -> bytes:
+        return hashlib.sha256(credentials.encode("utf-8")).digest()
+
+    @classmethod
+    def hash_password(cls, password: str) -> str:
+        salt = os.urandom(16)
+        password_hash = hashlib.scrypt(password.encode("utf-8"), salt=salt,
+                                       n=cls.SCRYPT_N, r=cls.SCRYPT_R, p=cls.SCRYPT_P, dklen=32)
+        return "$".join([cls.HASH_PREFIX, str(cls.SCRYPT_N), str(cls.SCRYPT_R), str(cls.SCRYPT_P),
+                         base64.b64encode(salt).decode("ascii"), base64.b64encode(password_hash).decode("ascii")])
+
+    @classmethod
+    def verify_password(cls, password: str, password_hash: str) -> bool:
+        try:
+            prefix, n, r, p, salt, expected = password_hash.split("$")
+            if prefix != cls.HASH_PREFIX:
+                return False
+            expected_hash = base64.b64decode(expected)
+            actual_hash = hashlib.scrypt(password.encode("utf-8"), salt=base64.b64decode(salt),
+                                         n=int(n), r=int(r), p=int(p), dklen=len(expected_hash),
+                                         maxmem=128 * int(r) * int(n) * 2)
+        except (ValueError, binascii.Error) as ex:
+            LOGGER.error("Invalid password hash. '%s'", ex)
+            return False
+        return hmac.compare_digest(actual_hash, expected_hash)
 
     @staticmethod
     def _read_pwd_file(file_path: str) -> str:
         try:
             with open(file_path, "r", encoding="utf-8") as file:
-                pwd = file.readline()
-                if not pwd.strip():
+                pwd = file.readline().strip()
+                if not pwd:
                     raise ValueError("Password file is empty.")
-                return pwd
         except (OSError, ValueError) as ex:
             LOGGER.warning("Unable to read password file. '%s' \n\tGenerating new file with default password.", ex)
-            AuthManager._write_pwd_file(AuthManager.DEFAULT_PASSWORD, file_path)
-            return AuthManager.DEFAULT_PASSWORD
+            password_hash = AuthManager.hash_password(AuthManager.DEFAULT_PASSWORD)
+            AuthManager._write_pwd_file(password_hash, file_path)
+            return password_hash
+
+        if pwd.startswith(f"{AuthManager.HASH_PREFIX}$"):
+            return pwd
+        LOGGER.info("Migrating plaintext password file to a password hash.")
+        password_hash = AuthManager.hash_password(pwd)
+        try:
+            AuthManager._write_pwd_file(password_hash, file_path)
+        except SetPasswordError:
+            LOGGER.warning("Keeping plaintext password file, it is hashed in memory only.")
+        return password_hash
 
     @staticmethod
-    def _write_pwd_file(password: str, file_path: str) -> None:
+    def _write_pwd_file(password_hash: str, file_path: str) -> None:
         try:
-            with open(file_path, "w", encoding="utf-8") as file:
-                file.write(password.strip())
+            # replaced atomically, other workers never read a partially written file
+            shared.write_atomically(file_path, password_hash.strip().encode("utf-8"))
         except OSError as ex:
             LOGGER.error("Unable to write password file. '%s'", ex)
             raise SetPasswordError(ex) from ex
@@ -64,6 +395,13 @@ class BasicAuthBackend(AuthenticationBackend):
             return
 
         auth = conn.headers["Authorization"]
+        auth_manager: AuthManager = conn.app.state.auth_manager
+        await auth_manager.reload_changed_password_async()
+        digest = AuthManager.credentials_digest(auth)
+        username = auth_manager.cached_user(digest)
+        if username is not None:
+            return AuthCredentials(["authenticated"]), SimpleUser(username)
+
         try:
             scheme, credentials = auth.split()
             if scheme.lower() != "basic":
@@ -73,8 +411,36 @@ class BasicAuthBackend(AuthenticationBackend):
             raise AuthenticationError('Invalid credentials.') from ex
 
         username, _, password = decoded_credentials.partition(":")
-        auth_manager: AuthManager = conn.app.state.auth_manager
-
-        if auth_manager.check_credentials(username, password):
+        if await auth_manager.check_credentials_async(username, password, digest):
             return AuthCredentials(["authenticated"]), SimpleUser(username)
         return None
+
+
+class SessionAuthBackend(BasicAuthBackend):
+    """Authenticates session tokens ("Bearer" scheme), falls back to HTTP Basic for scripts."""
+    # pylint: disable=too-few-public-methods
+
+    async def authenticate(self, conn: HTTPConnection):
+        auth = conn.headers.get("Authorization", "")
+        scheme, _, token = auth.partition(" ")
+        scheme = scheme.lower()
+        if scheme != "bearer":
+            try:
+                result = await super().authenticate(conn)
+            except AuthenticationError:
+                metrics.AUTH_ATTEMPTS.inc(_scheme_label(scheme), "failure")
+                raise
+            if auth:
+                metrics.AUTH_ATTEMPTS.inc(_scheme_label(scheme), "success" if result else "failure")
+            return result
+
+        auth_manager: AuthManager = conn.app.state.auth_manager
+        username = await auth_manager.sessions.validate_async(token.strip())
+        metrics.AUTH_ATTEMPTS.inc("bearer", "failure" if username is None else "success")
+        if username is None:
+            return None
+        return AuthCredentials(["authenticated", "session"]), SimpleUser(username)
+
+
+def _scheme_label(scheme: str) -> str:
+    return scheme if scheme in ("basic", "bearer") else "other"
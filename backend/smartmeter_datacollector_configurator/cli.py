@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+
+# Only the standard library is imported here, the web app and its dependencies are loaded by uvicorn.
+
+# The parsed arguments are handed to the app factory (also in the reloader process) through this variable.
+ARGS_ENV = "SMARTMETER_CONFIGURATOR_ARGS"
+
+
+def parse_arguments(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Smart Meter Data Collector Configurator Backend", add_help=True)
+    parser.add_argument(
+        '-c', '--config', help="Directory path where config files should be deployed.", default=".")
+    parser.add_argument(
+        '-s', '--static', help="Director path with the static files.", default="")
+    parser.add_argument(
+        '--host', help="Host IP, default: 127.0.0.1", default="127.0.0.1")
+    parser.add_argument(
+        '--port', help="Port, default: 8000", type=int, default=8000)
+    parser.add_argument(
+        '--serial-dir', help="Directory with the serial device links, default: /dev/serial/by-id", default=None)
+    parser.add_argument(
+        '-d', '--dev', help="Development mode: debug log, reloading", action='store_true')
+    parser.add_argument(
+        '--workers', help="Number of worker processes, default: 1 (a single one in development mode)", type=int,
+        default=1)
+    parser.add_argument(
+        '--service-manager', help="Backend controlling the services: auto (D-Bus if available, otherwise "
+        "systemctl), dbus, systemctl or fake (in memory, without systemd), default: auto",
+        choices=["auto", "dbus", "systemctl", "fake"], default="auto")
+    parser.add_argument(
+        '--status-interval', help="Seconds between two queries of the service status, default: 10", type=float,
+        default=10.0)
+    parser.add_argument(
+        '--journal-command', help="Command printing the datacollector's journal as JSON lines and following it, "
+        "default: journalctl for the smartmeter-datacollector unit", default=None)
+    parser.add_argument(
+        '--profile-requests', help="Capture slow requests, profile sampled ones and detect a blocked event loop",
+        action='store_true')
+    parser.add_argument(
+        '--slow-request-ms', help="Requests taking longer are captured, default: 500", type=int, default=500)
+    parser.add_argument(
+        '--profile-sample-rate', help="Share of the requests profiled, default: 0.1", type=float, default=0.1)
+    parser.add_argument(
+        '--loop-block-ms', help="Event loop blocking longer is captured, default: 200", type=int, default=200)
+    parser.add_argument(
+        '--profile-startup', help="Report the timing of the startup phases and imports, then exit",
+        action='store_true')
+    # directory of the state shared by the worker processes, created by main()
+    parser.set_defaults(state_dir=None)
+    return parser.parse_args(argv)
+
+
+def load_arguments() -> argparse.Namespace:
+    """Returns the arguments parsed by main() or parses the command line if started otherwise."""
+    handed_over = os.environ.get(ARGS_ENV)
+    if handed_over:
+        return argparse.Namespace(**json.loads(handed_over))
+    return parse_arguments()
+
+
+def main():
+    args = parse_arguments()
+    if args.profile_startup:
+        # pylint: disable=import-outside-toplevel
+        from smartmeter_datacollector_configurator.startup import print_startup_profile
+        print_startup_profile(args)
+        return
+
+    debug_mode = bool(args.dev)
+    logger_level = "debug" if args.dev else "info"
+    # reloading supports a single worker only
+    workers = 1 if debug_mode else max(args.workers, 1)
+    if workers > 1:
+        # in memory if available, the shared state is rewritten with every job progress
+        args.state_dir = tempfile.mkdtemp(prefix="smartmeter-configurator-",
+                                          dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    os.environ[ARGS_ENV] = json.dumps(vars(args))
+
+    import uvicorn  # pylint: disable=import-outside-toplevel
+    try:
+        uvicorn.run("smartmeter_datacollector_configurator.app:web_app",
+                    host=args.host,
+                    port=args.port,
+                    log_level=logger_level,
+                    reload=debug_mode,
+                    workers=workers,
+                    factory=True)
+    finally:
+        if args.state_dir:
+            shutil.rmtree(args.state_dir, ignore_errors=True)
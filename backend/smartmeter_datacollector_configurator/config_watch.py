@@ -0,0 +1,69 @@
+import configparser
+import logging
+from typing import AsyncIterator, Optional
+
+from smartmeter_datacollector_configurator import configurator
+from smartmeter_datacollector_configurator.events import Event, EventBroadcaster, TooManySubscribersError
+from smartmeter_datacollector_configurator.io_executor import run_io
+from smartmeter_datacollector_configurator.watcher import CoalescedRefresh, DirectoryWatcher
+
+LOGGER = logging.getLogger("uvicorn.error")
+
+# Clients notified of configuration changes at the same time.
+MAX_SUBSCRIBERS = 32
+# Changes are collected this long, an editor saving a file touches it several times.
+DEBOUNCE = 0.5
+
+
+class ConfigWatch:
+    """Watches the configuration directory and publishes a "changed" event with the new ETag.
+
+    Changes made through the API, by another worker or by hand are noticed alike.
+    The configuration is parsed once per change, the ETag is None while it cannot be read.
+    """
+
+    def __init__(self, config_dir: str, max_subscribers: int = MAX_SUBSCRIBERS, debounce: float = DEBOUNCE,
+                 use_inotify: bool = True, poll_interval: float = 2.0) -> None:
+        self.config_dir = config_dir
+        self.etag: Optional[str] = None
+        # only the latest change matters to a client
+        self.events = EventBroadcaster(max_queue_size=4, max_subscribers=max_subscribers)
+        self._refresh = CoalescedRefresh(self._refresh_etag)
+        self._watcher = DirectoryWatcher(config_dir, self._refresh.schedule, debounce=debounce,
+                                         use_inotify=use_inotify, poll_interval=poll_interval)
+
+    async def start(self) -> None:
+        self.etag = await run_io(self._read_etag)
+        self._watcher.start()
+
+    def stop(self) -> None:
+        self._watcher.stop()
+        self.events.close()
+
+    async def refresh(self) -> None:
+        await self._refresh()
+
+    async def stream(self) -> AsyncIterator[Event]:
+        """Yields "current" with the ETag at subscription time, then a "changed" event per change."""
+        try:
+            with self.events.subscribe() as changes:
+                yield "current", {"etag": self.etag}
+                while (change := await changes.get()) is not None:
+                    yield change
+        except TooManySubscribersError:
+            # lost the race for the last free place after the endpoint checked it, the client reconnects
+            LOGGER.debug("Configuration event stream rejected, too many subscribers.")
+
+    async def _refresh_etag(self) -> None:
+        etag = await run_io(self._read_etag)
+        if etag != self.etag:
+            LOGGER.info("Configuration changed on disk, ETag %s.", etag)
+            self.etag = etag
+            self.events.publish("changed", {"etag": etag})
+
+    def _read_etag(self) -> Optional[str]:
+        try:
+            return configurator.retrieve_cached_config(self.config_dir).etag
+        except (configparser.Error, ValueError, OSError) as ex:
+            LOGGER.warning("Unable to read the changed configuration. '%s'", ex)
+            return None
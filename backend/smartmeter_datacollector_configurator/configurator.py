@@ -1,7 +1,19 @@
 import configparser
+import contextlib
+import hashlib
+import io
+import json
 import logging
+import os
+import shutil
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Type, Union
 
+from smartmeter_datacollector_configurator import metrics, shared
 from smartmeter_datacollector_configurator.dto import ConfigDto, LoggerSinkDto, MeterDto, MqttSinkDto, SinkType
+from smartmeter_datacollector_configurator.io_executor import run_io
 
 CA_FILE_NAME = "ca.crt"
 CONFIG_FILE_NAME = "datacollector.ini"
@@ -13,7 +25,149 @@ class ConfigWriteError(Exception):
     pass
 
 
+class ConfigSectionNotFoundError(Exception):
+    pass
+
+
+class ConfigConflictError(Exception):
+    """The configuration does not match the expected ETag (anymore)."""
+
+    def __init__(self, etag: str) -> None:
+        super().__init__(f"Configuration has been changed meanwhile, current ETag {etag}.")
+        self.etag = etag
+
+
+FileSignature = Optional[Tuple[str, int, int, int]]
+CacheKey = Tuple[FileSignature, FileSignature]
+SinkDto = Union[MqttSinkDto, LoggerSinkDto]
+
+# Sink kinds of the section API with the sink types and DTO stored in a section of that kind.
+SINK_KINDS: Dict[str, Tuple[Tuple[str, ...], Type[SinkDto]]] = {
+    "mqtt": ((SinkType.MQTT.value, SinkType.MQTT_RLDSP.value), MqttSinkDto),
+    "logger": ((SinkType.LOGGER.value,), LoggerSinkDto),
+}
+
+
+@dataclass(frozen=True)
+class CachedConfig:
+    """Validated configuration together with its encoded API representation."""
+    key: CacheKey
+    dto: ConfigDto
+    body: bytes
+    etag: str
+
+
+@dataclass(frozen=True)
+class ConfigChange:
+    """Changed key of a section of the canonical configuration, None for absent values."""
+    section: str
+    key: str
+    old: Any
+    new: Any
+
+    def to_dict(self) -> Dict[str, Any]:
+        # secrets are not revealed, only whether they are set
+        if self.key in SECRET_KEYS:
+            return {"section": self.section, "key": self.key,
+                    "old": None if self.old is None else "***", "new": None if self.new is None else "***"}
+        return {"section": self.section, "key": self.key, "old": self.old, "new": self.new}
+
+
+SECRET_KEYS = {"password", "key"}
+
+_CONFIG_CACHE: Dict[str, CachedConfig] = {}
+# Writes run on the I/O thread pool and must not interleave.
+_WRITE_LOCK = threading.Lock()
+# Lock files serializing the writes with other worker processes, by config directory.
+_PROCESS_LOCKS: Dict[str, str] = {}
+
+
 def retrieve_config(config_dir: str) -> ConfigDto:
+    return retrieve_cached_config(config_dir).dto.copy(deep=True)
+
+
+def retrieve_cached_config(config_dir: str) -> CachedConfig:
+    """Return the configuration of config_dir, parsing the files only if they changed on disk.
+
+    While a write is in progress the last written configuration is returned.
+    The returned entry is shared and must not be modified.
+    """
+    cached = _CONFIG_CACHE.get(config_dir)
+    if cached and _WRITE_LOCK.locked():
+        metrics.CONFIG_CACHE.inc("hit")
+        return cached
+    return _refresh_cache(config_dir)
+
+
+def _refresh_cache(config_dir: str, locked: bool = False) -> CachedConfig:
+    """Parses the files if they changed, locked tells whether the caller holds the write lock."""
+    key = _cache_key(config_dir)
+    cached = _CONFIG_CACHE.get(config_dir)
+    if cached and cached.key == key:
+        metrics.CONFIG_CACHE.inc("hit")
+        return cached
+
+    lock_path = _PROCESS_LOCKS.get(config_dir)
+    if lock_path and not locked:
+        # another worker may be replacing the files, wait until it replaced both
+        with shared.file_lock(lock_path, shared=True):
+            return _refresh_cache(config_dir, locked=True)
+
+    metrics.CONFIG_CACHE.inc("miss")
+    start = time.perf_counter()
+    cached = _build_cache_entry(key, _parse_config(config_dir))
+    metrics.CONFIG_READ_DURATION.observe(time.perf_counter() - start)
+    metrics.CONFIG_READ_BYTES.inc(amount=sum(signature[2] for signature in key if signature))
+    _CONFIG_CACHE[config_dir] = cached
+    return cached
+
+
+async def retrieve_cached_config_async(config_dir: str) -> CachedConfig:
+    return await run_io(retrieve_cached_config, config_dir)
+
+
+def etag_matches(if_match: Optional[str], etag: str) -> bool:
+    """Whether one of the ETags of an If-Match / If-None-Match header matches, weak ones included."""
+    if not if_match:
+        return False
+    for candidate in if_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def config_etag(config: ConfigDto) -> str:
+    return _encode_config(config)[1]
+
+
+def share_between_processes(config_dir: str, lock_path: str) -> None:
+    """Serializes the writes of config_dir with other processes through the lock file.
+
+    The cache needs no coordination, it is checked against the file signatures on every access.
+    """
+    _PROCESS_LOCKS[config_dir] = lock_path
+
+
+@contextlib.contextmanager
+def _write_locked(config_dir: str) -> Iterator[None]:
+    with _WRITE_LOCK:
+        lock_path = _PROCESS_LOCKS.get(config_dir)
+        if lock_path is None:
+            yield
+            return
+        with shared.file_lock(lock_path):
+            yield
+
+
+def invalidate_config_cache(config_dir: Optional[str] = None) -> None:
+    if config_dir is None:
+        _CONFIG_CACHE.clear()
+    else:
+        _CONFIG_CACHE.pop(config_dir, None)
+
+
+def _parse_config(config_dir: str) -> ConfigDto:
     parser = _read_config_file(f"{config_dir}/{CONFIG_FILE_NAME}")
     dto = ConfigDto()
     for sec in parser.sections():
@@ -40,40 +194,245 @@ def retrieve_config(config_dir: str) -> ConfigDto:
     return dto
 
 
-def write_config_from_dto(config_dir: str, config: ConfigDto) -> None:
+async def write_config_from_dto_async(config_dir: str, config: ConfigDto,
+                                      if_match: Optional[str] = None) -> CachedConfig:
+    return await run_io(write_config_from_dto, config_dir, config, if_match)
+
+
+def write_config_from_dto(config_dir: str, config: ConfigDto, if_match: Optional[str] = None) -> CachedConfig:
+    """Writes the configuration, if if_match is given only if it matches the ETag of the current configuration."""
+    with _write_locked(config_dir):
+        _check_if_match(config_dir, if_match)
+        return _write_config_from_dto(config_dir, config)
+
+
+def _write_config_from_dto(config_dir: str, config: ConfigDto) -> CachedConfig:
+    _write_files(config_dir, *render_config(config_dir, config))
+    cached = _build_cache_entry(_cache_key(config_dir), config.copy(deep=True))
+    _CONFIG_CACHE[config_dir] = cached
+    return cached
+
+
+def render_config(config_dir: str, config: ConfigDto) -> Tuple[str, Optional[str]]:
+    """Returns the content of the INI file and of the CA file (None if there is none) for the configuration."""
     parser = configparser.ConfigParser()
     for i, meter in enumerate(config.meters):
         sec_name = f"reader{i}"
         parser.add_section(sec_name)
         parser[sec_name] = meter.dict(exclude_none=True)
+    ca_cert = None
     sinks = (config.mqtt_sink, config.logger_sink)
     for i, sink in enumerate(sinks):
         if not sink:
             continue
         sec_name = f"sink{i}"
         parser.add_section(sec_name)
-        sec_dict = sink.dict(exclude={"ca_cert"}, exclude_none=True)
-        parser[sec_name] = sec_dict
-
-        # Handle CA certificate file
-        if isinstance(sink, MqttSinkDto) and sink.ca_cert:
-            try:
-                _write_txt_file(f"{config_dir}/{CA_FILE_NAME}", sink.ca_cert)
-            except OSError as ex:
-                LOGGER.error("Unable to write ca certificate file. '%s'", ex)
-                raise ConfigWriteError(ex) from ex
-            parser[sec_name]["ca_file_path"] = f"{config_dir}/{CA_FILE_NAME}"
+        ca_cert = _set_sink_section(parser, sec_name, sink, config_dir) or ca_cert
 
     parser.add_section("logging")
     parser["logging"] = {
         "default": config.log_level
     }
+    return _render_parser(parser), ca_cert
+
+
+def replace_config(config_dir: str, ini: str, ca_cert: Optional[str], config: ConfigDto,
+                   if_match: Optional[str] = None) -> CachedConfig:
+    """Replaces the files by already rendered contents of the validated configuration, see render_config."""
+    with _write_locked(config_dir):
+        _check_if_match(config_dir, if_match)
+        _write_files(config_dir, ini, ca_cert)
+        cached = _build_cache_entry(_cache_key(config_dir), config)
+        _CONFIG_CACHE[config_dir] = cached
+        return cached
+
+
+def read_written_files(config_dir: str, cached: CachedConfig) -> Optional[Tuple[str, Optional[str]]]:
+    """Returns the contents of the INI and CA file as written for cached, None if they have been replaced since."""
+    with _write_locked(config_dir):
+        if _cache_key(config_dir) != cached.key:
+            return None
+        ini = _read_txt_file(f"{config_dir}/{CONFIG_FILE_NAME}")
+        uses_ca = cached.dto.mqtt_sink is not None and cached.dto.mqtt_sink.ca_cert
+        ca_cert = _read_txt_file(f"{config_dir}/{CA_FILE_NAME}") if uses_ca else None
+        return ini, ca_cert
+
+
+def update_meter(config_dir: str, index: int, meter: Optional[MeterDto],
+                 if_match: Optional[str] = None) -> CachedConfig:
+    """Replaces the meter at index, deletes it if meter is None. Index equal to the number of meters appends."""
+    def mutate(parser: configparser.ConfigParser, config: ConfigDto) -> None:
+        sections = _meter_sections(parser)
+        if meter is not None and index == len(sections):
+            section = _free_section_name(parser, "reader")
+            parser.add_section(section)
+            config.meters.append(meter)
+        else:
+            section = _meter_section(sections, index)
+            if meter is None:
+                parser.remove_section(section)
+                del config.meters[index]
+                return
+            config.meters[index] = meter
+        parser[section] = meter.dict(exclude_none=True)
+
+    return _update_sections(config_dir, mutate, if_match)
+
+
+def patch_meter(config_dir: str, index: int, changes: Dict[str, Any], if_match: Optional[str] = None) -> CachedConfig:
+    """Applies the changed fields to the meter at index, only the resulting meter is validated."""
+    def mutate(parser: configparser.ConfigParser, config: ConfigDto) -> None:
+        section = _meter_section(_meter_sections(parser), index)
+        meter = MeterDto.parse_obj({**config.meters[index].dict(), **changes})
+        config.meters[index] = meter
+        parser[section] = meter.dict(exclude_none=True)
+
+    return _update_sections(config_dir, mutate, if_match)
 
+
+def update_sink(config_dir: str, kind: str, sink: Optional[SinkDto], if_match: Optional[str] = None) -> CachedConfig:
+    """Replaces or adds the sink of the kind ("mqtt", "logger"), deletes it if sink is None."""
+    def mutate(parser: configparser.ConfigParser, config: ConfigDto) -> Optional[str]:
+        section = _sink_section(parser, kind)
+        if sink is None:
+            if section is None:
+                raise ConfigSectionNotFoundError(f"No {kind} sink configured.")
+            parser.remove_section(section)
+            setattr(config, f"{kind}_sink", None)
+            return None
+        if section is None:
+            section = _free_section_name(parser, "sink")
+            parser.add_section(section)
+        setattr(config, f"{kind}_sink", sink)
+        return _set_sink_section(parser, section, sink, config_dir)
+
+    return _update_sections(config_dir, mutate, if_match)
+
+
+def patch_sink(config_dir: str, kind: str, changes: Dict[str, Any], if_match: Optional[str] = None) -> CachedConfig:
+    """Applies the changed fields to the configured sink of the kind, only the resulting sink is validated."""
+    def mutate(parser: configparser.ConfigParser, config: ConfigDto) -> Optional[str]:
+        section = _sink_section(parser, kind)
+        current: Optional[SinkDto] = getattr(config, f"{kind}_sink")
+        if section is None or current is None:
+            raise ConfigSectionNotFoundError(f"No {kind} sink configured.")
+        sink = SINK_KINDS[kind][1].parse_obj({**current.dict(), **changes})
+        setattr(config, f"{kind}_sink", sink)
+        return _set_sink_section(parser, section, sink, config_dir)
+
+    return _update_sections(config_dir, mutate, if_match)
+
+
+def canonical_config(config: ConfigDto) -> Dict[str, Dict[str, Any]]:
+    """Section-wise representation of the configuration independent of the INI formatting.
+
+    Values are typed by the DTOs, the CA certificate is represented by its hash.
+    """
+    sections: Dict[str, Dict[str, Any]] = {"logging": {"level": config.log_level}}
+    for i, meter in enumerate(config.meters):
+        sections[f"meters[{i}]"] = meter.dict(exclude_none=True)
+    if config.mqtt_sink:
+        sections["mqtt_sink"] = config.mqtt_sink.dict(exclude={"ca_cert"}, exclude_none=True)
+        if config.mqtt_sink.ca_cert:
+            ca_cert = "\n".join(line.rstrip() for line in config.mqtt_sink.ca_cert.strip().splitlines())
+            sections["mqtt_sink"]["ca_cert_sha256"] = hashlib.sha256(ca_cert.encode("utf-8")).hexdigest()
+    if config.logger_sink:
+        sections["logger_sink"] = config.logger_sink.dict(exclude_none=True)
+    return sections
+
+
+def diff_config(current: ConfigDto, new: ConfigDto) -> List[ConfigChange]:
+    current_sections, new_sections = canonical_config(current), canonical_config(new)
+    changes = []
+    for section in list(current_sections) + [sec for sec in new_sections if sec not in current_sections]:
+        old_values, new_values = current_sections.get(section, {}), new_sections.get(section, {})
+        for key in list(old_values) + [key for key in new_values if key not in old_values]:
+            if old_values.get(key) != new_values.get(key):
+                changes.append(ConfigChange(section, key, old_values.get(key), new_values.get(key)))
+    return changes
+
+
+def _update_sections(config_dir: str, mutate: Callable[[configparser.ConfigParser, ConfigDto], Optional[str]],
+                     if_match: Optional[str] = None) -> CachedConfig:
+    """Rewrites only the sections changed by mutate, which returns the CA certificate to store if any.
+
+    Unknown sections are preserved and files with unchanged content are not written.
+    """
+    with _write_locked(config_dir):
+        config = _check_if_match(config_dir, if_match).dto.copy(deep=True)
+        parser = _read_config_file(f"{config_dir}/{CONFIG_FILE_NAME}")
+        ca_cert = mutate(parser, config)
+        _write_files(config_dir, _render_parser(parser), ca_cert)
+
+        cached = _build_cache_entry(_cache_key(config_dir), config)
+        _CONFIG_CACHE[config_dir] = cached
+        return cached
+
+
+def _check_if_match(config_dir: str, if_match: Optional[str]) -> CachedConfig:
+    current = _refresh_cache(config_dir, locked=True)
+    if if_match is not None and not etag_matches(if_match, current.etag):
+        raise ConfigConflictError(current.etag)
+    return current
+
+
+def _meter_sections(parser: configparser.ConfigParser) -> List[str]:
+    return [sec for sec in parser.sections() if sec.startswith("reader")]
+
+
+def _meter_section(sections: List[str], index: int) -> str:
+    if not 0 <= index < len(sections):
+        raise ConfigSectionNotFoundError(f"No meter with index {index}.")
+    return sections[index]
+
+
+def _sink_section(parser: configparser.ConfigParser, kind: str) -> Optional[str]:
+    # like _parse_config the last section of a kind is the effective one
+    sink_types = SINK_KINDS[kind][0]
+    sections = [sec for sec in parser.sections()
+                if sec.startswith("sink") and parser.get(sec, "type", fallback=None) in sink_types]
+    return sections[-1] if sections else None
+
+
+def _free_section_name(parser: configparser.ConfigParser, prefix: str) -> str:
+    i = 0
+    while parser.has_section(f"{prefix}{i}"):
+        i += 1
+    return f"{prefix}{i}"
+
+
+def _set_sink_section(parser: configparser.ConfigParser, section: str, sink: SinkDto,
+                      config_dir: str) -> Optional[str]:
+    parser[section] = sink.dict(exclude={"ca_cert"}, exclude_none=True)
+    if isinstance(sink, MqttSinkDto) and sink.ca_cert:
+        parser[section]["ca_file_path"] = f"{config_dir}/{CA_FILE_NAME}"
+        return sink.ca_cert
+    return None
+
+
+def _cache_key(config_dir: str) -> CacheKey:
+    return (
+        _file_signature(f"{config_dir}/{CONFIG_FILE_NAME}"),
+        _file_signature(f"{config_dir}/{CA_FILE_NAME}")
+    )
+
+
+def _file_signature(file_path: str) -> FileSignature:
     try:
-        _write_config_file(f"{config_dir}/{CONFIG_FILE_NAME}", parser)
-    except OSError as ex:
-        LOGGER.error("Unable to write config to file. '%s'", ex)
-        raise ConfigWriteError(ex) from ex
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return (file_path, stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def _build_cache_entry(key: CacheKey, dto: ConfigDto) -> CachedConfig:
+    return CachedConfig(key, dto, *_encode_config(dto))
+
+
+def _encode_config(dto: ConfigDto) -> Tuple[bytes, str]:
+    # The API delivers the JSON document of the config as JSON string.
+    body = json.dumps(dto.json(), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return body, f'"{hashlib.sha256(body).hexdigest()[:32]}"'
 
 
 def _read_config_file(file_path: str) -> configparser.ConfigParser:
@@ -86,16 +445,101 @@ def _read_config_file(file_path: str) -> configparser.ConfigParser:
     return parser
 
 
-def _write_config_file(file_path: str, config: configparser.ConfigParser) -> None:
-    with open(file_path, 'w', encoding="utf-8") as file:
-        config.write(file, True)
+def _render_parser(parser: configparser.ConfigParser) -> str:
+    content = io.StringIO()
+    parser.write(content, True)
+    return content.getvalue()
+
+
+def _write_files(config_dir: str, ini: str, ca_cert: Optional[str]) -> None:
+    """Writes the changed files of a configuration as one transaction.
+
+    The new contents are staged in temporary files which then replace the CA file and the INI (in this order,
+    the INI refers to the CA file). If replacing the INI fails, the previous CA file is moved back. A failure
+    never leaves a truncated or half written configuration behind, only a crash between the two replacements
+    leaves the new CA file next to the old INI.
+    """
+    config_path = f"{config_dir}/{CONFIG_FILE_NAME}"
+    ca_path = f"{config_dir}/{CA_FILE_NAME}"
+    staged: List[Tuple[str, str]] = []
+    # replaced files with the backup of their previous content, None if there was none
+    replaced: List[Tuple[str, Optional[str]]] = []
+    start = time.perf_counter()
+    written = 0
+    try:
+        if ca_cert and _file_differs(ca_path, ca_cert):
+            staged.append((_stage_file(ca_path, ca_cert), ca_path))
+            written += len(ca_cert.encode("utf-8"))
+        if _file_differs(config_path, ini):
+            staged.append((_stage_file(config_path, ini), config_path))
+            written += len(ini.encode("utf-8"))
+        for temp_path, file_path in staged:
+            with contextlib.suppress(OSError):
+                shutil.copymode(file_path, temp_path)
+            backup = _link_backup(file_path)
+            try:
+                os.replace(temp_path, file_path)
+            except OSError:
+                if backup:
+                    with contextlib.suppress(OSError):
+                        os.remove(backup)
+                raise
+            replaced.append((file_path, backup))
+        if staged:
+            metrics.CONFIG_WRITE_DURATION.observe(time.perf_counter() - start)
+            metrics.CONFIG_WRITE_BYTES.inc(amount=written)
+        staged = []
+    except OSError as ex:
+        LOGGER.error("Unable to write config to file. '%s'", ex)
+        _restore_backups(replaced)
+        invalidate_config_cache(config_dir)
+        raise ConfigWriteError(ex) from ex
+    finally:
+        for temp_path, _ in staged:
+            with contextlib.suppress(OSError):
+                os.remove(temp_path)
+        for _, backup in replaced:
+            if backup:
+                with contextlib.suppress(OSError):
+                    os.remove(backup)
+
+
+def _link_backup(file_path: str) -> Optional[str]:
+    """Keeps the current content of the file under a second name (a hard link, nothing is copied)."""
+    backup = f"{file_path}.{os.getpid()}.bak"
+    with contextlib.suppress(FileNotFoundError):
+        # left behind by a crash
+        os.remove(backup)
+    try:
+        os.link(file_path, backup)
+    except FileNotFoundError:
+        return None
+    return backup
+
+
+def _restore_backups(replaced: List[Tuple[str, Optional[str]]]) -> None:
+    for file_path, backup in reversed(replaced):
+        try:
+            if backup:
+                os.replace(backup, file_path)
+            else:
+                os.remove(file_path)
+        except OSError as ex:
+            LOGGER.error("Unable to restore %s. '%s'", file_path, ex)
+
+
+def _stage_file(file_path: str, content: str) -> str:
+    # created with the permissions a plain open() would give, an existing file's mode is copied over afterwards
+    return shared.stage_file(file_path, content.encode("utf-8"), mode=0o666)
+
+
+def _file_differs(file_path: str, content: str) -> bool:
+    try:
+        return _read_txt_file(file_path) != content
+    except (OSError, UnicodeDecodeError):
+        return True
 
 
 def _read_txt_file(file_path: str) -> str:
     with open(file_path, 'r', encoding="utf-8") as file:
         return file.read()
-
-
-def _write_txt_file(file_path: str, content: str) -> None:
-    with open(file_path, 'w', encoding="utf-8") as file:
-        file.write(content)
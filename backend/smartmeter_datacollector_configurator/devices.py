@@ -0,0 +1,128 @@
+import logging
+import os
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from smartmeter_datacollector_configurator.events import EventBroadcaster
+from smartmeter_datacollector_configurator.io_executor import run_io
+from smartmeter_datacollector_configurator.watcher import CoalescedRefresh, DirectoryWatcher
+
+LOGGER = logging.getLogger("uvicorn.error")
+
+SERIAL_BY_ID_DIR = "/dev/serial/by-id"
+SYSFS_TTY_DIR = "/sys/class/tty"
+
+# USB device attributes read from sysfs, mapped to SerialDevice fields.
+_USB_ATTRIBUTES = {
+    "idVendor": "vendor_id",
+    "idProduct": "product_id",
+    "manufacturer": "manufacturer",
+    "product": "product",
+    "serial": "serial",
+}
+# Levels searched upwards from the tty device for the USB device directory.
+_MAX_SYSFS_DEPTH = 6
+# Clients following the plugged devices at the same time.
+MAX_SUBSCRIBERS = 32
+
+
+@dataclass(frozen=True)
+class SerialDevice:
+    path: str
+    target: Optional[str] = None
+    vendor_id: Optional[str] = None
+    product_id: Optional[str] = None
+    manufacturer: Optional[str] = None
+    product: Optional[str] = None
+    serial: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class SerialDeviceIndex:
+    """In-memory index of the serial devices in /dev/serial/by-id kept current by a directory watcher.
+
+    The sysfs attributes of a device are read once when it appears.
+    Plugged and unplugged devices are published as "added" and "removed" events.
+    """
+
+    def __init__(self, by_id_dir: str = SERIAL_BY_ID_DIR, sysfs_dir: str = SYSFS_TTY_DIR,
+                 use_inotify: bool = True, poll_interval: float = 2.0, max_subscribers: int = MAX_SUBSCRIBERS) -> None:
+        self.by_id_dir = by_id_dir
+        self.sysfs_dir = sysfs_dir
+        self.events = EventBroadcaster(max_subscribers=max_subscribers)
+        self._devices: Dict[str, SerialDevice] = {}
+        self._refresh = CoalescedRefresh(self._refresh_devices)
+        self._watcher = DirectoryWatcher(by_id_dir, self._refresh.schedule, use_inotify=use_inotify,
+                                         poll_interval=poll_interval)
+
+    def paths(self) -> List[str]:
+        return sorted(self._devices)
+
+    def devices(self) -> List[SerialDevice]:
+        return [self._devices[path] for path in self.paths()]
+
+    async def start(self) -> None:
+        await self.refresh()
+        self._watcher.start()
+
+    def stop(self) -> None:
+        self._watcher.stop()
+
+    async def refresh(self) -> None:
+        await self._refresh()
+
+    async def _refresh_devices(self) -> None:
+        added, removed = await run_io(self._scan, dict(self._devices))
+        for path in removed:
+            LOGGER.info("Serial device %s removed.", path)
+            del self._devices[path]
+            self.events.publish("removed", {"path": path})
+        for device in added:
+            LOGGER.info("Serial device %s added.", device.path)
+            self._devices[device.path] = device
+            self.events.publish("added", device.to_dict())
+
+    def _scan(self, known: Dict[str, SerialDevice]) -> Tuple[List[SerialDevice], List[str]]:
+        try:
+            paths = {entry.path for entry in os.scandir(self.by_id_dir)}
+        except OSError:
+            paths = set()
+
+        added = []
+        for path in sorted(paths):
+            target = os.path.realpath(path)
+            if path in known and known[path].target == target:
+                continue
+            if path in known:
+                # the same by-id link now points to another tty, it has been re-plugged
+                paths.discard(path)
+            added.append(SerialDevice(path, target, **self._read_usb_attributes(os.path.basename(target))))
+        removed = [path for path in known if path not in paths]
+        return added, removed
+
+    def _read_usb_attributes(self, tty_name: str) -> Dict[str, str]:
+        try:
+            device_dir = os.path.realpath(os.path.join(self.sysfs_dir, tty_name, "device"))
+        except OSError:
+            return {}
+        for _ in range(_MAX_SYSFS_DEPTH):
+            if os.path.isfile(os.path.join(device_dir, "idVendor")):
+                return {
+                    field: value for attribute, field in _USB_ATTRIBUTES.items()
+                    if (value := _read_attribute(os.path.join(device_dir, attribute))) is not None
+                }
+            parent = os.path.dirname(device_dir)
+            if parent == device_dir:
+                break
+            device_dir = parent
+        return {}
+
+
+def _read_attribute(file_path: str) -> Optional[str]:
+    try:
+        with open(file_path, "r", encoding="utf-8") as file:
+            return file.read().strip()
+    except (OSError, UnicodeDecodeError):
+        return None
@@ -119,3 +119,36 @@ class CredentialsDto(BaseModel):
         if len(pwd) < 8 or len(pwd) > 30:
             raise ValueError("Invalid password length.")
         return pwd
+
+
+class ProbeRequestDto(BaseModel):
+    ports: Optional[List[str]] = None
+    budget: Optional[float] = None
+
+    @validator("budget")
+    @classmethod
+    def budget_valid_range(cls, val: Optional[float]):
+        if val is not None and (val <= 0 or val > 60):
+            raise ValueError(f"Invalid probe budget {val}.")
+        return val
+
+
+class ProfilingSettingsDto(BaseModel):
+    enabled: bool
+    sample_rate: float = 0.1
+    slow_request_ms: int = 500
+    loop_block_ms: int = 200
+
+    @validator("sample_rate")
+    @classmethod
+    def sample_rate_valid_range(cls, val: float):
+        if val < 0 or val > 1:
+            raise ValueError(f"Invalid sample rate {val}.")
+        return val
+
+    @validator("slow_request_ms", "loop_block_ms")
+    @classmethod
+    def threshold_positive(cls, val: int):
+        if val <= 0:
+            raise ValueError("Thresholds must be positive.")
+        return val
@@ -0,0 +1,91 @@
+import asyncio
+import contextlib
+import json
+from typing import Any, AsyncIterator, Iterator, Optional, Set, Tuple
+
+from starlette.responses import StreamingResponse
+
+Event = Tuple[str, Any]
+
+# Sent as SSE comment to keep idle connections open through proxies.
+KEEP_ALIVE_INTERVAL = 15.0
+
+
+class TooManySubscribersError(Exception):
+    pass
+
+
+class EventBroadcaster:
+    """Fans out published events to all subscribers, each with its own bounded queue."""
+
+    def __init__(self, max_queue_size: int = 100, max_subscribers: Optional[int] = None) -> None:
+        self._subscribers: Set["asyncio.Queue[Optional[Event]]"] = set()
+        self._max_queue_size = max_queue_size
+        self._max_subscribers = max_subscribers
+        self._closed = False
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    @property
+    def full(self) -> bool:
+        return self._max_subscribers is not None and len(self._subscribers) >= self._max_subscribers
+
+    def publish(self, event: str, data: Any) -> None:
+        for queue in self._subscribers:
+            if queue.full():
+                # a slow subscriber loses its oldest event rather than blocking the publisher
+                queue.get_nowait()
+            queue.put_nowait((event, data))
+
+    def close(self) -> None:
+        """Ends the event stream of all current and future subscribers."""
+        self._closed = True
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+    @contextlib.contextmanager
+    def subscribe(self) -> Iterator["asyncio.Queue[Optional[Event]]"]:
+        if self.full:
+            raise TooManySubscribersError(f"Limit of {self._max_subscribers} subscribers reached.")
+        queue: "asyncio.Queue[Optional[Event]]" = asyncio.Queue(maxsize=self._max_queue_size)
+        if self._closed:
+            queue.put_nowait(None)
+        self._subscribers.add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers.discard(queue)
+
+
+def format_sse(event: str, data: Any) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode("utf-8")
+
+
+def sse_response(events: AsyncIterator[Event]) -> StreamingResponse:
+    return StreamingResponse(
+        _encode_events(events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def _encode_events(events: AsyncIterator[Event]) -> AsyncIterator[bytes]:
+    iterator = aiter(events)
+    next_event = asyncio.ensure_future(anext(iterator))
+    try:
+        while True:
+            done, _ = await asyncio.wait({next_event}, timeout=KEEP_ALIVE_INTERVAL)
+            if not done:
+                yield b": keep-alive\n\n"
+                continue
+            try:
+                event, data = next_event.result()
+            except StopAsyncIteration:
+                return
+            yield format_sse(event, data)
+            next_event = asyncio.ensure_future(anext(iterator))
+    finally:
+        next_event.cancel()
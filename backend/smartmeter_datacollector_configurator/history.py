@@ -0,0 +1,190 @@
+import contextlib
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from smartmeter_datacollector_configurator import configurator, shared
+from smartmeter_datacollector_configurator.configurator import CachedConfig
+from smartmeter_datacollector_configurator.dto import ConfigDto, LoggerSinkDto, MeterDto, MqttSinkDto
+from smartmeter_datacollector_configurator.io_executor import run_io
+
+LOGGER = logging.getLogger("uvicorn.error")
+
+HISTORY_DIR_NAME = ".history"
+INDEX_FILE_NAME = "index.json"
+OBJECTS_DIR_NAME = "objects"
+# Number of history entries kept, older ones and the snapshots only they refer to are removed.
+MAX_ENTRIES = 50
+
+SOURCE_WRITE = "write"
+SOURCE_ROLLBACK = "rollback"
+
+
+class SnapshotNotFoundError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class HistoryEntry:
+    """A configuration written at a point in time, the snapshot id is the hash of its content."""
+    snapshot: str
+    created: float
+    etag: str
+    source: str
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class ConfigHistory:
+    """Content-addressed history of the written configurations of a config directory.
+
+    Each snapshot is stored once as gzip compressed JSON named by its SHA-256, containing the validated
+    configuration and its INI file as written, including the sections the configurator does not know.
+    CA certificates are stored as objects of their own, so a certificate used by many snapshots is kept only once.
+    The index lists the entries in order of time.
+    """
+
+    def __init__(self, config_dir: str, max_entries: int = MAX_ENTRIES, lock_path: Optional[str] = None) -> None:
+        """The lock file serializes the index updates with other worker processes."""
+        self._config_dir = config_dir
+        self._history_dir = os.path.join(config_dir, HISTORY_DIR_NAME)
+        self._objects_dir = os.path.join(self._history_dir, OBJECTS_DIR_NAME)
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._lock_path = lock_path
+
+    def entries(self) -> List[HistoryEntry]:
+        """Returns the entries, the latest first."""
+        with self._locked():
+            return list(reversed(self._read_index()))
+
+    async def record_async(self, cached: CachedConfig, source: str = SOURCE_WRITE) -> None:
+        """Records the written configuration, a failure is logged only as the configuration is written anyway."""
+        await run_io(self._record_logged, cached, source)
+
+    def record(self, cached: CachedConfig, source: str = SOURCE_WRITE) -> Optional[HistoryEntry]:
+        """Stores the written files of the configuration unless it is the latest entry already.
+
+        Returns None if the files have been replaced meanwhile, the write replacing them is recorded itself.
+        """
+        written = configurator.read_written_files(self._config_dir, cached)
+        if written is None:
+            LOGGER.debug("Configuration replaced before it was recorded in history.")
+            return None
+        ini, ca_cert = written
+        config = cached.dto.dict()
+        if config["mqtt_sink"]:
+            config["mqtt_sink"]["ca_cert"] = None
+
+        with self._locked():
+            ca_ref = self._store_object(ca_cert.encode("utf-8")) if ca_cert else None
+            snapshot = self._store_object(_encode_json({"config": config, "ca_cert": ca_ref, "ini": ini}))
+            index = self._read_index()
+            if index and index[-1].snapshot == snapshot:
+                return index[-1]
+            entry = HistoryEntry(snapshot, time.time(), cached.etag, source)
+            index.append(entry)
+            removed = index[:-self._max_entries]
+            index = index[-self._max_entries:]
+            self._write_index(index)
+            if removed:
+                self._prune(index)
+        LOGGER.debug("Configuration %s recorded in history.", snapshot[:12])
+        return entry
+
+    def load(self, snapshot: str) -> ConfigDto:
+        return self._load(snapshot)[0]
+
+    def rollback(self, snapshot: str, if_match: Optional[str] = None) -> CachedConfig:
+        """Restores the snapshot by swapping in its stored files, it is neither parsed nor validated again."""
+        config, ini, ca_cert = self._load(snapshot)
+        cached = configurator.replace_config(self._config_dir, ini, ca_cert, config, if_match)
+        # the files are swapped already, the rollback succeeded even if it cannot be recorded
+        self._record_logged(cached, SOURCE_ROLLBACK)
+        LOGGER.info("Configuration rolled back to %s.", snapshot[:12])
+        return cached
+
+    def _record_logged(self, cached: CachedConfig, source: str) -> None:
+        try:
+            self.record(cached, source)
+        except OSError as ex:
+            LOGGER.warning("Unable to record configuration history. '%s'", ex)
+
+    def _load(self, snapshot: str) -> Tuple[ConfigDto, str, Optional[str]]:
+        with self._locked():
+            if snapshot not in {entry.snapshot for entry in self._read_index()}:
+                raise SnapshotNotFoundError(f"Configuration snapshot '{snapshot}' not found.")
+            data = json.loads(self._read_object(snapshot))
+            ca_cert = self._read_object(data["ca_cert"]).decode("utf-8") if data["ca_cert"] else None
+        return _construct_config(data["config"], ca_cert), data["ini"], ca_cert
+
+    @contextlib.contextmanager
+    def _locked(self) -> Iterator[None]:
+        with self._lock:
+            if self._lock_path is None:
+                yield
+                return
+            with shared.file_lock(self._lock_path):
+                yield
+
+    def _store_object(self, content: bytes) -> str:
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(self._objects_dir, mode=0o700, exist_ok=True)
+            shared.write_atomically(path, gzip.compress(content, mtime=0))
+        return digest
+
+    def _read_object(self, digest: str) -> bytes:
+        with open(self._object_path(digest), "rb") as file:
+            return gzip.decompress(file.read())
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self._objects_dir, f"{digest}.gz")
+
+    def _read_index(self) -> List[HistoryEntry]:
+        try:
+            with open(os.path.join(self._history_dir, INDEX_FILE_NAME), "r", encoding="utf-8") as file:
+                return [HistoryEntry(**entry) for entry in json.load(file)]
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError, TypeError) as ex:
+            LOGGER.warning("Unable to read configuration history index. '%s'", ex)
+            return []
+
+    def _write_index(self, index: List[HistoryEntry]) -> None:
+        shared.write_atomically(os.path.join(self._history_dir, INDEX_FILE_NAME),
+                                _encode_json([entry.to_dict() for entry in index]))
+
+    def _prune(self, index: List[HistoryEntry]) -> None:
+        referenced = set()
+        for snapshot in {entry.snapshot for entry in index}:
+            referenced.add(snapshot)
+            with contextlib.suppress(OSError, ValueError):
+                ca_ref = json.loads(self._read_object(snapshot))["ca_cert"]
+                if ca_ref:
+                    referenced.add(ca_ref)
+        for name in os.listdir(self._objects_dir):
+            if name.removesuffix(".gz") not in referenced:
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(self._objects_dir, name))
+
+
+def _construct_config(data: Dict[str, Any], ca_cert: Optional[str]) -> ConfigDto:
+    # the snapshot has been validated when it was written, its values are taken as they are
+    mqtt_sink = MqttSinkDto.construct(**{**data["mqtt_sink"], "ca_cert": ca_cert}) if data["mqtt_sink"] else None
+    logger_sink = LoggerSinkDto.construct(**data["logger_sink"]) if data["logger_sink"] else None
+    return ConfigDto.construct(log_level=data["log_level"],
+                               meters=[MeterDto.construct(**meter) for meter in data["meters"]],
+                               mqtt_sink=mqtt_sink, logger_sink=logger_sink)
+
+
+def _encode_json(data: Any) -> bytes:
+    return json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")
@@ -0,0 +1,42 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+# File I/O mostly targets a single SD card, more threads would only queue up in the kernel.
+IO_WORKERS = 2
+# Password hashing (scrypt, 16 MiB each) gets a thread of its own, failed logins must not delay the file I/O.
+HASH_WORKERS = 1
+
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_executor_lock = threading.Lock()
+
+
+def _get_executor(name: str, max_workers: int) -> ThreadPoolExecutor:
+    with _executor_lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        return _executors[name]
+
+
+async def run_io(func: Callable[..., T], *args, **kwargs) -> T:
+    """Run the blocking function func on the bounded I/O thread pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor("file-io", IO_WORKERS), functools.partial(func, *args, **kwargs))
+
+
+async def run_hashing(func: Callable[..., T], *args, **kwargs) -> T:
+    """Run the password hashing function func on its own thread, concurrent calls queue up there."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor("hashing", HASH_WORKERS), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_io_executor() -> None:
+    with _executor_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=True)
@@ -0,0 +1,186 @@
+import asyncio
+import collections
+import contextlib
+import json
+import logging
+import time
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional, Set
+
+from smartmeter_datacollector_configurator import metrics
+from smartmeter_datacollector_configurator.events import Event
+
+LOGGER = logging.getLogger("uvicorn.error")
+
+# Recent and live entries of the datacollector's journal as JSON lines.
+JOURNAL_COMMAND = ["journalctl", "--unit", "smartmeter-datacollector", "--follow", "--lines", "100", "--output",
+                   "json", "--no-pager"]
+# Number of recent lines sent to a new subscriber.
+BACKLOG_LINES = 100
+# Lines queued per subscriber, further lines are dropped until it caught up.
+SUBSCRIBER_QUEUE_SIZE = 256
+
+# syslog priorities
+LEVELS = {"emerg": 0, "alert": 1, "crit": 2, "err": 3, "warning": 4, "notice": 5, "info": 6, "debug": 7}
+DEFAULT_PRIORITY = LEVELS["info"]
+
+
+class JournalSubscription:
+    """Bounded queue of the lines of a subscriber with priority up to max_priority.
+
+    Lines arriving while the queue is full are dropped and replaced by a single "dropped" event.
+    """
+
+    def __init__(self, max_priority: int, queue_size: int) -> None:
+        self.max_priority = max_priority
+        self.queue: "asyncio.Queue[Optional[Event]]" = asyncio.Queue()
+        self.dropped = 0
+        self._queue_size = queue_size
+
+    def offer(self, line: Dict[str, Any]) -> None:
+        if line["priority"] > self.max_priority:
+            return
+        if self.queue.qsize() >= self._queue_size:
+            # a slow client loses lines instead of buffering them without bound
+            self.dropped += 1
+            metrics.JOURNAL_LINES_DROPPED.inc()
+            return
+        self._report_dropped()
+        self.queue.put_nowait(("line", line))
+
+    def close(self, event: Event) -> None:
+        # delivered even to a full queue
+        self._report_dropped()
+        self.queue.put_nowait(event)
+        self.queue.put_nowait(None)
+
+    def _report_dropped(self) -> None:
+        if self.dropped:
+            self.queue.put_nowait(("dropped", {"count": self.dropped}))
+            self.dropped = 0
+
+
+class JournalTail:
+    """Follows the journal with a single reader process shared by all subscribers.
+
+    The reader is started with the first subscriber and stopped when the last one has left.
+    Every subscriber gets the recent lines first, then the live ones. A subscriber joining a running reader gets
+    the recent lines from its backlog, otherwise from the new reader.
+    """
+
+    def __init__(self, command: Optional[List[str]] = None, backlog: int = BACKLOG_LINES,
+                 queue_size: int = SUBSCRIBER_QUEUE_SIZE) -> None:
+        self.command = list(command or JOURNAL_COMMAND)
+        self._backlog: Deque[Dict[str, Any]] = collections.deque(maxlen=backlog)
+        self._queue_size = queue_size
+        self._subscriptions: Set[JournalSubscription] = set()
+        self._reader: Optional[asyncio.Task] = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscriptions)
+
+    @property
+    def backlog(self) -> List[Dict[str, Any]]:
+        return list(self._backlog)
+
+    @contextlib.contextmanager
+    def subscribe(self, max_priority: int = DEFAULT_PRIORITY) -> Iterator[JournalSubscription]:
+        subscription = JournalSubscription(max_priority, self._queue_size)
+        if self._reader is None or self._reader.done():
+            # a new reader sends the recent lines itself (journalctl --lines)
+            self._backlog.clear()
+            self._reader = asyncio.create_task(self._read(), name="journal-reader")
+        else:
+            for line in self._backlog:
+                subscription.offer(line)
+        self._subscriptions.add(subscription)
+        try:
+            yield subscription
+        finally:
+            self._subscriptions.discard(subscription)
+            if not self._subscriptions and self._reader is not None:
+                self._reader.cancel()
+                self._reader = None
+
+    async def stream(self, max_priority: int = DEFAULT_PRIORITY) -> AsyncIterator[Event]:
+        """Yields "line" events, "dropped" with the number of lines lost at its place and "end" if the reader ended."""
+        with self.subscribe(max_priority) as subscription:
+            while (event := await subscription.queue.get()) is not None:
+                yield event
+
+    async def _read(self) -> None:
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *self.command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL)
+        except OSError as ex:
+            LOGGER.warning("Unable to read the journal. '%s'", ex)
+            self._close({"error": str(ex)})
+            return
+        try:
+            while (line := await _read_line(proc.stdout)) is not None:
+                entry = parse_line(line.decode(errors="replace"))
+                self._backlog.append(entry)
+                for subscription in self._subscriptions:
+                    subscription.offer(entry)
+            end: Dict[str, Any] = {"exit_code": await proc.wait()}
+        except Exception as ex:  # pylint: disable=broad-except
+            # the subscribers must not wait for lines which will never come
+            LOGGER.warning("Reading the journal failed. '%s'", ex)
+            end = {"error": str(ex) or type(ex).__name__}
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+        # not reached if cancelled, the reader is cancelled only after the last subscriber has left
+        self._close(end)
+
+    def _close(self, data: Dict[str, Any]) -> None:
+        for subscription in self._subscriptions:
+            subscription.close(("end", data))
+
+
+async def _read_line(stream: asyncio.StreamReader) -> Optional[bytes]:
+    """Returns the next line, None at the end of the stream. Lines longer than the stream's limit are skipped."""
+    skipping = False
+    while True:
+        try:
+            line = await stream.readuntil(b"\n")
+        except asyncio.IncompleteReadError as ex:
+            # the last line without line break
+            return None if skipping or not ex.partial else ex.partial
+        except asyncio.LimitOverrunError as ex:
+            # the data stays in the buffer, it is dropped until the line break
+            await stream.readexactly(ex.consumed)
+            if not skipping:
+                LOGGER.warning("Skipped a journal line longer than the limit of the stream.")
+            skipping = True
+            continue
+        if not skipping:
+            return line
+        skipping = False
+
+
+def parse_line(raw: str) -> Dict[str, Any]:
+    """Parses a journal entry in JSON output format, any other line is taken as info message."""
+    raw = raw.rstrip("\n")
+    try:
+        entry = json.loads(raw)
+        if not isinstance(entry, dict):
+            raise ValueError("not an entry")
+    except ValueError:
+        return {"time": time.time(), "priority": DEFAULT_PRIORITY, "message": raw}
+    message = entry.get("MESSAGE", "")
+    if isinstance(message, list):
+        # messages with binary content are given as byte array
+        message = bytes(message).decode(errors="replace")
+    try:
+        timestamp = int(entry["__REALTIME_TIMESTAMP"]) / 1e6
+    except (KeyError, TypeError, ValueError):
+        timestamp = time.time()
+    try:
+        priority = int(entry.get("PRIORITY", DEFAULT_PRIORITY))
+    except (TypeError, ValueError):
+        priority = DEFAULT_PRIORITY
+    return {"time": timestamp, "priority": priority, "message": message}
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+from typing import Collection, Optional
+
+from starlette.datastructures import Headers
+from starlette.responses import PlainTextResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+LOGGER = logging.getLogger("uvicorn.error")
+
+# Upper limits of the request bodies in bytes, far above what the frontend sends.
+JSON_BODY_LIMIT = 128 * 1024
+CREDENTIALS_BODY_LIMIT = 1024
+# Seconds a client has to send the complete request body.
+READ_TIMEOUT = 10.0
+
+
+class BodyRejectedError(Exception):
+    def __init__(self, status_code: int, detail: str) -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class BodyLimitMiddleware:
+    """Bounds the request body of the wrapped routes without buffering it.
+
+    A Content-Type other than one of content_types is rejected with 415 and a Content-Length above max_size with
+    413 before the body is read. A request without Content-Type is accepted. While the endpoint reads the body it is
+    counted, 413 is answered as soon as it exceeds max_size and 408 if it is not complete within read_timeout.
+    """
+
+    def __init__(self, app: ASGIApp, max_size: int, content_types: Optional[Collection[str]] = None,
+                 read_timeout: float = READ_TIMEOUT) -> None:
+        self.app = app
+        self.max_size = max_size
+        self.content_types = content_types
+        self.read_timeout = read_timeout
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            self._check_headers(Headers(scope=scope))
+        except BodyRejectedError as ex:
+            await self._reject(ex, scope, receive, send)
+            return
+
+        received = 0
+        more_body = True
+        deadline: Optional[float] = None
+        response_started = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, more_body, deadline
+            if not more_body:
+                # the endpoint waits for the disconnect, not for the body
+                return await receive()
+            loop = asyncio.get_running_loop()
+            if deadline is None:
+                deadline = loop.time() + self.read_timeout
+            try:
+                message = await asyncio.wait_for(receive(), max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError as ex:
+                raise BodyRejectedError(408, "Request body not received in time.") from ex
+            if message["type"] != "http.request":
+                more_body = False
+                return message
+            received += len(message.get("body", b""))
+            more_body = message.get("more_body", False)
+            if received > self.max_size:
+                raise BodyRejectedError(413, f"Request body exceeds {self.max_size} bytes.")
+            return message
+
+        async def send_with_state(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, send_with_state)
+        except BodyRejectedError as ex:
+            if response_started:
+                raise
+            await self._reject(ex, scope, receive, send)
+
+    def _check_headers(self, headers: Headers) -> None:
+        content_type = headers.get("content-type")
+        if content_type is not None and self.content_types is not None:
+            media_type = content_type.partition(";")[0].strip().lower()
+            if media_type not in self.content_types:
+                raise BodyRejectedError(415, f"Content-Type must be one of {', '.join(self.content_types)}.")
+        content_length = headers.get("content-length")
+        if content_length is not None:
+            try:
+                length = int(content_length)
+            except ValueError as ex:
+                raise BodyRejectedError(400, "Invalid Content-Length.") from ex
+            if length > self.max_size:
+                raise BodyRejectedError(413, f"Request body exceeds {self.max_size} bytes.")
+
+    @staticmethod
+    async def _reject(ex: BodyRejectedError, scope: Scope, receive: Receive, send: Send) -> None:
+        LOGGER.warning("Request %s %s rejected. '%s'", scope["method"], scope["path"], ex.detail)
+        # the rest of the body is not read, the connection can not be reused
+        response = PlainTextResponse(ex.detail, status_code=ex.status_code, headers={"Connection": "close"})
+        await response(scope, receive, send)
@@ -0,0 +1,279 @@
+"""In-process load generator driving the configurator ASGI app without network.
+
+    python -m smartmeter_datacollector_configurator.loadtest --concurrency 12 --duration 10 \\
+        --mix config=4,config_not_modified=2,ttydevices=3,static=3 [--fs-delay 0.02] [--fake-systemctl 0.5]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import math
+import os
+import random
+import stat
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from starlette.applications import Starlette
+
+from smartmeter_datacollector_configurator import configurator, services, system
+from smartmeter_datacollector_configurator.app import build_app
+from smartmeter_datacollector_configurator.asgi_client import lifespan, request
+from smartmeter_datacollector_configurator.authentication import AuthManager
+from smartmeter_datacollector_configurator.dto import ConfigDto, LoggerSinkDto, MeterDto
+
+
+@dataclass(frozen=True)
+class RouteSpec:
+    method: str
+    path: str
+    authenticated: bool = True
+    conditional: bool = False
+
+
+ROUTES: Dict[str, RouteSpec] = {
+    "config": RouteSpec("GET", "/api/config"),
+    "config_not_modified": RouteSpec("GET", "/api/config", conditional=True),
+    "ttydevices": RouteSpec("GET", "/api/ttydevices", authenticated=False),
+    "static": RouteSpec("GET", "/", authenticated=False),
+    "restart": RouteSpec("POST", "/api/restart"),
+}
+DEFAULT_MIX = "config=4,config_not_modified=2,ttydevices=3,static=3"
+# Interval in seconds of the probe measuring how late the event loop runs a scheduled wake-up.
+LAG_PROBE_INTERVAL = 0.01
+# Functions of the configurator touching the filesystem, delayed by --fs-delay.
+FILESYSTEM_FUNCTIONS = ("_file_signature", "_read_config_file", "_stage_file", "_read_txt_file")
+
+
+@dataclass
+class RouteStats:
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+
+
+@dataclass
+class LoadReport:
+    duration: float
+    concurrency: int
+    routes: Dict[str, RouteStats]
+    loop_lag: List[float]
+
+    @property
+    def requests(self) -> int:
+        return sum(len(stats.latencies) for stats in self.routes.values())
+
+    def to_dict(self) -> Dict:
+        return {
+            "duration": self.duration,
+            "concurrency": self.concurrency,
+            "requests": self.requests,
+            "throughput": self.requests / self.duration if self.duration else 0.0,
+            "routes": {name: {
+                "requests": len(stats.latencies),
+                "errors": stats.errors,
+                "throughput": len(stats.latencies) / self.duration if self.duration else 0.0,
+                **latency_summary(stats.latencies),
+            } for name, stats in self.routes.items()},
+            "loop_lag": latency_summary(self.loop_lag),
+        }
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile, 0.0 for no values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def latency_summary(values: List[float]) -> Dict[str, float]:
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values, default=0.0),
+    }
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.strip().partition("=")
+        if name not in ROUTES:
+            raise ValueError(f"Unknown route '{name}', must be one of {', '.join(ROUTES)}.")
+        weights[name] = int(weight or 1)
+    if not any(weights.values()):
+        raise ValueError("The request mix must contain at least one route with a positive weight.")
+    return weights
+
+
+@contextlib.contextmanager
+def slow_filesystem(delay: float) -> Iterator[None]:
+    """Delays every filesystem access of the configurator module, like a slow SD card would."""
+    originals = {name: getattr(configurator, name) for name in FILESYSTEM_FUNCTIONS}
+
+    def delayed(func: Callable) -> Callable:
+        def wrapper(*args, **kwargs):
+            time.sleep(delay)
+            return func(*args, **kwargs)
+        return wrapper
+
+    for name, func in originals.items():
+        setattr(configurator, name, delayed(func))
+    try:
+        yield
+    finally:
+        for name, func in originals.items():
+            setattr(configurator, name, func)
+
+
+@contextlib.contextmanager
+def fake_systemctl(work_dir: str, delay: float) -> Iterator[None]:
+    """Replaces systemctl by a script which succeeds after the delay."""
+    script = os.path.join(work_dir, "systemctl")
+    with open(script, "w", encoding="utf-8") as file:
+        file.write(f"#!/bin/sh\nsleep {delay}\nexit 0\n")
+    os.chmod(script, os.stat(script).st_mode | stat.S_IXUSR)
+    original = services.SYSCTL_BIN
+    services.SYSCTL_BIN = script
+    try:
+        yield
+    finally:
+        services.SYSCTL_BIN = original
+
+
+@contextlib.contextmanager
+def fake_services(delay: float) -> Iterator[None]:
+    """Replaces systemd by in-memory services, every operation takes the delay."""
+    installed = [system.DATACOL_SERVICE, *system.DEMO_SERVICES]
+    original = system.set_service_manager(services.FakeServiceManager(installed, latency=delay))
+    try:
+        yield
+    finally:
+        system.set_service_manager(original)
+
+
+def prepare_work_dir(work_dir: str, meters: int) -> Tuple[str, str, str]:
+    """Creates a config, static and serial directory with a sample configuration."""
+    config_dir = os.path.join(work_dir, "config")
+    static_dir = os.path.join(work_dir, "static")
+    serial_dir = os.path.join(work_dir, "serial")
+    for directory in (config_dir, static_dir, serial_dir):
+        os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(static_dir, "index.html"), "w", encoding="utf-8") as file:
+        file.write("<!DOCTYPE html><html><body><div id=\"app\"></div></body></html>")
+    config = ConfigDto(meters=[MeterDto(type="lge450", port=f"/dev/ttyUSB{i}") for i in range(meters)],
+                       logger_sink=LoggerSinkDto())
+    configurator.write_config_from_dto(config_dir, config)
+    return config_dir, static_dir, serial_dir
+
+
+async def _measure_loop_lag(lags: List[float], stop: asyncio.Event) -> None:
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + LAG_PROBE_INTERVAL
+        await asyncio.sleep(LAG_PROBE_INTERVAL)
+        lags.append(max(0.0, loop.time() - expected))
+
+
+async def _client(app: Starlette, routes: List[str], weights: List[int], headers: Dict[str, Dict[str, str]],
+                  stats: Dict[str, RouteStats], deadline: float, rng: random.Random) -> None:
+    while time.monotonic() < deadline:
+        name = rng.choices(routes, weights)[0]
+        spec = ROUTES[name]
+        start = time.perf_counter()
+        response = await request(app, spec.method, spec.path, headers=headers[name])
+        stats[name].latencies.append(time.perf_counter() - start)
+        if response.status >= 400:
+            stats[name].errors += 1
+
+
+def _route_headers(app: Starlette, config_dir: str, names: List[str]) -> Dict[str, Dict[str, str]]:
+    token = app.state.auth_manager.sessions.create(AuthManager.USERNAME)
+    headers = {}
+    for name in names:
+        spec = ROUTES[name]
+        headers[name] = {"Accept-Encoding": "gzip, br"}
+        if spec.authenticated:
+            headers[name]["Authorization"] = f"Bearer {token}"
+        if spec.conditional:
+            headers[name]["If-None-Match"] = configurator.retrieve_cached_config(config_dir).etag
+    return headers
+
+
+async def run_load(app: Starlette, config_dir: str, mix: Dict[str, int], concurrency: int, duration: float,
+                   seed: Optional[int] = None) -> LoadReport:
+    """Runs concurrent clients against the app for the duration, each sending requests of the weighted mix."""
+    routes = [name for name, weight in mix.items() if weight > 0]
+    weights = [mix[name] for name in routes]
+    stats = {name: RouteStats() for name in routes}
+    lags: List[float] = []
+    rng = random.Random(seed)
+
+    async with lifespan(app):
+        headers = _route_headers(app, config_dir, routes)
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(_measure_loop_lag(lags, stop))
+        start = time.monotonic()
+        deadline = start + duration
+        await asyncio.gather(*(_client(app, routes, weights, headers, stats, deadline,
+                                       random.Random(rng.random())) for _ in range(concurrency)))
+        elapsed = time.monotonic() - start
+        stop.set()
+        await lag_task
+    return LoadReport(elapsed, concurrency, stats, lags)
+
+
+def format_report(report: LoadReport) -> str:
+    data = report.to_dict()
+    lines = [f"{data['requests']} requests in {data['duration']:.1f} s with {data['concurrency']} clients,"
+             f" {data['throughput']:.1f} req/s",
+             f"{'route':<22} {'req/s':>8} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"]
+    rows = list(data["routes"].items()) + [("event loop lag", {**data["loop_lag"], "throughput": 0, "errors": 0})]
+    for name, route in rows:
+        lines.append(f"{name:<22} {route['throughput']:8.1f} {route['errors']:7d} {route['p50'] * 1000:8.2f}"
+                     f" {route['p95'] * 1000:8.2f} {route['p99'] * 1000:8.2f} {route['max'] * 1000:8.2f}")
+    return "\n".join(lines)
+
+
+def parse_arguments(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="In-process load test of the configurator web app")
+    parser.add_argument('-n', '--concurrency', type=int, default=12, help="Concurrent clients, default: 12")
+    parser.add_argument('-t', '--duration', type=float, default=10.0, help="Duration in seconds, default: 10")
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help=f"Weighted request mix of {', '.join(ROUTES)}, default: {DEFAULT_MIX}")
+    parser.add_argument('--meters', type=int, default=3, help="Meters of the sample configuration, default: 3")
+    parser.add_argument('--fs-delay', type=float, default=0.0,
+                        help="Seconds added to every configuration file access, default: 0")
+    parser.add_argument('--fake-systemctl', type=float, metavar="SECONDS", default=None,
+                        help="Replace systemctl by a fake taking the given seconds")
+    parser.add_argument('--fake-services', type=float, metavar="SECONDS", default=None,
+                        help="Replace systemd by in-memory services whose operations take the given seconds")
+    parser.add_argument('--seed', type=int, default=None, help="Seed of the random request mix")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> None:
+    args = parse_arguments(argv)
+    mix = parse_mix(args.mix)
+    logging.getLogger("uvicorn.error").setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory(prefix="configurator-load-") as work_dir, contextlib.ExitStack() as stack:
+        config_dir, static_dir, serial_dir = prepare_work_dir(work_dir, args.meters)
+        if args.fs_delay > 0:
+            stack.enter_context(slow_filesystem(args.fs_delay))
+        if args.fake_systemctl is not None:
+            stack.enter_context(fake_systemctl(work_dir, args.fake_systemctl))
+        if args.fake_services is not None:
+            stack.enter_context(fake_services(args.fake_services))
+        app = build_app(config_dir, static_dir, serial_dir=serial_dir)
+        report = asyncio.run(run_load(app, config_dir, mix, args.concurrency, args.duration, args.seed))
+    print(json.dumps(report.to_dict(), indent=2) if args.json else format_report(report))
+
+
+if __name__ == '__main__':
+    main()
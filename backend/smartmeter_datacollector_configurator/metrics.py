@@ -0,0 +1,249 @@
+"""Counters and histograms exposed in the Prometheus text format.
+
+Updates take no lock: every thread counts into its own shard which only it writes to, the shards are summed
+up when the metrics are collected.
+"""
+import bisect
+import threading
+import time
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+from starlette.routing import BaseRoute, Mount, Route
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+Labels = Tuple[str, ...]
+
+# Upper bounds in seconds of the latency histograms.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Methods labelled as they are, any other is labelled "other".
+HTTP_METHODS = frozenset(("GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"))
+
+
+class _ShardedValues:
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._shards: List[Dict] = []
+        self._register_lock = threading.Lock()
+
+    def shard(self) -> Dict:
+        try:
+            return self._local.values
+        except AttributeError:
+            values: Dict = {}
+            self._local.values = values
+            # only taken once per thread
+            with self._register_lock:
+                self._shards.append(values)
+            return values
+
+    def snapshots(self) -> List[Dict]:
+        with self._register_lock:
+            shards = list(self._shards)
+        # copying a dict is atomic, the owning thread may keep counting meanwhile
+        return [shard.copy() for shard in shards]
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = _ShardedValues()
+
+    def _check(self, labels: Labels) -> Labels:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects the labels {', '.join(self.labelnames)}.")
+        return tuple(str(label) for label in labels)
+
+    def expose(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+
+    def _label_text(self, labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = list(zip(self.labelnames, labels)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        key = self._check(labels)
+        shard = self._values.shard()
+        shard[key] = shard.get(key, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        key = self._check(labels)
+        return sum(shard.get(key, 0) for shard in self._values.snapshots())
+
+    def collect(self) -> Dict[Labels, float]:
+        totals: Dict[Labels, float] = {}
+        for shard in self._values.snapshots():
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def expose(self) -> Iterator[str]:
+        yield from super().expose()
+        for labels, value in sorted(self.collect().items()):
+            yield f"{self.name}{self._label_text(labels)} {_format(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        key = self._check(labels)
+        shard = self._values.shard()
+        # per bucket counts (the last one for +Inf), sum and count
+        values = shard.get(key)
+        if values is None:
+            values = shard[key] = [0] * (len(self.buckets) + 3)
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    def count(self, *labels: str) -> int:
+        key = self._check(labels)
+        return sum(shard[key][-1] for shard in self._values.snapshots() if key in shard)
+
+    def collect(self) -> Dict[Labels, List[float]]:
+        totals: Dict[Labels, List[float]] = {}
+        for shard in self._values.snapshots():
+            for key, values in shard.items():
+                total = totals.setdefault(key, [0] * len(values))
+                for i, value in enumerate(list(values)):
+                    total[i] += value
+        return totals
+
+    def expose(self) -> Iterator[str]:
+        yield from super().expose()
+        bounds = [_format(bound) for bound in self.buckets] + ["+Inf"]
+        for labels, values in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, values):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{self._label_text(labels, (('le', bound),))} {_format(cumulative)}"
+            yield f"{self.name}_sum{self._label_text(labels)} {_format(values[-2])}"
+            yield f"{self.name}_count{self._label_text(labels)} {_format(values[-1])}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[Metric] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        counter = Counter(name, documentation, labelnames)
+        self._metrics.append(counter)
+        return counter
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        histogram = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(histogram)
+        return histogram
+
+    def expose(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.expose()) + "\n"
+
+
+class MetricsMiddleware:
+    """Measures the HTTP requests, labelled by the path template of the route which handled them."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self._route_names: Dict[int, str] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # the routers store the matched endpoint in the scope
+            route = self._route_name(scope)
+            # the method is chosen by the client, unknown ones must not create series of their own
+            method = scope["method"] if scope["method"] in HTTP_METHODS else "other"
+            HTTP_REQUESTS.inc(route, method, str(status))
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, route, method)
+
+    def _route_name(self, scope: Scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if not self._route_names and "app" in scope:
+            self._route_names = dict(_route_paths(scope["app"].routes))
+        return self._route_names.get(id(endpoint), getattr(endpoint, "__name__", type(endpoint).__name__))
+
+
+def _route_paths(routes: List[BaseRoute], prefix: str = "") -> Iterator[Tuple[int, str]]:
+    for route in routes:
+        if isinstance(route, Route):
+            yield id(route.endpoint), prefix + route.path
+        elif isinstance(route, Mount):
+            if route.routes:
+                yield from _route_paths(route.routes, prefix + route.path)
+            else:
+                yield id(route.app), (prefix + route.path) or "/"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "configurator_http_requests_total", "HTTP requests by route, method and status code.",
+    ("route", "method", "status"))
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "configurator_http_request_duration_seconds", "Duration of HTTP requests until the response is sent.",
+    ("route", "method"))
+CONFIG_CACHE = REGISTRY.counter(
+    "configurator_config_cache_lookups_total", "Configuration lookups answered from the cache (hit) or disk (miss).",
+    ("result",))
+CONFIG_READ_DURATION = REGISTRY.histogram(
+    "configurator_config_read_duration_seconds", "Duration of reading and parsing the configuration files.")
+CONFIG_READ_BYTES = REGISTRY.counter(
+    "configurator_config_read_bytes_total", "Bytes of configuration files read.")
+CONFIG_WRITE_DURATION = REGISTRY.histogram(
+    "configurator_config_write_duration_seconds", "Duration of writing the configuration files.")
+CONFIG_WRITE_BYTES = REGISTRY.counter(
+    "configurator_config_written_bytes_total", "Bytes of configuration files written.")
+AUTH_ATTEMPTS = REGISTRY.counter(
+    "configurator_auth_attempts_total", "Authentication attempts by scheme and result.", ("scheme", "result"))
+SYSTEMCTL_DURATION = REGISTRY.histogram(
+    "configurator_systemctl_duration_seconds", "Duration of systemctl invocations.", ("command", "service"))
+SYSTEMCTL_CALLS = REGISTRY.counter(
+    "configurator_systemctl_calls_total", "systemctl invocations by exit code, 'timeout' if it was killed.",
+    ("command", "service", "exit_code"))
+JOURNAL_LINES_DROPPED = REGISTRY.counter(
+    "configurator_journal_lines_dropped_total", "Journal lines dropped for clients reading too slowly.")
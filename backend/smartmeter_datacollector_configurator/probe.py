@@ -0,0 +1,323 @@
+import asyncio
+import contextlib
+import logging
+import os
+import termios
+import tty
+from dataclasses import dataclass, field
+from typing import Collection, Dict, List, Optional, Sequence, Tuple
+
+from smartmeter_datacollector_configurator.dto import MeterDto, MeterType
+from smartmeter_datacollector_configurator.io_executor import run_io
+
+LOGGER = logging.getLogger("uvicorn.error")
+
+HDLC_FLAG = 0x7E
+# LLC header preceding the DLMS APDU in frames sent by the meter.
+LLC_HEADERS = (b"\xe6\xe7\x00", b"\xe6\xe6\x00")
+APDU_DATA_NOTIFICATION = 0x0F
+APDU_GENERAL_GLO_CIPHERING = 0xDB
+
+# (baudrate, parity) combinations the meters are probed with, in this order.
+SERIAL_SETTINGS: List[Tuple[int, str]] = [
+    (2400, "N"),
+    (2400, "E"),
+    (115200, "N"),
+]
+_BAUDRATES = {
+    2400: termios.B2400,
+    9600: termios.B9600,
+    115200: termios.B115200,
+}
+
+# Candidate meter types with their share of the confidence by DLMS manufacturer flag ID.
+# The L+G models cannot be told apart by their messages.
+MANUFACTURER_METERS: Dict[str, List[Tuple[MeterType, float]]] = {
+    "LGZ": [(MeterType.LGE450, 0.5), (MeterType.LGE360, 0.25), (MeterType.LGE570, 0.25)],
+    "ISK": [(MeterType.ISKRAAM550, 1.0)],
+    "KAM": [(MeterType.KAMSTRUP_HAN, 1.0)],
+    "KFM": [(MeterType.KAMSTRUP_HAN, 1.0)],
+}
+KAMSTRUP_LIST_ID = b"Kamstrup"
+
+# Seconds listened with one serial setting, meters push a message every few seconds.
+PROBE_WINDOW = 6.0
+# Seconds the whole probe of all ports may take.
+PROBE_BUDGET = 20.0
+# Number of consistently classified frames after which a port is not listened to any longer.
+CONFIDENT_FRAMES = 2
+
+PROC_DIR = "/proc"
+
+
+@dataclass
+class MeterGuess:
+    meter_type: MeterType
+    confidence: float
+
+
+@dataclass
+class ProbeResult:
+    port: str
+    baudrate: Optional[int] = None
+    parity: Optional[str] = None
+    manufacturer: Optional[str] = None
+    frames: int = 0
+    guesses: List[MeterGuess] = field(default_factory=list)
+    error: Optional[str] = None
+
+    @property
+    def best(self) -> Optional[MeterGuess]:
+        return max(self.guesses, key=lambda guess: guess.confidence, default=None)
+
+    def to_dict(self) -> Dict:
+        best = self.best
+        return {
+            "port": self.port,
+            "meter": MeterDto(type=best.meter_type, port=self.port).dict(exclude_none=True) if best else None,
+            "confidence": round(best.confidence, 2) if best else 0.0,
+            "alternatives": [{"type": guess.meter_type.value, "confidence": round(guess.confidence, 2)}
+                             for guess in sorted(self.guesses, key=lambda guess: -guess.confidence)[1:]],
+            "manufacturer": self.manufacturer,
+            "baudrate": self.baudrate,
+            "parity": self.parity,
+            "frames": self.frames,
+            "error": self.error,
+        }
+
+
+def hdlc_fcs(data: bytes) -> int:
+    """CRC-16/X-25 frame check sequence used by HDLC."""
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x8408 if crc & 1 else crc >> 1
+    return crc ^ 0xFFFF
+
+
+def extract_hdlc_frames(buffer: bytearray) -> List[bytes]:
+    """Removes all complete HDLC frames with a valid FCS from the buffer and returns their content.
+
+    Incomplete data at the end stays in the buffer, garbage is discarded.
+    """
+    frames = []
+    while True:
+        start = buffer.find(HDLC_FLAG)
+        if start < 0:
+            buffer.clear()
+            return frames
+        del buffer[:start]
+        # skip repeated (e.g. closing and opening) flags
+        while len(buffer) > 1 and buffer[1] == HDLC_FLAG:
+            del buffer[0]
+        if len(buffer) < 3:
+            return frames
+        if buffer[1] & 0xF0 != 0xA0:
+            del buffer[0]
+            continue
+        length = ((buffer[1] & 0x07) << 8) | buffer[2]
+        if len(buffer) < length + 2:
+            return frames
+        frame = bytes(buffer[1:length + 1])
+        if length > 4 and buffer[length + 1] == HDLC_FLAG and \
+                hdlc_fcs(frame[:-2]) == int.from_bytes(frame[-2:], "little"):
+            frames.append(frame)
+            del buffer[:length + 1]
+        else:
+            del buffer[0]
+
+
+def hdlc_information(frame: bytes) -> bytes:
+    """Returns the information field of an HDLC frame (without the frame format field and FCS)."""
+    pos = 2
+    for _ in range(2):
+        # destination and source address, the last byte of an address has the LSB set
+        while pos < len(frame) and not frame[pos] & 0x01:
+            pos += 1
+        pos += 1
+    # control field and header check sequence
+    pos += 3
+    return frame[pos:-2]
+
+
+def classify_frame(frame: bytes) -> Tuple[Optional[str], List[MeterGuess]]:
+    """Returns the manufacturer and the meter type guesses of one HDLC frame."""
+    info = hdlc_information(frame)
+    for header in LLC_HEADERS:
+        if info.startswith(header):
+            info = info[len(header):]
+            break
+    if not info:
+        return None, []
+
+    manufacturer = None
+    if info[0] == APDU_GENERAL_GLO_CIPHERING and len(info) >= 10 and info[1] == 8:
+        manufacturer = info[2:5].decode("ascii", errors="replace")
+    elif info[0] == APDU_DATA_NOTIFICATION:
+        if KAMSTRUP_LIST_ID in info:
+            manufacturer = "KAM"
+        else:
+            manufacturer = next((flag for flag in MANUFACTURER_METERS if flag.encode() in info), None)
+
+    candidates = MANUFACTURER_METERS.get(manufacturer or "", [])
+    return manufacturer, [MeterGuess(meter_type, share) for meter_type, share in candidates]
+
+
+class _FrameCollector:
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self.frames = 0
+        self.votes: Dict[Optional[str], int] = {}
+        self.guesses: Dict[Optional[str], List[MeterGuess]] = {}
+
+    def feed(self, data: bytes) -> None:
+        self.buffer.extend(data)
+        for frame in extract_hdlc_frames(self.buffer):
+            self.frames += 1
+            manufacturer, guesses = classify_frame(frame)
+            self.votes[manufacturer] = self.votes.get(manufacturer, 0) + 1
+            self.guesses[manufacturer] = guesses
+
+    @property
+    def confident(self) -> bool:
+        return any(manufacturer and votes >= CONFIDENT_FRAMES for manufacturer, votes in self.votes.items())
+
+    def result(self, result: ProbeResult) -> None:
+        result.frames = self.frames
+        if not self.frames:
+            return
+        manufacturer, votes = max(self.votes.items(), key=lambda item: (item[0] is not None, item[1]))
+        result.manufacturer = manufacturer
+        # agreement of the frames and their number scale the confidence of the classification
+        certainty = votes / self.frames * min(votes, CONFIDENT_FRAMES) / CONFIDENT_FRAMES
+        result.guesses = [MeterGuess(guess.meter_type, guess.confidence * certainty)
+                          for guess in self.guesses[manufacturer]]
+
+
+async def probe_ports(ports: Sequence[str], budget: float = PROBE_BUDGET, window: float = PROBE_WINDOW,
+                      skip: Collection[str] = ()) -> List[ProbeResult]:
+    """Detects the smart meter types connected to the ports, all ports concurrently within the time budget.
+
+    The supported meters push HDLC framed DLMS messages. A port is listened to with
+    each candidate serial setting until frames are decoded, the meter is then
+    classified by the manufacturer in the DLMS system title or by the list
+    identifier of Kamstrup HAN.
+
+    The ports in skip (e.g. those of the configured meters) and the ports opened by another process are not
+    probed, that would take the frames of the datacollector. The serial settings of a probed port are restored.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + budget
+    skipped = {os.path.realpath(port) for port in skip}
+    return list(await asyncio.gather(*(probe_port(port, deadline, window, os.path.realpath(port) in skipped)
+                                       for port in ports)))
+
+
+async def probe_port(port: str, deadline: float, window: float = PROBE_WINDOW, skip: bool = False) -> ProbeResult:
+    loop = asyncio.get_running_loop()
+    result = ProbeResult(port)
+    if skip:
+        result.error = "Port is configured for a meter."
+        return result
+    if await run_io(port_in_use, port):
+        result.error = "Port is in use by another process."
+        return result
+    for baudrate, parity in SERIAL_SETTINGS:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        collector = _FrameCollector()
+        try:
+            await _listen(port, baudrate, parity, min(window, remaining), collector)
+        except termios.error as ex:
+            LOGGER.debug("Serial setting %s %s not supported by %s. '%s'", baudrate, parity, port, ex)
+            result.error = f"Unsupported serial setting {baudrate} {parity}."
+            continue
+        except OSError as ex:
+            LOGGER.warning("Unable to probe %s. '%s'", port, ex)
+            result.error = str(ex)
+            return result
+        result.error = None
+        if collector.frames:
+            result.baudrate, result.parity = baudrate, parity
+            collector.result(result)
+            if result.guesses:
+                break
+    LOGGER.debug("Probe of %s: %s", port, result)
+    return result
+
+
+async def _listen(port: str, baudrate: int, parity: str, duration: float, collector: _FrameCollector) -> None:
+    loop = asyncio.get_running_loop()
+    fd = os.open(port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    done = loop.create_future()
+
+    def on_readable() -> None:
+        try:
+            data = os.read(fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError as ex:
+            if not done.done():
+                done.set_exception(ex)
+            return
+        collector.feed(data)
+        if collector.confident and not done.done():
+            done.set_result(None)
+
+    try:
+        saved_attrs = termios.tcgetattr(fd)
+        try:
+            _configure_port(fd, baudrate, parity)
+            loop.add_reader(fd, on_readable)
+            try:
+                await asyncio.wait_for(asyncio.shield(done), duration)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                loop.remove_reader(fd)
+        finally:
+            # the next user of the port (the datacollector) expects its own settings
+            with contextlib.suppress(termios.error, OSError):
+                termios.tcsetattr(fd, termios.TCSANOW, saved_attrs)
+    finally:
+        os.close(fd)
+
+
+def port_in_use(port: str, proc_dir: str = PROC_DIR) -> bool:
+    """Whether another process has the device of the port open, like fuser checks it."""
+    target = os.path.realpath(port)
+    own_pid = str(os.getpid())
+    try:
+        pids = [entry.name for entry in os.scandir(proc_dir) if entry.name.isdigit() and entry.name != own_pid]
+    except OSError:
+        return False
+    for pid in pids:
+        fd_dir = os.path.join(proc_dir, pid, "fd")
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            # exited meanwhile or owned by another user
+            continue
+        for fd in fds:
+            with contextlib.suppress(OSError):
+                if os.readlink(os.path.join(fd_dir, fd)) == target:
+                    return True
+    return False
+
+
+def _configure_port(fd: int, baudrate: int, parity: str) -> None:
+    tty.setraw(fd)
+    attrs = termios.tcgetattr(fd)
+    cflag = attrs[2] & ~(termios.PARENB | termios.PARODD | termios.CSTOPB | termios.CSIZE)
+    cflag |= termios.CS8 | termios.CLOCAL | termios.CREAD
+    if parity in ("E", "O"):
+        cflag |= termios.PARENB
+    if parity == "O":
+        cflag |= termios.PARODD
+    attrs[2] = cflag
+    attrs[4] = attrs[5] = _BAUDRATES[baudrate]
+    termios.tcsetattr(fd, termios.TCSANOW, attrs)
+    # drop what has been received with the previous settings
+    termios.tcflush(fd, termios.TCIFLUSH)
@@ -0,0 +1,238 @@
+"""Opt-in diagnostics of slow requests and of a blocked event loop.
+
+Profiles and stacks are kept in a small ring buffer from where they can be downloaded, a profile as pstats
+file for snakeviz or 'python -m pstats'.
+"""
+import asyncio
+import collections
+import io
+import itertools
+import logging
+import marshal
+import random
+import sys
+import threading
+import time
+import traceback
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Deque, Dict, List, Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+if TYPE_CHECKING:
+    import cProfile
+
+LOGGER = logging.getLogger("uvicorn.error")
+
+# Number of captures kept, the oldest one is dropped first.
+MAX_CAPTURES = 20
+SLOW_REQUEST_MS = 500
+LOOP_BLOCK_MS = 200
+SAMPLE_RATE = 0.1
+# Functions listed in the text summary of a profile.
+SUMMARY_FUNCTIONS = 25
+
+KIND_REQUEST = "slow-request"
+KIND_LOOP_BLOCK = "loop-block"
+
+
+@dataclass
+class Capture:
+    id: int
+    kind: str
+    created: float
+    duration: float
+    description: str
+    # pstats data of a profiled request
+    profile: Optional[bytes] = field(default=None, repr=False)
+    # stack of the event loop thread while it was blocked
+    stack: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.id, "kind": self.kind, "created": self.created, "duration": self.duration,
+                "description": self.description, "profiled": self.profile is not None}
+
+    def summary(self) -> str:
+        if self.stack is not None:
+            return self.stack
+        if self.profile is None:
+            return "Request has not been profiled.\n"
+        import pstats  # pylint: disable=import-outside-toplevel
+        out = io.StringIO()
+        stats = pstats.Stats(_StatsSource(marshal.loads(self.profile)), stream=out)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(SUMMARY_FUNCTIONS)
+        return out.getvalue()
+
+
+class _StatsSource:
+    # pylint: disable=too-few-public-methods
+    def __init__(self, stats: Dict) -> None:
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+class RequestProfiler:
+    """Settings and captures of the request profiling, shared by the middleware and the admin endpoints."""
+
+    def __init__(self, max_captures: int = MAX_CAPTURES) -> None:
+        self.enabled = False
+        self.sample_rate = SAMPLE_RATE
+        self.slow_request_ms = SLOW_REQUEST_MS
+        self.loop_block_ms = LOOP_BLOCK_MS
+        self._captures: Deque[Capture] = collections.deque(maxlen=max_captures)
+        self._ids = itertools.count(1)
+        # cProfile hooks the whole thread, only one request is profiled at a time
+        self._profiling = False
+        self._watchdog: Optional[LoopWatchdog] = None
+
+    def settings(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "sample_rate": self.sample_rate, "slow_request_ms": self.slow_request_ms,
+                "loop_block_ms": self.loop_block_ms}
+
+    def configure(self, enabled: bool, sample_rate: float = SAMPLE_RATE, slow_request_ms: int = SLOW_REQUEST_MS,
+                  loop_block_ms: int = LOOP_BLOCK_MS) -> None:
+        """Applies the settings and stops the loop watchdog, start() starts it again if enabled."""
+        self.stop()
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_request_ms = slow_request_ms
+        self.loop_block_ms = loop_block_ms
+
+    def start(self) -> None:
+        """Starts the loop watchdog if profiling is enabled, must be called on the event loop."""
+        if self.enabled and self._watchdog is None:
+            self._watchdog = LoopWatchdog(self, self.loop_block_ms / 1000)
+            self._watchdog.start()
+
+    def stop(self) -> None:
+        if self._watchdog is not None:
+            self._watchdog.stop()
+            self._watchdog = None
+
+    def captures(self) -> List[Capture]:
+        """Returns the captures, the latest first."""
+        return list(reversed(self._captures))
+
+    def get(self, capture_id: int) -> Optional[Capture]:
+        return next((capture for capture in self._captures if capture.id == capture_id), None)
+
+    def add(self, kind: str, duration: float, description: str, profile: Optional[bytes] = None,
+            stack: Optional[str] = None) -> Capture:
+        capture = Capture(next(self._ids), kind, time.time(), duration, description, profile, stack)
+        # deque.append is thread-safe, the watchdog adds from its own thread
+        self._captures.append(capture)
+        LOGGER.warning("%s captured: %s took %.0f ms.", kind, description, duration * 1000)
+        return capture
+
+    def begin_profile(self) -> Optional["cProfile.Profile"]:
+        if self._profiling or random.random() >= self.sample_rate:
+            return None
+        # loaded once a request is profiled, most instances never enable profiling
+        import cProfile  # pylint: disable=import-outside-toplevel
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler (e.g. a debugger) is active
+            return None
+        self._profiling = True
+        return profile
+
+    def end_profile(self, profile: "cProfile.Profile") -> bytes:
+        profile.disable()
+        self._profiling = False
+        profile.create_stats()
+        return marshal.dumps(profile.stats)
+
+
+class ProfilingMiddleware:
+    """Profiles sampled requests and captures every request slower than the threshold if profiling is enabled.
+
+    As cProfile hooks the event loop thread, the profile of a request also contains what other requests did
+    meanwhile.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        profiler: Optional[RequestProfiler] = getattr(scope["app"].state, "profiler", None) \
+            if "app" in scope else None
+        if scope["type"] != "http" or profiler is None or not profiler.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        streaming = False
+        profile = profiler.begin_profile()
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status, streaming, profile
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                # event streams stay open as long as the client listens, they are neither profiled nor captured
+                streaming = any(name.lower() == b"content-type" and value.startswith(b"text/event-stream")
+                                for name, value in message.get("headers", []))
+                if streaming and profile:
+                    profiler.end_profile(profile)
+                    profile = None
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - start
+            data = profiler.end_profile(profile) if profile else None
+            if duration * 1000 >= profiler.slow_request_ms and not streaming:
+                profiler.add(KIND_REQUEST, duration, f"{scope['method']} {scope['path']} -> {status}", data)
+
+
+class LoopWatchdog:
+    """Detects the event loop being blocked longer than the threshold and captures the stack blocking it.
+
+    A task on the loop updates a heartbeat, a thread checks it and reads the loop thread's current frame.
+    """
+
+    def __init__(self, profiler: RequestProfiler, threshold: float) -> None:
+        self._profiler = profiler
+        self._threshold = threshold
+        self._interval = threshold / 4
+        self._last_beat = time.monotonic()
+        self._stopped = threading.Event()
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._loop_thread_id = 0
+
+    def start(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._heartbeat = asyncio.get_running_loop().create_task(self._beat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+        if self._thread is not None:
+            self._thread.join()
+
+    async def _beat(self) -> None:
+        while True:
+            self._last_beat = time.monotonic()
+            await asyncio.sleep(self._interval)
+
+    def _watch(self) -> None:
+        captured_beat = None
+        while not self._stopped.wait(self._interval):
+            last_beat = self._last_beat
+            blocked = time.monotonic() - last_beat - self._interval
+            # one capture per blocking, it is taken while the loop is still blocked
+            if blocked >= self._threshold and captured_beat != last_beat:
+                captured_beat = last_beat
+                frame = sys._current_frames().get(self._loop_thread_id)  # pylint: disable=protected-access
+                stack = "".join(traceback.format_stack(frame)) if frame else "Stack not available.\n"
+                self._profiler.add(KIND_LOOP_BLOCK, blocked, "Event loop blocked", stack=stack)
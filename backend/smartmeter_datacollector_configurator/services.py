@@ -0,0 +1,380 @@
+"""Backends controlling and querying the systemd services.
+
+SystemctlServiceManager runs /bin/systemctl for every operation. DbusServiceManager keeps one connection to
+systemd over D-Bus (requires the optional dbus-fast package) and waits for the job completion signals.
+FakeServiceManager keeps the services in memory, for tests and benchmarks without systemd.
+"""
+import abc
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Set
+
+from smartmeter_datacollector_configurator import metrics
+
+try:
+    from dbus_fast import BusType, Message, MessageType
+    from dbus_fast.aio import MessageBus
+except ImportError:
+    MessageBus = None  # type: ignore
+
+LOGGER = logging.getLogger("uvicorn.error")
+
+SYSCTL_BIN = "/bin/systemctl"
+DBUS_SYSTEM_SOCKET = "/run/dbus/system_bus_socket"
+
+# Unit properties of a service status, named like the systemd properties.
+STATUS_PROPERTIES = ("Id", "LoadState", "ActiveState", "SubState", "ActiveEnterTimestampMonotonic",
+                     "ExecMainStatus")
+# Seconds a status or installation query may take.
+QUERY_TIMEOUT = 10.0
+
+BACKEND_AUTO = "auto"
+BACKEND_DBUS = "dbus"
+BACKEND_SYSTEMCTL = "systemctl"
+BACKEND_FAKE = "fake"
+BACKENDS = (BACKEND_AUTO, BACKEND_DBUS, BACKEND_SYSTEMCTL, BACKEND_FAKE)
+
+
+class NoPermissionError(Exception):
+    pass
+
+
+class NotInstalledError(Exception):
+    pass
+
+
+class GeneralSystemError(Exception):
+    pass
+
+
+class ServiceManager(abc.ABC):
+    """Starts, stops and queries systemd services, the names are given without the .service suffix.
+
+    start(), stop() and restart() return once systemd has finished the job. A backend must implement all of them,
+    installed() and status(), close() is optional.
+    """
+    name = ""
+
+    @abc.abstractmethod
+    async def start(self, service: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def stop(self, service: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def restart(self, service: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def installed(self, services: List[str]) -> List[str]:
+        """Returns those of the services which are installed, in the given order."""
+
+    @abc.abstractmethod
+    async def status(self, services: List[str]) -> List[Dict[str, str]]:
+        """Returns the STATUS_PROPERTIES of every service, also of services not installed."""
+
+    async def close(self) -> None:
+        pass
+
+
+class SystemctlServiceManager(ServiceManager):
+    name = BACKEND_SYSTEMCTL
+
+    async def start(self, service: str) -> None:
+        await self._control("start", service)
+
+    async def stop(self, service: str) -> None:
+        await self._control("stop", service)
+
+    async def restart(self, service: str) -> None:
+        await self._control("restart", service)
+
+    async def installed(self, services: List[str]) -> List[str]:
+        # systemctl exits with 1 if none of the units is installed
+        _, stdout = await self._run("list-unit-files", services, "--no-legend", "--no-pager")
+        listed_units = {line.split()[0] for line in stdout.splitlines() if line.strip()}
+        return [service for service in services if f"{service}.service" in listed_units]
+
+    async def status(self, services: List[str]) -> List[Dict[str, str]]:
+        return_code, stdout = await self._run("show", services, "--no-pager",
+                                              f"--property={','.join(STATUS_PROPERTIES)}")
+        if return_code:
+            raise GeneralSystemError(f"Return code: {return_code}")
+        return _parse_unit_properties(stdout)
+
+    async def _control(self, command: str, service: str) -> None:
+        return_code, _ = await self._run(command, [service], capture=False)
+        _check_for_error(return_code, service)
+
+    @staticmethod
+    async def _run(command: str, services: List[str], *options: str, capture: bool = True):
+        """Runs systemctl, returns the exit code and the output. A cancelled call kills the process."""
+        start = time.perf_counter()
+        proc = await asyncio.create_subprocess_exec(
+            SYSCTL_BIN,
+            command,
+            *options,
+            *(f"{service}.service" if capture else service for service in services),
+            stdout=asyncio.subprocess.PIPE if capture else None,
+            stderr=asyncio.subprocess.DEVNULL if capture else None)
+        label = services[0] if len(services) == 1 else "multiple"
+        try:
+            stdout, _ = await (asyncio.wait_for(proc.communicate(), QUERY_TIMEOUT) if capture else proc.communicate())
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # the process must not outlive the caller (nor the event loop)
+            proc.kill()
+            await proc.wait()
+            _record_systemctl(command, label, start, None)
+            raise
+        _record_systemctl(command, label, start, proc.returncode)
+        return proc.returncode, stdout.decode(errors="replace") if stdout else ""
+
+
+class DbusServiceManager(ServiceManager):
+    """Talks to systemd over one long-lived system bus connection, reconnecting if it was lost."""
+    name = BACKEND_DBUS
+    DESTINATION = "org.freedesktop.systemd1"
+    PATH = "/org/freedesktop/systemd1"
+    MANAGER = "org.freedesktop.systemd1.Manager"
+    # Number of job results kept for jobs which finished before their caller started waiting.
+    MAX_EARLY_RESULTS = 64
+
+    def __init__(self) -> None:
+        if MessageBus is None:
+            raise GeneralSystemError("The D-Bus backend requires the dbus-fast package.")
+        self._bus: Optional["MessageBus"] = None
+        self._connecting: Optional[asyncio.Task] = None
+        self._jobs: Dict[str, "asyncio.Future[str]"] = {}
+        self._early_results: Dict[str, str] = {}
+
+    async def start(self, service: str) -> None:
+        await self._control("StartUnit", service)
+
+    async def stop(self, service: str) -> None:
+        await self._control("StopUnit", service)
+
+    async def restart(self, service: str) -> None:
+        await self._control("RestartUnit", service)
+
+    async def installed(self, services: List[str]) -> List[str]:
+        unit_files = await self._call(self.MANAGER, "ListUnitFilesByPatterns", "asas",
+                                      [[], [f"{service}.service" for service in services]], timeout=QUERY_TIMEOUT)
+        listed_units = {os.path.basename(path) for path, _ in unit_files[0]}
+        return [service for service in services if f"{service}.service" in listed_units]
+
+    async def status(self, services: List[str]) -> List[Dict[str, str]]:
+        # one call for the states of all units, the timestamps and exit codes are pipelined on the connection
+        units = (await self._call(self.MANAGER, "ListUnitsByNames", "as",
+                                  [[f"{service}.service" for service in services]], timeout=QUERY_TIMEOUT))[0]
+        details = await asyncio.gather(*(self._unit_details(unit[6], unit[2]) for unit in units))
+        return [{"Id": unit[0], "LoadState": unit[2], "ActiveState": unit[3], "SubState": unit[4], **detail}
+                for unit, detail in zip(units, details)]
+
+    async def close(self) -> None:
+        if self._bus is not None:
+            self._bus.disconnect()
+            self._bus = None
+
+    async def _unit_details(self, path: str, load_state: str) -> Dict[str, str]:
+        if load_state != "loaded":
+            return {}
+        entered, exit_status = await asyncio.gather(
+            self._get_property(path, "org.freedesktop.systemd1.Unit", "ActiveEnterTimestampMonotonic"),
+            self._get_property(path, "org.freedesktop.systemd1.Service", "ExecMainStatus"))
+        return {"ActiveEnterTimestampMonotonic": str(entered), "ExecMainStatus": str(exit_status)}
+
+    async def _get_property(self, path: str, interface: str, name: str):
+        reply = await self._call("org.freedesktop.DBus.Properties", "Get", "ss", [interface, name], path=path,
+                                 timeout=QUERY_TIMEOUT)
+        return reply[0].value
+
+    async def _control(self, method: str, service: str) -> None:
+        start = time.perf_counter()
+        result = "exception"
+        try:
+            job_path = (await self._call(self.MANAGER, method, "ss", [f"{service}.service", "replace"]))[0]
+            result = self._early_results.pop(job_path, None) or await self._wait_for_job(job_path)
+        finally:
+            # recorded like the systemctl calls, with the job result instead of the exit code
+            metrics.SYSTEMCTL_DURATION.observe(time.perf_counter() - start, method, service)
+            metrics.SYSTEMCTL_CALLS.inc(method, service, result)
+        if result != "done":
+            raise GeneralSystemError(f"Job of {service} {result}.")
+
+    async def _wait_for_job(self, job_path: str) -> str:
+        future = asyncio.get_running_loop().create_future()
+        self._jobs[job_path] = future
+        try:
+            return await future
+        finally:
+            self._jobs.pop(job_path, None)
+
+    async def _call(self, interface: str, member: str, signature: str, body: list, path: str = PATH,
+                    timeout: Optional[float] = None) -> list:
+        bus = await self._connect()
+        message = Message(destination=self.DESTINATION, path=path, interface=interface, member=member,
+                          signature=signature, body=body)
+        reply = await asyncio.wait_for(bus.call(message), timeout)
+        if reply.message_type == MessageType.ERROR:
+            raise _dbus_error(reply.error_name, reply.body[0] if reply.body else "")
+        return reply.body
+
+    async def _connect(self) -> "MessageBus":
+        if self._bus is not None and self._bus.connected:
+            return self._bus
+        # concurrent callers share one connection attempt
+        if self._connecting is None or self._connecting.done():
+            self._connecting = asyncio.create_task(self._open())
+        return await asyncio.shield(self._connecting)
+
+    async def _open(self) -> "MessageBus":
+        try:
+            bus = await MessageBus(bus_type=BusType.SYSTEM).connect()
+        except OSError as ex:
+            raise GeneralSystemError(f"Unable to connect to the system bus. '{ex}'") from ex
+        bus.add_message_handler(self._on_message)
+        await bus.call(Message(destination="org.freedesktop.DBus", path="/org/freedesktop/DBus",
+                               interface="org.freedesktop.DBus", member="AddMatch", signature="s",
+                               body=[f"type='signal',interface='{self.MANAGER}',member='JobRemoved'"]))
+        # systemd only emits the job signals to subscribed clients
+        await bus.call(Message(destination=self.DESTINATION, path=self.PATH, interface=self.MANAGER,
+                               member="Subscribe"))
+        for future in self._jobs.values():
+            # the signals of jobs started on a lost connection never arrive
+            if not future.done():
+                future.set_exception(GeneralSystemError("Connection to systemd lost."))
+        self._bus = bus
+        LOGGER.info("Connected to systemd over D-Bus.")
+        return bus
+
+    def _on_message(self, message: "Message") -> bool:
+        if message.message_type != MessageType.SIGNAL or message.member != "JobRemoved":
+            return False
+        _, job_path, _, result = message.body
+        future = self._jobs.get(job_path)
+        if future is None:
+            # the signal may arrive before the caller started waiting
+            self._early_results[job_path] = result
+            while len(self._early_results) > self.MAX_EARLY_RESULTS:
+                del self._early_results[next(iter(self._early_results))]
+        elif not future.done():
+            future.set_result(result)
+        return False
+
+
+class FakeServiceManager(ServiceManager):
+    """Services in memory, every operation takes latency seconds (per service if given in latencies)."""
+    name = BACKEND_FAKE
+
+    def __init__(self, installed: Optional[List[str]] = None, latency: float = 0.0,
+                 latencies: Optional[Dict[str, float]] = None) -> None:
+        self.latency = latency
+        self.latencies = dict(latencies or {})
+        self.calls: List[List[str]] = []
+        self._installed: Set[str] = set(installed or [])
+        self._failed: Set[str] = set()
+        self._active_since: Dict[str, float] = {service: time.monotonic() for service in self._installed}
+
+    def install(self, *services: str) -> None:
+        self._installed.update(services)
+        for service in services:
+            self._active_since.setdefault(service, time.monotonic())
+
+    def fail(self, service: str) -> None:
+        """Lets the service fail, it is active again after the next start."""
+        self._failed.add(service)
+        self._active_since.pop(service, None)
+
+    async def start(self, service: str) -> None:
+        await self._control("start", service)
+        self._failed.discard(service)
+        self._active_since.setdefault(service, time.monotonic())
+
+    async def stop(self, service: str) -> None:
+        await self._control("stop", service)
+        self._active_since.pop(service, None)
+
+    async def restart(self, service: str) -> None:
+        await self._control("restart", service)
+        self._failed.discard(service)
+        self._active_since[service] = time.monotonic()
+
+    async def installed(self, services: List[str]) -> List[str]:
+        self.calls.append(["installed", *services])
+        await asyncio.sleep(self.latency)
+        return [service for service in services if service in self._installed]
+
+    async def status(self, services: List[str]) -> List[Dict[str, str]]:
+        self.calls.append(["status", *services])
+        await asyncio.sleep(self.latency)
+        return [self._status(service) for service in services]
+
+    async def _control(self, command: str, service: str) -> None:
+        self.calls.append([command, service])
+        await asyncio.sleep(self.latencies.get(service, self.latency))
+        if service not in self._installed:
+            raise NotInstalledError(f"{service} is not installed.")
+
+    def _status(self, service: str) -> Dict[str, str]:
+        status = {"Id": f"{service}.service", "LoadState": "loaded" if service in self._installed else "not-found",
+                  "ActiveState": "inactive", "SubState": "dead", "ActiveEnterTimestampMonotonic": "0",
+                  "ExecMainStatus": "0"}
+        if service in self._failed:
+            status.update(ActiveState="failed", SubState="failed", ExecMainStatus="1")
+        elif service in self._active_since:
+            status.update(ActiveState="active", SubState="running",
+                          ActiveEnterTimestampMonotonic=str(int(self._active_since[service] * 1e6)))
+        return status
+
+
+def create_service_manager(backend: str = BACKEND_AUTO, fake_installed: Optional[List[str]] = None) -> ServiceManager:
+    """Creates the backend, auto chooses D-Bus if dbus-fast is installed and the system bus is available.
+
+    The fake backend has the services fake_installed installed and running.
+    """
+    if backend == BACKEND_FAKE:
+        return FakeServiceManager(fake_installed)
+    if backend == BACKEND_DBUS or (backend == BACKEND_AUTO and MessageBus is not None
+                                   and os.path.exists(DBUS_SYSTEM_SOCKET)):
+        return DbusServiceManager()
+    return SystemctlServiceManager()
+
+
+def _parse_unit_properties(output: str) -> List[Dict[str, str]]:
+    # one block of "Key=Value" lines per unit, separated by an empty line
+    units = []
+    for block in output.split("\n\n"):
+        properties = dict(line.partition("=")[::2] for line in block.splitlines() if "=" in line)
+        if properties:
+            units.append(properties)
+    return units
+
+
+def _dbus_error(name: str, text: str) -> Exception:
+    if name == "org.freedesktop.systemd1.NoSuchUnit":
+        return NotInstalledError(text)
+    if name in ("org.freedesktop.DBus.Error.AccessDenied",
+                "org.freedesktop.DBus.Error.InteractiveAuthorizationRequired"):
+        return NoPermissionError("Insufficient system privileges to control service.")
+    return GeneralSystemError(f"{name}: {text}")
+
+
+def _record_systemctl(command: str, service: str, start: float, return_code: Optional[int]) -> None:
+    metrics.SYSTEMCTL_DURATION.observe(time.perf_counter() - start, command, service)
+    metrics.SYSTEMCTL_CALLS.inc(command, service, "timeout" if return_code is None else str(return_code))
+
+
+def _check_for_error(return_code: int, service: str) -> None:
+    if return_code == 4:
+        LOGGER.error("Insufficient system privileges.")
+        raise NoPermissionError("Insufficient system privileges to restart service.")
+    if return_code == 5:
+        LOGGER.error("%s is not installed.", service)
+        raise NotInstalledError(f"{service} is not installed.")
+    if return_code > 0:
+        LOGGER.error("General error %s", service)
+        raise GeneralSystemError(f"Return code: {return_code}")
@@ -0,0 +1,132 @@
+"""Coordination of the worker processes through files in a state directory shared by all workers.
+
+State held in memory (caches, session secret, jobs) is checked against the signature of its file before use,
+so a change made by one worker is seen by the others with their next request.
+"""
+import contextlib
+import os
+from typing import Iterator, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # not available on Windows, only the multi-worker mode needs it
+    fcntl = None  # type: ignore
+
+FileSignature = Optional[Tuple[int, int, int]]
+
+
+def file_signature(path: str) -> FileSignature:
+    """Changes with every write of the file, also with an atomic replacement (new inode)."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+class FileWatch:
+    """Tells whether a file changed since it was last marked as seen."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._seen = file_signature(path)
+        self._current = self._seen
+
+    def changed(self) -> bool:
+        """Whether the file changed, call mark_seen() once the change has been processed successfully."""
+        self._current = file_signature(self.path)
+        return self._current != self._seen
+
+    def mark_seen(self) -> None:
+        """Takes the state found by the last changed() as seen, a change happening meanwhile is reported again."""
+        self._seen = self._current
+
+    def reset(self) -> None:
+        """Takes the current state of the file as seen, e.g. after writing it."""
+        self._seen = self._current = file_signature(self.path)
+
+
+@contextlib.contextmanager
+def file_lock(path: str, shared: bool = False) -> Iterator[None]:
+    """Holds an advisory lock of the file across processes, exclusive unless shared."""
+    if fcntl is None:
+        raise RuntimeError("File locks are not supported on this platform.")
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def try_lock(path: str) -> Optional[int]:
+    """Takes the exclusive lock of the file without waiting, returns the descriptor to release it or None."""
+    if fcntl is None:
+        raise RuntimeError("File locks are not supported on this platform.")
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def release_lock(fd: int) -> None:
+    os.close(fd)
+
+
+def stage_file(path: str, content: bytes, mode: int = 0o600) -> str:
+    """Writes the content to a temporary file next to path and flushes it to disk, returns the temporary path.
+
+    The caller moves it into place (or removes it), see write_atomically.
+    """
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        with os.fdopen(fd, "wb") as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+    return temp_path
+
+
+def write_atomically(path: str, content: bytes, mode: int = 0o600) -> None:
+    """Replaces the file by the content, readers see either the old or the complete new file, also after a crash."""
+    temp_path = stage_file(path, content, mode)
+    try:
+        os.replace(temp_path, path)
+    finally:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+
+
+def create_once(path: str, content: bytes) -> bytes:
+    """Creates the file with the content unless it exists, returns the content of the file.
+
+    The file is linked in complete, concurrent processes all end up with the content of the first one.
+    """
+    existing = read_file(path)
+    if existing is not None:
+        return existing
+    temp_path = stage_file(path, content)
+    try:
+        with contextlib.suppress(FileExistsError):
+            os.link(temp_path, path)
+    finally:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+    return read_file(path) or content
+
+
+def read_file(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
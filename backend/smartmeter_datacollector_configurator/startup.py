@@ -0,0 +1,97 @@
+import argparse
+import asyncio
+import importlib
+import os
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+APP_MODULE = "smartmeter_datacollector_configurator.app"
+TOP_IMPORTS = 15
+
+
+@dataclass(frozen=True)
+class ImportTiming:
+    module: str
+    depth: int
+    self_us: int
+    cumulative_us: int
+
+
+@dataclass
+class StartupProfile:
+    # wall time of a fresh interpreter importing the app
+    cold_start: float = 0.0
+    # phase name -> duration in seconds, in order of execution
+    phases: List[Tuple[str, float]] = field(default_factory=list)
+    imports: List[ImportTiming] = field(default_factory=list)
+
+    @property
+    def total(self) -> float:
+        return sum(duration for _, duration in self.phases)
+
+
+def parse_importtime(output: str) -> List[ImportTiming]:
+    """Parses the report of 'python -X importtime' ("import time: self | cumulative | name")."""
+    timings = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            timings.append(ImportTiming(name.strip(), (len(name) - len(name.lstrip()) - 1) // 2,
+                                        int(self_us), int(cumulative_us)))
+        except ValueError:
+            continue  # header line
+    return timings
+
+
+def cold_import(module: str = APP_MODULE) -> Tuple[float, List[ImportTiming]]:
+    """Imports the module in a fresh interpreter, returns the wall time and the import timings."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            env=env, capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, parse_importtime(result.stderr)
+
+
+def profile_startup(args: argparse.Namespace) -> StartupProfile:
+    """Measures the startup phases of the web app in this process and its imports in a fresh interpreter."""
+    profile = StartupProfile()
+    profile.cold_start, profile.imports = cold_import()
+
+    start = time.perf_counter()
+    app_module = importlib.import_module(APP_MODULE)
+    profile.phases.append(("import app", time.perf_counter() - start))
+
+    start = time.perf_counter()
+    app = app_module.create_app(args)
+    profile.phases.append(("build app", time.perf_counter() - start))
+
+    async def run_lifespan():
+        start = time.perf_counter()
+        async with app.router.lifespan_context(app):
+            profile.phases.append(("lifespan startup", time.perf_counter() - start))
+            start = time.perf_counter()
+        profile.phases.append(("lifespan shutdown", time.perf_counter() - start))
+
+    asyncio.run(run_lifespan())
+    return profile
+
+
+def format_profile(profile: StartupProfile, top: int = TOP_IMPORTS) -> str:
+    lines = [f"Cold start (fresh interpreter importing the app): {profile.cold_start * 1000:.1f} ms",
+             "Startup phases:"]
+    lines += [f"  {name:<40} {duration * 1000:9.1f} ms" for name, duration in profile.phases]
+    lines.append(f"  {'total':<40} {profile.total * 1000:9.1f} ms")
+    lines.append(f"Slowest imports (cumulative, of {len(profile.imports)}):")
+    slowest = sorted(profile.imports, key=lambda timing: timing.cumulative_us, reverse=True)[:top]
+    lines += [f"  {'  ' * timing.depth + timing.module:<60} {timing.cumulative_us / 1000:9.1f} ms"
+              f" (self {timing.self_us / 1000:.1f} ms)" for timing in slowest]
+    return "\n".join(lines)
+
+
+def print_startup_profile(args: argparse.Namespace) -> None:
+    print(format_profile(profile_startup(args)))
@@ -0,0 +1,162 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, Optional, Set, Tuple
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+LOGGER = logging.getLogger("uvicorn.error")
+
+# Precompressed variants generated by the build scripts, in order of preference.
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+# Files up to this size (and index.html) are kept in memory.
+MEMORY_CACHE_FILE_LIMIT = 64 * 1024
+# The frontend build emits content hashed file names ("index-4f3a9c1e.js") into the assets directory.
+HASHED_ASSET = re.compile(r"^assets/.+-[A-Za-z0-9_-]{8,}\.[A-Za-z0-9]+$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+@dataclass(frozen=True)
+class CachedAsset:
+    media_type: str
+    cache_control: str
+    # encoding (None for identity) -> (content, etag)
+    variants: Dict[Optional[str], Tuple[bytes, str]]
+
+
+def cache_control_for(path: str) -> str:
+    if HASHED_ASSET.match(path):
+        return IMMUTABLE_CACHE_CONTROL
+    return REVALIDATE_CACHE_CONTROL
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> Set[str]:
+    encodings = set()
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.partition(";")
+        params = params.strip().lower()
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if coding.strip():
+            encodings.add(coding.strip().lower())
+    return encodings
+
+
+def choose_encoding(accept_encoding: Optional[str], available) -> Optional[str]:
+    accepted = accepted_encodings(accept_encoding)
+    for encoding, _ in ENCODINGS:
+        if encoding in available and (encoding in accepted or "*" in accepted):
+            return encoding
+    return None
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """Serves the frontend bundle with precompressed variants and long-lived caching of hashed assets.
+
+    Call preload() at startup to keep index.html and small files in memory, changes of those
+    files on disk are picked up on the next restart only.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._memory: Dict[str, CachedAsset] = {}
+
+    def preload(self) -> None:
+        memory: Dict[str, CachedAsset] = {}
+        for directory in self.all_directories:
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    full_path = os.path.join(root, name)
+                    path = os.path.relpath(full_path, directory).replace(os.sep, "/")
+                    if path in memory or name.endswith(tuple(suffix for _, suffix in ENCODINGS)):
+                        continue
+                    try:
+                        if path == "index.html" or os.path.getsize(full_path) <= MEMORY_CACHE_FILE_LIMIT:
+                            memory[path] = self._load_asset(path, full_path)
+                    except OSError as ex:
+                        LOGGER.warning("Unable to cache static file '%s'. '%s'", full_path, ex)
+        self._memory = memory
+        LOGGER.debug("%d static files cached in memory.", len(memory))
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if scope["method"] in ("GET", "HEAD"):
+            asset = self._memory.get("index.html" if path == "." else path.replace(os.sep, "/"))
+            if asset is not None:
+                return self._memory_response(asset, scope)
+        return await super().get_response(path, scope)
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        relative_path = self._relative_path(str(full_path))
+        headers = {"Cache-Control": cache_control_for(relative_path)}
+        media_type = mimetypes.guess_type(str(full_path))[0] or "text/plain"
+
+        variants = self._variants_on_disk(str(full_path))
+        if variants:
+            headers["Vary"] = "Accept-Encoding"
+        encoding = choose_encoding(request_headers.get("accept-encoding"), variants)
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+            full_path, stat_result = variants[encoding]
+
+        response = FileResponse(full_path, status_code=status_code, headers=headers, media_type=media_type,
+                                stat_result=stat_result)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def _memory_response(self, asset: CachedAsset, scope: Scope) -> Response:
+        request_headers = Headers(scope=scope)
+        encoding = choose_encoding(request_headers.get("accept-encoding"), asset.variants)
+        content, etag = asset.variants[encoding]
+        headers = {"Cache-Control": asset.cache_control, "ETag": etag}
+        if len(asset.variants) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+
+        response = Response(content, media_type=asset.media_type, headers=headers)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def _relative_path(self, full_path: str) -> str:
+        for directory in self.all_directories:
+            directory = os.path.realpath(directory)
+            if os.path.commonpath([full_path, directory]) == directory:
+                return os.path.relpath(full_path, directory).replace(os.sep, "/")
+        return os.path.basename(full_path)
+
+    @staticmethod
+    def _variants_on_disk(full_path: str) -> Dict[str, Tuple[str, os.stat_result]]:
+        variants = {}
+        for encoding, suffix in ENCODINGS:
+            try:
+                variants[encoding] = (full_path + suffix, os.stat(full_path + suffix))
+            except OSError:
+                continue
+        return variants
+
+    @staticmethod
+    def _load_asset(path: str, full_path: str) -> CachedAsset:
+        variants: Dict[Optional[str], Tuple[bytes, str]] = {}
+        for encoding, suffix in ((None, ""),) + ENCODINGS:
+            try:
+                with open(full_path + suffix, "rb") as file:
+                    content = file.read()
+            except FileNotFoundError:
+                continue
+            variants[encoding] = (content, f'"{hashlib.sha256(content).hexdigest()[:32]}"')
+        media_type = mimetypes.guess_type(full_path)[0] or "text/plain"
+        return CachedAsset(media_type, cache_control_for(path), variants)
@@ -0,0 +1,130 @@
+import asyncio
+import contextlib
+import json
+import logging
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+
+from smartmeter_datacollector_configurator import system
+
+LOGGER = logging.getLogger("uvicorn.error")
+
+# Seconds between two status queries, and right after a restart until FAST_PERIOD has elapsed.
+REFRESH_INTERVAL = 10.0
+FAST_REFRESH_INTERVAL = 1.0
+FAST_PERIOD = 30.0
+
+
+@dataclass(frozen=True)
+class ServiceStatus:
+    name: str
+    load_state: str
+    active_state: str
+    sub_state: str
+    # seconds since the service entered the active state, None if it is not active
+    uptime: Optional[float]
+    # exit status of the last main process
+    exit_code: Optional[int]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_properties(cls, name: str, properties: Dict[str, str], now: float) -> "ServiceStatus":
+        active_state = properties.get("ActiveState", "unknown")
+        entered = _to_int(properties.get("ActiveEnterTimestampMonotonic"))
+        uptime = None
+        if active_state == "active" and entered:
+            # systemd and time.monotonic() both use CLOCK_MONOTONIC
+            uptime = round(max(now - entered / 1e6, 0.0), 1)
+        return cls(name, properties.get("LoadState", "unknown"), active_state, properties.get("SubState", "unknown"),
+                   uptime, _to_int(properties.get("ExecMainStatus")))
+
+
+class StatusMonitor:
+    """Keeps a snapshot of the state of the datacollector and the installed demo services.
+
+    A background task queries all services with one systemctl call per interval, the snapshot is served as
+    prepared JSON however many clients poll. After boost() (e.g. a restart) it is refreshed at a faster pace.
+    """
+
+    def __init__(self, interval: float = REFRESH_INTERVAL, fast_interval: float = FAST_REFRESH_INTERVAL,
+                 fast_period: float = FAST_PERIOD) -> None:
+        self.interval = interval
+        self.fast_interval = fast_interval
+        self.fast_period = fast_period
+        self._services: List[ServiceStatus] = []
+        self._updated_at: Optional[float] = None
+        self._error: Optional[str] = None
+        self._body = self._encode()
+        self._fast_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def services(self) -> List[ServiceStatus]:
+        return list(self._services)
+
+    def snapshot(self) -> bytes:
+        """Returns the last status as JSON document."""
+        return self._body
+
+    def start(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="status-monitor")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    def boost(self) -> None:
+        """Refreshes right away and at the fast interval for a while, the services are changing."""
+        self._fast_until = time.monotonic() + self.fast_period
+        self._wakeup.set()
+
+    async def refresh(self) -> None:
+        services = [system.DATACOL_SERVICE]
+        try:
+            services += await system.get_installed_demo_services()
+            units = await system.query_unit_status(services)
+        except Exception as ex:  # pylint: disable=broad-except
+            # whatever the service manager raises (e.g. a D-Bus error) is shown, the monitor keeps polling
+            if self._error is None:
+                LOGGER.warning("Unable to query the service status. '%s'", ex)
+            self._error = str(ex) or type(ex).__name__
+        else:
+            now = time.monotonic()
+            by_id = {unit.get("Id", "").removesuffix(".service"): unit for unit in units}
+            self._services = [ServiceStatus.from_properties(service, by_id.get(service, {}), now)
+                              for service in services]
+            self._error = None
+        self._updated_at = time.time()
+        self._body = self._encode()
+
+    async def _run(self) -> None:
+        while True:
+            # a boost during the refresh triggers the next one right away
+            self._wakeup.clear()
+            await self.refresh()
+            interval = self.fast_interval if time.monotonic() < self._fast_until else self.interval
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), interval)
+
+    def _encode(self) -> bytes:
+        return json.dumps({
+            "updated_at": self._updated_at,
+            "error": self._error,
+            "services": [service.to_dict() for service in self._services],
+        }).encode("utf-8")
+
+
+def _to_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
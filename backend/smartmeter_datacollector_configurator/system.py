@@ -1,12 +1,23 @@
 import asyncio
+import collections
+import contextlib
+import functools
+import json
 import logging
-import subprocess
-from typing import List
+import os
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
 
-LOGGER = logging.getLogger("uvicorn.error")
+from smartmeter_datacollector_configurator import shared
+from smartmeter_datacollector_configurator.events import EventBroadcaster
+from smartmeter_datacollector_configurator.io_executor import run_io
+# the errors of the service managers are raised by the functions of this module
+from smartmeter_datacollector_configurator.services import (GeneralSystemError, NoPermissionError, NotInstalledError,
+                                                            ServiceManager, SystemctlServiceManager)
+from smartmeter_datacollector_configurator.watcher import CoalescedRefresh
 
-SYSCTL_BIN = "/bin/systemctl"
-LS_BIN = "/bin/ls"
+LOGGER = logging.getLogger("uvicorn.error")
 
 DATACOL_SERVICE = "smartmeter-datacollector"
 
@@ -15,114 +26,476 @@ BROKER_SERVICE = "mosquitto"
 TELEGRAF_SERVICE = "telegraf"
 INFLUX_SERVICE = "influxdb"
 GRAFANA_SERVICE = "grafana-server"
+DEMO_SERVICES = [
+    GRAFANA_SERVICE,
+    TELEGRAF_SERVICE,
+    INFLUX_SERVICE,
+    BROKER_SERVICE
+]
 
+# Services which have to be running before the key service is started.
+DEMO_DEPENDENCIES = {
+    TELEGRAF_SERVICE: [BROKER_SERVICE, INFLUX_SERVICE],
+    GRAFANA_SERVICE: [INFLUX_SERVICE],
+}
+# Seconds a single systemctl stop/start of a demo service may take.
+DEMO_STEP_TIMEOUT = 30.0
 
-class NoPermissionError(Exception):
-    pass
+# Number of finished jobs kept for status queries.
+MAX_FINISHED_JOBS = 16
+# Interval of polling a job run by another worker process (seconds).
+REMOTE_JOB_POLL_INTERVAL = 0.2
 
+# Installed units rarely change, the discovery result is reused for this many seconds.
+DEMO_DISCOVERY_TTL = 60.0
 
-class NotInstalledError(Exception):
-    pass
 
+_service_manager: ServiceManager = SystemctlServiceManager()
 
-class GeneralSystemError(Exception):
-    pass
 
+def get_service_manager() -> ServiceManager:
+    return _service_manager
+
+
+def set_service_manager(manager: ServiceManager) -> ServiceManager:
+    """Replaces the backend used for all services, returns the previous one."""
+    global _service_manager  # pylint: disable=global-statement
+    previous, _service_manager = _service_manager, manager
+    invalidate_demo_services_cache()
+    return previous
 
-async def restart_datacollector() -> None:
-    proc = await asyncio.create_subprocess_exec(
-        SYSCTL_BIN,
-        "restart",
-        DATACOL_SERVICE)
 
-    return_code = await proc.wait()
-    _check_for_error(return_code, DATACOL_SERVICE)
+async def restart_datacollector() -> None:
+    await _control("restart", DATACOL_SERVICE)
     LOGGER.info("%s successfully restarted.", DATACOL_SERVICE)
 
 
+async def query_unit_status(services: List[str]) -> List[Dict[str, str]]:
+    """Returns the status properties (services.STATUS_PROPERTIES) of the services with a single query."""
+    return await _service_manager.status(services)
+
+
+class DemoServiceDiscovery:
+    """Caches the installed demo services for DEMO_DISCOVERY_TTL seconds.
+
+    Concurrent callers share one running discovery instead of spawning their own.
+    """
+
+    def __init__(self) -> None:
+        self._cache: Optional[Tuple[float, List[str]]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def get(self) -> List[str]:
+        if self._cache and time.monotonic() - self._cache[0] < DEMO_DISCOVERY_TTL:
+            return list(self._cache[1])
+
+        task = self._task
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.create_task(self._discover())
+            self._task = task
+        return list(await asyncio.shield(task))
+
+    def invalidate(self) -> None:
+        self._cache = None
+        self._task = None
+
+    async def _discover(self) -> List[str]:
+        installed = await _service_manager.installed(DEMO_SERVICES)
+        LOGGER.debug("Installed demo services: %s", installed)
+        self._cache = (time.monotonic(), installed)
+        return installed
+
+
+_demo_discovery = DemoServiceDiscovery()
+
+
 async def get_installed_demo_services() -> List[str]:
-    demo_services = [
-        GRAFANA_SERVICE,
-        TELEGRAF_SERVICE,
-        INFLUX_SERVICE,
-        BROKER_SERVICE
-    ]
-    installed = []
-    for service in demo_services:
-        proc = await asyncio.create_subprocess_exec(
-            SYSCTL_BIN,
-            "list-unit-files",
-            f"{service}.service",
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.DEVNULL)
-        await proc.wait()
-        stdout, _ = await proc.communicate() if proc.stdout else (b"", None)
-        if proc.returncode == 0 and service in (stdout.decode() if isinstance(stdout, bytes) else ""):
-            installed.append(service)
-    return installed
-
-
-_DEMO_RESTART_TASK_NAME = "restart_demo"
-
-
-async def trigger_demo_restart(services_to_restart: List[str]) -> bool:
-    all_running_task_names = {t.get_name() for t in asyncio.all_tasks() if not t.done()}
-    if _DEMO_RESTART_TASK_NAME in all_running_task_names:
-        LOGGER.warning("Demo restart already in progress.")
-        return False
-
-    asyncio.create_task(restart_demo(services_to_restart), name=_DEMO_RESTART_TASK_NAME)
-    return True
-
-
-async def restart_demo(services_to_restart: List[str]):
-    # Stop all demo services
-    for service in services_to_restart:
-        LOGGER.info("Restarting demo services. Stopping %s...", service)
-        proc = await asyncio.create_subprocess_exec(
-            SYSCTL_BIN,
-            "stop",
-            service)
-
-        return_code = await proc.wait()
-        _check_for_error(return_code, service)
-        LOGGER.info("%s successfully stopped.", service)
-
-    services_to_restart.reverse()
-    # Start all demo services in other direction
-    for service in services_to_restart:
-        LOGGER.info("Restarting demo services. Starting %s...", service)
-        proc = await asyncio.create_subprocess_exec(
-            SYSCTL_BIN,
-            "start",
-            service)
-
-        return_code = await proc.wait()
+    return await _demo_discovery.get()
+
+
+def invalidate_demo_services_cache() -> None:
+    _demo_discovery.invalidate()
+
+
+class Job:
+    """Background system task with its progress, tracked by the JobRegistry."""
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+    def __init__(self, kind: str) -> None:
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.state = self.PENDING
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.steps: Dict[str, Dict[str, Any]] = {}
+        self.error: Optional[str] = None
+        self.result: Any = None
+        self.version = 0
+        self.updates = EventBroadcaster()
+        # snapshot of a job run by another worker process, it does not change
+        self.remote = False
+        self._changed = asyncio.Event()
+        self._on_change: Optional[Callable[["Job"], None]] = None
+
+    @property
+    def done(self) -> bool:
+        return self.state in (self.SUCCEEDED, self.FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "steps": list(self.steps.values()),
+            "error": self.error,
+            "result": self.result,
+            "version": self.version,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Job":
+        """Restores the snapshot of a job run by another worker process."""
+        job = cls(data["kind"])
+        job.id = data["id"]
+        job.state = data["state"]
+        job.started_at = data["started_at"]
+        job.finished_at = data["finished_at"]
+        job.steps = {step["name"]: step for step in data["steps"]}
+        job.error = data["error"]
+        job.result = data["result"]
+        job.version = data["version"]
+        job.remote = True
+        return job
+
+    def set_step(self, name: str, state: str, error: Optional[str] = None) -> None:
+        step = {"name": name, "state": state, "error": error}
+        self.steps[name] = step
+        self.updates.publish("progress", step)
+        self._notify()
+
+    async def wait_finished(self) -> None:
+        while not self.done:
+            await self._changed.wait()
+
+    async def wait_for_change(self, since_version: int, timeout: float) -> None:
+        """Waits until the job has changed after since_version, it has finished or timeout has elapsed."""
+        if self.version != since_version or self.done:
+            return
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self._changed.wait(), timeout)
+
+    def _start(self) -> None:
+        self.state = self.RUNNING
+        self.started_at = time.time()
+        self._notify()
+
+    def _finish(self, result: Any = None, error: Optional[str] = None) -> None:
+        self.state = self.FAILED if error else self.SUCCEEDED
+        if result is not None:
+            self.result = result
+        self.error = error
+        self.finished_at = time.time()
+        self._notify()
+        self.updates.publish("done", self.to_dict())
+        self.updates.close()
+
+    def _notify(self) -> None:
+        self.version += 1
+        if self._on_change:
+            self._on_change(self)
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+class JobRegistry:
+    """Runs background jobs, at most one per key at a time, and keeps the most recent finished ones.
+
+    With a state directory the jobs are shared with the other worker processes using it: every job is saved as
+    JSON file on each change, a lock file per key keeps a key exclusive across the processes and pointer files
+    name the active job of a key and the latest job of a kind. Jobs of other processes are returned as snapshots
+    (Job.remote), wait_for_change() and events() poll them. Changes are saved on the I/O threads, changes made
+    while a save is running are saved together right after it.
+    """
+
+    def __init__(self, max_finished: int = MAX_FINISHED_JOBS, state_dir: Optional[str] = None) -> None:
+        self._jobs: Dict[str, Job] = {}
+        self._active: Dict[str, Job] = {}
+        self._latest: Dict[str, Job] = {}
+        self._finished: Deque[str] = collections.deque()
+        self._max_finished = max_finished
+        self._tasks: Set[asyncio.Task] = set()
+        self._state_dir = state_dir
+        # descriptors of the key lock files held by the active jobs of this process
+        self._key_locks: Dict[str, int] = {}
+        self._savers: Dict[str, CoalescedRefresh] = {}
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is None and self._state_dir and job_id.isalnum():
+            job = self._load(job_id)
+        return job
+
+    def latest(self, kind: str) -> Optional[Job]:
+        if self._state_dir:
+            job_id = self._read_pointer(f"{kind}.latest")
+            return self.get(job_id) if job_id else None
+        return self._latest.get(kind)
+
+    async def get_async(self, job_id: str) -> Optional[Job]:
+        """Like get(), the jobs of other processes are read on the I/O threads."""
+        if job_id in self._jobs or not self._state_dir:
+            return self._jobs.get(job_id)
+        return await run_io(self.get, job_id)
+
+    async def latest_async(self, kind: str) -> Optional[Job]:
+        if not self._state_dir:
+            return self._latest.get(kind)
+        return await run_io(self.latest, kind)
+
+    def submit(self, kind: str, func: Callable[[Job], Awaitable[Any]], key: Optional[str] = None) -> Tuple[Job, bool]:
+        """Starts func as a new job unless a job with the same key (default: kind) is still active.
+
+        Returns the new or already active job and whether it has been created.
+        """
+        key = key or kind
+        active = self._active.get(key)
+        if active:
+            return active, False
+        if self._state_dir:
+            with shared.file_lock(self._path("registry.lock")):
+                active = self._claim(key)
+                if active:
+                    return active, False
+                job = self._create(kind, key, func)
+                self._write_pointer(f"{key}.active", job.id)
+                self._write_pointer(f"{kind}.latest", job.id)
+                return job, True
+        return self._create(kind, key, func), True
+
+    async def wait_for_change(self, job: Job, since_version: int, timeout: float) -> Job:
+        """Waits like Job.wait_for_change(), returns the current state of the job."""
+        if not job.remote:
+            await job.wait_for_change(since_version, timeout)
+            return job
+        deadline = time.monotonic() + timeout
+        while job.version == since_version and not job.done and time.monotonic() < deadline:
+            await asyncio.sleep(REMOTE_JOB_POLL_INTERVAL)
+            job = await run_io(self._load, job.id) or job
+        return job
+
+    async def events(self, job: Job) -> AsyncIterator[Tuple[str, Any]]:
+        """Yields a snapshot of the job, then its progress ("progress" per step) until it is "done"."""
+        if not job.remote:
+            with job.updates.subscribe() as updates:
+                yield "snapshot", job.to_dict()
+                while (update := await updates.get()) is not None:
+                    yield update
+            return
+        yield "snapshot", job.to_dict()
+        while not job.done:
+            await asyncio.sleep(REMOTE_JOB_POLL_INTERVAL)
+            current = await run_io(self._load, job.id)
+            if current is None:
+                return
+            for name, step in current.steps.items():
+                if job.steps.get(name) != step:
+                    yield "progress", step
+            job = current
+        yield "done", job.to_dict()
+
+    def _create(self, kind: str, key: str, func: Callable[[Job], Awaitable[Any]]) -> Job:
+        job = Job(kind)
+        if self._state_dir:
+            # saved right away, the pointers written under the registry lock name it to the other processes
+            self._save(job)
+            self._savers[job.id] = CoalescedRefresh(functools.partial(self._save_async, job))
+            job._on_change = self._schedule_save  # pylint: disable=protected-access
+        self._jobs[job.id] = job
+        self._active[key] = job
+        self._latest[kind] = job
+        task = asyncio.create_task(self._run(job, key, func), name=f"job-{kind}-{job.id}")
+        # keep a reference, the event loop only holds weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def _claim(self, key: str) -> Optional[Job]:
+        """Takes the lock of the key, returns the job of another process holding it instead."""
+        fd = shared.try_lock(self._path(f"{key}.lock"))
+        if fd is None:
+            job_id = self._read_pointer(f"{key}.active")
+            job = self.get(job_id) if job_id else None
+            if job is not None:
+                return job
+            raise GeneralSystemError(f"Job of '{key}' is running in another worker but not readable.")
+        self._key_locks[key] = fd
+        return None
+
+    async def _run(self, job: Job, key: str, func: Callable[[Job], Awaitable[Any]]) -> None:
+        job._start()  # pylint: disable=protected-access
+        try:
+            result = await func(job)
+        except Exception as ex:  # pylint: disable=broad-except
+            LOGGER.error("Job %s (%s) failed. '%s'", job.kind, job.id, ex)
+            job._finish(error=str(ex) or type(ex).__name__)  # pylint: disable=protected-access
+        else:
+            job._finish(result=result)  # pylint: disable=protected-access
+        finally:
+            del self._active[key]
+            self._release(key)
+            self._retire(job)
+
+    def _release(self, key: str) -> None:
+        fd = self._key_locks.pop(key, None)
+        if fd is None:
+            return
+        with shared.file_lock(self._path("registry.lock")):
+            with contextlib.suppress(OSError):
+                os.remove(self._path(f"{key}.active"))
+            shared.release_lock(fd)
+
+    def _retire(self, job: Job) -> None:
+        self._finished.append(job.id)
+        while len(self._finished) > self._max_finished:
+            job_id = self._finished.popleft()
+            self._jobs.pop(job_id, None)
+            self._savers.pop(job_id, None)
+            if self._state_dir:
+                with contextlib.suppress(OSError):
+                    os.remove(self._path(f"{job_id}.json"))
+
+    def _save(self, job: Job) -> None:
+        try:
+            shared.write_atomically(self._path(f"{job.id}.json"), json.dumps(job.to_dict()).encode("utf-8"))
+        except (OSError, TypeError, ValueError) as ex:
+            LOGGER.warning("Unable to save state of job %s. '%s'", job.id, ex)
+
+    def _schedule_save(self, job: Job) -> None:
+        self._savers[job.id].schedule()
+
+    async def _save_async(self, job: Job) -> None:
+        try:
+            # encoded on the event loop, the job may change while it is written
+            content = json.dumps(job.to_dict()).encode("utf-8")
+            await run_io(shared.write_atomically, self._path(f"{job.id}.json"), content)
+        except (OSError, TypeError, ValueError) as ex:
+            LOGGER.warning("Unable to save state of job %s. '%s'", job.id, ex)
+
+    def _load(self, job_id: str) -> Optional[Job]:
+        content = shared.read_file(self._path(f"{job_id}.json"))
+        if content is None:
+            return None
+        return Job.from_dict(json.loads(content))
+
+    def _read_pointer(self, name: str) -> Optional[str]:
+        content = shared.read_file(self._path(name))
+        return content.decode("ascii") if content else None
+
+    def _write_pointer(self, name: str, job_id: str) -> None:
+        shared.write_atomically(self._path(name), job_id.encode("ascii"))
+
+    def _path(self, name: str) -> str:
+        return f"{self._state_dir}/{name}"
+
+
+class DemoRestart:
+    """Restarts the demo services in dependency order, independent services concurrently.
+
+    A service is stopped only after all services depending on it are stopped
+    and started only after all services it depends on are started.
+    The state of every service is reported as step of the job.
+    """
+    PENDING = "pending"
+    STOPPING = "stopping"
+    STOPPED = "stopped"
+    STARTING = "starting"
+    RUNNING = "running"
+    FAILED = "failed"
+
+    def __init__(self, services: List[str], job: Job, step_timeout: float = DEMO_STEP_TIMEOUT) -> None:
+        self.services = list(services)
+        self.job = job
+        self.step_timeout = step_timeout
+        self._stopped = {service: asyncio.Event() for service in self.services}
+        self._started = {service: asyncio.Event() for service in self.services}
+        for service in self.services:
+            job.set_step(service, self.PENDING)
+
+    async def run(self) -> None:
+        await asyncio.gather(*(self._restart_service(service) for service in self.services))
+        failed = [step["name"] for step in self.job.steps.values() if step["state"] == self.FAILED]
+        if failed:
+            raise GeneralSystemError(f"Failed to restart {', '.join(failed)}.")
+
+    async def _restart_service(self, service: str) -> None:
+        dependents = [other for other in self.services if service in DEMO_DEPENDENCIES.get(other, [])]
+        await asyncio.gather(*(self._stopped[other].wait() for other in dependents))
+        try:
+            self._set_state(service, self.STOPPING)
+            await self._step("stop", service)
+            self._set_state(service, self.STOPPED)
+        except (GeneralSystemError, NoPermissionError, NotInstalledError, asyncio.TimeoutError) as ex:
+            # the service might still be running, starting it again is harmless
+            self._set_state(service, self.FAILED, f"Stop failed: {_describe(ex)}")
+        finally:
+            self._stopped[service].set()
+
+        dependencies = [other for other in DEMO_DEPENDENCIES.get(service, []) if other in self._started]
+        await asyncio.gather(*(self._started[other].wait() for other in dependencies))
+        try:
+            self._set_state(service, self.STARTING)
+            await self._step("start", service)
+            self._set_state(service, self.RUNNING)
+        except (GeneralSystemError, NoPermissionError, NotInstalledError, asyncio.TimeoutError) as ex:
+            # dependent services are started anyway, they might work partially
+            self._set_state(service, self.FAILED, f"Start failed: {_describe(ex)}")
+        finally:
+            self._started[service].set()
+
+    async def _step(self, command: str, service: str) -> None:
+        LOGGER.info("Restarting demo services. %s %s...", command.capitalize(), service)
         try:
-            _check_for_error(return_code, service)
-        except (GeneralSystemError, NoPermissionError, NotInstalledError) as _:
-            # try to start other services even if one fails, but log the error
-            continue
-        LOGGER.info("%s successfully started.", service)
+            await asyncio.wait_for(_control(command, service), self.step_timeout)
+        except asyncio.TimeoutError:
+            LOGGER.error("Timeout while trying to %s %s.", command, service)
+            raise
 
+    def _set_state(self, service: str, state: str, error: Optional[str] = None) -> None:
+        if not error:
+            LOGGER.info("%s %s.", service, state)
+        self.job.set_step(service, state, error)
 
-def retrieve_tty_devices() -> List[str]:
-    cmd = f"{LS_BIN} /dev/serial/by-id/*"
+
+DEMO_RESTART_JOB = "demo-restart"
+
+
+def trigger_demo_restart(jobs: JobRegistry, services_to_restart: List[str]) -> Tuple[Job, bool]:
+    job, created = jobs.submit(DEMO_RESTART_JOB, functools.partial(restart_demo, services_to_restart))
+    if not created:
+        LOGGER.warning("Demo restart already in progress.")
+    return job, created
+
+
+async def restart_demo(services_to_restart: List[str], job: Job, step_timeout: float = DEMO_STEP_TIMEOUT) -> None:
+    await DemoRestart(services_to_restart, job, step_timeout).run()
+
+
+async def _control(command: str, service: str) -> None:
     try:
-        output = subprocess.run(cmd, shell=True, text=True, capture_output=True, check=True)
-    except subprocess.CalledProcessError as ex:
-        LOGGER.error("Unable to get tty devices. (%s)", ex)
-        return []
-    return output.stdout.rsplit()
-
-
-def _check_for_error(return_code: int, service: str) -> None:
-    if return_code == 4:
-        LOGGER.error("Insufficient system privileges.")
-        raise NoPermissionError("Insufficient system privileges to restart service.")
-    if return_code == 5:
-        LOGGER.error("%s is not installed.", service)
-        raise NotInstalledError(f"{service} is not installed.")
-    if return_code > 0:
-        LOGGER.error("General error %s", service)
-        raise GeneralSystemError(f"Return code: {return_code}")
+        await getattr(_service_manager, command)(service)
+    except NotInstalledError:
+        invalidate_demo_services_cache()
+        raise
+
+
+def _describe(ex: Exception) -> str:
+    if isinstance(ex, asyncio.TimeoutError):
+        return "timeout"
+    return str(ex)
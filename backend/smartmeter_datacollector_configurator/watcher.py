@@ -0,0 +1,212 @@
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from smartmeter_datacollector_configurator.io_executor import run_io
+
+LOGGER = logging.getLogger("uvicorn.error")
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+_DIR_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+             | IN_DELETE_SELF | IN_MOVE_SELF)
+_ANCESTOR_MASK = IN_CREATE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM | IN_DELETE_SELF | IN_MOVE_SELF
+_EVENT_HEADER = struct.Struct("iIII")
+
+DirectorySignature = Optional[List[Tuple[str, int, int, int]]]
+
+_background_tasks: Set[asyncio.Task] = set()
+
+
+class CoalescedRefresh:
+    """Runs the refresh coroutine function one at a time.
+
+    Calls while a refresh is running are coalesced into a single refresh started right after it.
+    """
+
+    def __init__(self, refresh: Callable[[], Awaitable[None]]) -> None:
+        self._refresh = refresh
+        self._running = False
+        self._again = False
+
+    async def __call__(self) -> None:
+        if self._running:
+            self._again = True
+            return
+        self._running = True
+        try:
+            while True:
+                self._again = False
+                await self._refresh()
+                if not self._again:
+                    break
+        finally:
+            self._running = False
+
+    def schedule(self) -> None:
+        """Refreshes in the background, usable as callback of a DirectoryWatcher."""
+        task = asyncio.create_task(self())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+
+class DirectoryWatcher:
+    """Calls callback after entries of a directory have been created, changed or removed.
+
+    Uses inotify where available and falls back to polling the directory otherwise.
+    The directory does not need to exist, its creation is reported as change as well.
+    Changes are collected for debounce seconds and reported with a single callback.
+    """
+
+    def __init__(self, path: str, callback: Callable[[], None], debounce: float = 0.2,
+                 poll_interval: float = 2.0, use_inotify: bool = True) -> None:
+        self.path = os.path.abspath(path)
+        self._callback = callback
+        self._debounce = debounce
+        self._poll_interval = poll_interval
+        self._use_inotify = use_inotify
+        self._fd: Optional[int] = None
+        self._watches: Dict[int, str] = {}
+        self._poll_task: Optional[asyncio.Task] = None
+        self._pending: Optional[asyncio.TimerHandle] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self._fd is not None
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        if self._use_inotify:
+            self._fd = _inotify_init()
+        if self._fd is not None:
+            self._loop.add_reader(self._fd, self._on_inotify_event)
+            self._arm()
+        else:
+            LOGGER.debug("inotify not available, polling %s.", self.path)
+            self._poll_task = asyncio.create_task(self._poll(directory_signature(self.path)))
+
+    def stop(self) -> None:
+        if self._pending:
+            self._pending.cancel()
+            self._pending = None
+        if self._poll_task:
+            self._poll_task.cancel()
+            self._poll_task = None
+        if self._fd is not None:
+            if self._loop:
+                self._loop.remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+            self._watches.clear()
+
+    def _schedule_callback(self) -> None:
+        if self._pending is None and self._loop:
+            self._pending = self._loop.call_later(self._debounce, self._fire)
+
+    def _fire(self) -> None:
+        self._pending = None
+        try:
+            self._callback()
+        except Exception as ex:  # pylint: disable=broad-except
+            LOGGER.error("Directory watcher callback for %s failed. '%s'", self.path, ex)
+
+    def _on_inotify_event(self) -> None:
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        rearm = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size + name_len
+            if wd not in self._watches or self._watches[wd] != self.path or mask & (IN_IGNORED | IN_DELETE_SELF):
+                rearm = True
+        if rearm:
+            self._arm()
+        self._schedule_callback()
+
+    def _arm(self) -> None:
+        """(Re-)Adds the watch for the directory or, if it does not exist, for its closest existing ancestor."""
+        for wd in list(self._watches):
+            _LIBC.inotify_rm_watch(self._fd, wd)
+        self._watches.clear()
+
+        if os.path.isdir(self.path):
+            self._add_watch(self.path, _DIR_MASK)
+            return
+        ancestor = os.path.dirname(self.path)
+        while not os.path.isdir(ancestor) and ancestor != os.path.dirname(ancestor):
+            ancestor = os.path.dirname(ancestor)
+        self._add_watch(ancestor, _ANCESTOR_MASK)
+
+    def _add_watch(self, path: str, mask: int) -> None:
+        wd = _LIBC.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            LOGGER.debug("Unable to watch %s. (errno %s)", path, ctypes.get_errno())
+            return
+        self._watches[wd] = path
+
+    async def _poll(self, signature: DirectorySignature) -> None:
+        while True:
+            await asyncio.sleep(self._poll_interval)
+            current = await run_io(directory_signature, self.path)
+            if current != signature:
+                signature = current
+                self._schedule_callback()
+
+
+def directory_signature(path: str) -> DirectorySignature:
+    try:
+        with os.scandir(path) as entries:
+            signature = []
+            for entry in entries:
+                stat = entry.stat(follow_symlinks=False)
+                signature.append((entry.name, stat.st_mtime_ns, stat.st_size, stat.st_ino))
+    except OSError:
+        return None
+    return sorted(signature)
+
+
+def _load_libc() -> Optional[ctypes.CDLL]:
+    library = ctypes.util.find_library("c")
+    if not library:
+        return None
+    try:
+        libc = ctypes.CDLL(library, use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_LIBC = _load_libc()
+
+
+def _inotify_init() -> Optional[int]:
+    if _LIBC is None:
+        return None
+    fd = _LIBC.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        LOGGER.warning("Unable to initialize inotify. (errno %s)", ctypes.get_errno())
+        return None
+    return fd
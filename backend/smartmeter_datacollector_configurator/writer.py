@@ -0,0 +1,103 @@
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+
+from smartmeter_datacollector_configurator import configurator
+from smartmeter_datacollector_configurator.dto import ConfigDto
+from smartmeter_datacollector_configurator.history import ConfigHistory
+from smartmeter_datacollector_configurator.io_executor import run_io
+
+LOGGER = logging.getLogger("uvicorn.error")
+
+# Seconds a save waits for further saves to be written together with them.
+COALESCE_WINDOW = 0.05
+
+PendingWrite = Tuple[ConfigDto, Optional[str], "asyncio.Future[str]"]
+
+
+class ConfigWriter:
+    """Single writer of the configuration files which coalesces bursts of saves into one disk write.
+
+    The saves of a burst are applied in order: each If-Match is checked against the ETag the configuration
+    has after the saves before it, but only the last accepted configuration is written.
+    """
+
+    def __init__(self, config_dir: str, history: Optional[ConfigHistory] = None,
+                 coalesce_window: float = COALESCE_WINDOW) -> None:
+        self._config_dir = config_dir
+        self._history = history
+        self._coalesce_window = coalesce_window
+        self._pending: List[PendingWrite] = []
+        self._task: Optional["asyncio.Task[None]"] = None
+        self.disk_writes = 0
+
+    async def write(self, config: ConfigDto, if_match: Optional[str] = None) -> str:
+        """Saves the configuration and returns its ETag.
+
+        Raises ConfigConflictError if if_match does not match and ConfigWriteError if writing fails.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((config, if_match, future))
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return await future
+
+    async def close(self) -> None:
+        """Waits until the pending saves are written."""
+        if self._task is not None:
+            await asyncio.shield(self._task)
+
+    async def _run(self) -> None:
+        try:
+            while self._pending:
+                await asyncio.sleep(self._coalesce_window)
+                batch, self._pending = self._pending, []
+                await self._write_batch(batch)
+        finally:
+            self._task = None
+
+    async def _write_batch(self, batch: List[PendingWrite]) -> None:
+        try:
+            current = await configurator.retrieve_cached_config_async(self._config_dir)
+        except Exception as ex:  # pylint: disable=broad-except
+            _fail(batch, ex)
+            return
+
+        etag = current.etag
+        accepted: List[Tuple[PendingWrite, str]] = []
+        for pending in batch:
+            config, if_match, future = pending
+            if if_match is not None and not configurator.etag_matches(if_match, etag):
+                _fail([pending], configurator.ConfigConflictError(etag))
+                continue
+            etag = configurator.config_etag(config)
+            accepted.append((pending, etag))
+        if not accepted:
+            return
+
+        try:
+            written = await run_io(configurator.write_config_from_dto, self._config_dir, accepted[-1][0][0],
+                                   current.etag)
+        except configurator.ConfigConflictError:
+            # changed by another endpoint meanwhile, the If-Match headers are checked again in the next round
+            LOGGER.debug("Configuration changed during coalesced write, retrying.")
+            self._pending[:0] = [pending for pending, _ in accepted]
+            return
+        except Exception as ex:  # pylint: disable=broad-except
+            _fail([pending for pending, _ in accepted], ex)
+            return
+
+        self.disk_writes += 1
+        if self._history:
+            await self._history.record_async(written)
+        if len(accepted) > 1:
+            LOGGER.debug("Coalesced %d configuration saves into one write.", len(accepted))
+        for (_, _, future), config_etag in accepted:
+            if not future.done():
+                future.set_result(config_etag)
+
+
+def _fail(batch: List[PendingWrite], ex: Exception) -> None:
+    for _, _, future in batch:
+        if not future.done():
+            future.set_exception(ex)
@@ -0,0 +1,53 @@
+from pathlib import Path
+from typing import List, Tuple
+
+import pytest
+
+from smartmeter_datacollector_configurator import services, system
+
+FAKE_SYSTEMCTL = Path(__file__).parent / "fake_systemctl.py"
+
+
+class FakeSystemctl:
+    def __init__(self, log_file: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+        self._log_file = log_file
+        self._monkeypatch = monkeypatch
+
+    def set_installed(self, *units: str) -> None:
+        self._monkeypatch.setenv("FAKE_SYSTEMCTL_UNITS", ",".join(units))
+
+    def set_failed(self, *units: str) -> None:
+        self._monkeypatch.setenv("FAKE_SYSTEMCTL_FAILED", ",".join(units))
+
+    def set_delay(self, seconds: float) -> None:
+        self._monkeypatch.setenv("FAKE_SYSTEMCTL_DELAY", str(seconds))
+
+    def set_unit_delay(self, unit: str, seconds: float) -> None:
+        self._monkeypatch.setenv("FAKE_SYSTEMCTL_UNIT_DELAYS", f"{unit}={seconds}")
+
+    def calls(self) -> List[List[str]]:
+        return [args for _, _, args in self.timed_calls()]
+
+    def timed_calls(self) -> List[Tuple[float, float, List[str]]]:
+        """Returns (start, end, arguments) of every finished invocation in order of completion."""
+        if not self._log_file.exists():
+            return []
+        calls = []
+        for line in self._log_file.read_text(encoding="utf-8").splitlines():
+            start, end, *args = line.split()
+            calls.append((float(start), float(end), args))
+        return calls
+
+
+@pytest.fixture
+def fake_systemctl(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> FakeSystemctl:
+    log_file = tmp_path / "systemctl.log"
+    monkeypatch.setattr(services, "SYSCTL_BIN", str(FAKE_SYSTEMCTL))
+    monkeypatch.setenv("FAKE_SYSTEMCTL_LOG", str(log_file))
+    monkeypatch.delenv("FAKE_SYSTEMCTL_UNITS", raising=False)
+    monkeypatch.delenv("FAKE_SYSTEMCTL_DELAY", raising=False)
+    monkeypatch.delenv("FAKE_SYSTEMCTL_UNIT_DELAYS", raising=False)
+    monkeypatch.delenv("FAKE_SYSTEMCTL_FAILED", raising=False)
+    system.invalidate_demo_services_cache()
+    yield FakeSystemctl(log_file, monkeypatch)
+    system.invalidate_demo_services_cache()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Stand-in for /bin/systemctl used by the tests.
+
+Behaviour is controlled by environment variables:
+    FAKE_SYSTEMCTL_LOG          file to which every invocation is appended as one line
+                                "<start> <end> <args...>" with monotonic timestamps
+    FAKE_SYSTEMCTL_UNITS        comma separated list of installed units (without .service suffix)
+    FAKE_SYSTEMCTL_DELAY        seconds every invocation takes
+    FAKE_SYSTEMCTL_UNIT_DELAYS  comma separated "<unit>=<seconds>" overriding the delay per unit
+    FAKE_SYSTEMCTL_FAILED       comma separated list of installed units which failed with exit code 1
+"""
+import os
+import sys
+import time
+
+
+def main() -> int:
+    start = time.monotonic()
+    args = sys.argv[1:]
+    installed = [unit for unit in os.environ.get("FAKE_SYSTEMCTL_UNITS", "").split(",") if unit]
+    command = args[0] if args else ""
+    units = [arg.removesuffix(".service") for arg in args[1:] if not arg.startswith("-")]
+
+    delay = float(os.environ.get("FAKE_SYSTEMCTL_DELAY", "0"))
+    for unit_delay in os.environ.get("FAKE_SYSTEMCTL_UNIT_DELAYS", "").split(","):
+        unit, _, seconds = unit_delay.partition("=")
+        if unit and unit in units:
+            delay = float(seconds)
+    time.sleep(delay)
+
+    log_file = os.environ.get("FAKE_SYSTEMCTL_LOG")
+    if log_file:
+        with open(log_file, "a", encoding="utf-8") as file:
+            file.write(f"{start:.6f} {time.monotonic():.6f} {' '.join(args)}\n")
+
+    if command == "list-unit-files":
+        listed = [unit for unit in units if unit in installed]
+        for unit in listed:
+            print(f"{unit}.service enabled enabled")
+        return 0 if listed else 1
+    if command == "show":
+        failed = os.environ.get("FAKE_SYSTEMCTL_FAILED", "").split(",")
+        print("\n\n".join(_show(unit, unit in installed, unit in failed) for unit in units))
+        return 0
+    if command in ("start", "stop", "restart"):
+        return 0 if all(unit in installed for unit in units) else 5
+    return 1
+
+
+def _show(unit: str, installed: bool, failed: bool) -> str:
+    if not installed:
+        return f"Id={unit}.service\nLoadState=not-found\nActiveState=inactive\nSubState=dead\n" \
+            "ActiveEnterTimestampMonotonic=0\nExecMainStatus=0"
+    if failed:
+        return f"Id={unit}.service\nLoadState=loaded\nActiveState=failed\nSubState=failed\n" \
+            "ActiveEnterTimestampMonotonic=0\nExecMainStatus=1"
+    # active since 5 seconds
+    entered = int((time.monotonic() - 5) * 1e6)
+    return f"Id={unit}.service\nLoadState=loaded\nActiveState=active\nSubState=running\n" \
+        f"ActiveEnterTimestampMonotonic={entered}\nExecMainStatus=0"
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,368 @@
+import asyncio
+import json
+import time
+import unittest.mock
+from pathlib import Path
+
+import pytest
+
+from smartmeter_datacollector_configurator import apply, configurator, system
+from smartmeter_datacollector_configurator.app import build_app
+from smartmeter_datacollector_configurator.asgi_client import basic_auth, lifespan, request
+from smartmeter_datacollector_configurator.authentication import AuthManager
+from smartmeter_datacollector_configurator.configurator import etag_matches
+from smartmeter_datacollector_configurator.devices import SerialDeviceIndex
+from smartmeter_datacollector_configurator.dto import ConfigDto, MeterDto, MeterType
+
+
+@pytest.fixture
+def app(tmp_path: Path):
+    static_dir = tmp_path / "static"
+    static_dir.mkdir()
+    (static_dir / "index.html").write_text("<html></html>", encoding="utf-8")
+    return build_app(str(tmp_path), static_dir, serial_dir=str(tmp_path / "serial" / "by-id"))
+
+
+def test_etag_matches():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('W/"abc"', '"abc"')
+    assert etag_matches('"xyz", "abc"', '"abc"')
+    assert etag_matches('*', '"abc"')
+    assert not etag_matches(None, '"abc"')
+    assert not etag_matches('"xyz"', '"abc"')
+
+
+def test_get_config_requires_authentication(app):
+    response = asyncio.run(request(app, "GET", "/api/config"))
+
+    assert response.status == 403
+
+
+def test_get_config_answers_not_modified(app):
+    async def run():
+        first = await request(app, "GET", "/api/config", headers=basic_auth())
+        second = await request(app, "GET", "/api/config",
+                               headers={**basic_auth(), "If-None-Match": first.headers["etag"]})
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert first.status == 200
+    assert ConfigDto.parse_raw(json.loads(first.body)) == ConfigDto()
+    assert second.status == 304
+    assert not second.body
+    assert second.headers["etag"] == first.headers["etag"]
+
+
+def test_post_config_changes_etag(app):
+    config = ConfigDto(meters=[MeterDto(type=MeterType.LGE450, port="/dev/port")])
+
+    async def run():
+        before = await request(app, "GET", "/api/config", headers=basic_auth())
+        posted = await request(app, "POST", "/api/config", headers=basic_auth(), body=config.json().encode())
+        after = await request(app, "GET", "/api/config",
+                              headers={**basic_auth(), "If-None-Match": before.headers["etag"]})
+        return before, posted, after
+
+    before, posted, after = asyncio.run(run())
+
+    assert posted.status == 200
+    assert after.status == 200
+    assert posted.headers["etag"] == after.headers["etag"] != before.headers["etag"]
+    assert ConfigDto.parse_raw(json.loads(after.body)) == config
+
+
+def test_post_config_rejects_stale_if_match(app):
+    config = ConfigDto(meters=[MeterDto(type=MeterType.LGE450, port="/dev/port")])
+
+    async def run():
+        loaded = await request(app, "GET", "/api/config", headers=basic_auth())
+        headers = {**basic_auth(), "If-Match": loaded.headers["etag"]}
+        first = await request(app, "POST", "/api/config", headers=headers, body=config.json().encode())
+        stale = await request(app, "POST", "/api/config", headers=headers, body=ConfigDto().json().encode())
+        return first, stale
+
+    first, stale = asyncio.run(run())
+
+    assert first.status == 200
+    assert stale.status == 412
+    assert stale.headers["etag"] == first.headers["etag"]
+    assert configurator.retrieve_config(app.state.config_path) == config
+
+
+def test_post_config_coalesces_burst(app):
+    configs = [ConfigDto(meters=[MeterDto(type=MeterType.LGE450, port=f"/dev/port{i}")]) for i in range(5)]
+
+    async def run():
+        return await asyncio.gather(*(request(app, "POST", "/api/config", headers=basic_auth(),
+                                              body=config.json().encode()) for config in configs))
+
+    with unittest.mock.patch.object(configurator, "_stage_file", wraps=configurator._stage_file) as stage_file:
+        responses = asyncio.run(run())
+
+    assert [response.status for response in responses] == [200] * 5
+    stage_file.assert_called_once()
+    assert app.state.config_writer.disk_writes == 1
+    # the saves are applied in order of arrival, the last one is on disk
+    etags = [response.headers["etag"] for response in responses]
+    assert len(set(etags)) == 5
+    configurator.invalidate_config_cache()
+    written = configurator.retrieve_cached_config(app.state.config_path)
+    assert written.etag in etags
+    assert written.dto == configs[etags.index(written.etag)]
+
+
+def test_get_config_served_during_slow_write(app, monkeypatch):
+    original_stage = configurator._stage_file
+
+    def slow_stage(*args):
+        time.sleep(0.5)
+        return original_stage(*args)
+
+    monkeypatch.setattr(configurator, "_stage_file", slow_stage)
+    config = ConfigDto(meters=[MeterDto(type=MeterType.LGE450, port="/dev/port")])
+
+    async def run():
+        post = asyncio.create_task(
+            request(app, "POST", "/api/config", headers=basic_auth(), body=config.json().encode()))
+        await asyncio.sleep(0.05)
+        start = time.monotonic()
+        responses = await asyncio.gather(*(request(app, "GET", "/api/config", headers=basic_auth())
+                                           for _ in range(5)))
+        elapsed = time.monotonic() - start
+        assert not post.done()
+        return responses, elapsed, await post
+
+    responses, elapsed, posted = asyncio.run(run())
+
+    assert all(response.status == 200 for response in responses)
+    assert elapsed < 0.3
+    assert posted.status == 200
+
+
+def _parse_events(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+def test_restart_demo_streams_progress(app, fake_systemctl):
+    fake_systemctl.set_installed(system.BROKER_SERVICE, system.INFLUX_SERVICE)
+
+    async def run():
+        triggered = await request(app, "POST", "/api/restart-demo", headers=basic_auth())
+        progress = await request(app, "GET", "/api/restart-demo/progress", headers=basic_auth())
+        return triggered, progress
+
+    triggered, progress = asyncio.run(run())
+
+    assert triggered.status == 200
+    assert triggered.headers["location"].startswith("/api/jobs/")
+    assert progress.status == 200
+    assert progress.headers["content-type"].startswith("text/event-stream")
+    events = _parse_events(progress.text)
+    assert events[0][0] == "snapshot"
+    assert events[-1][0] == "done"
+    done = events[-1][1]
+    assert done["state"] == system.Job.SUCCEEDED
+    assert {step["state"] for step in done["steps"]} == {system.DemoRestart.RUNNING}
+
+
+def test_restart_demo_rejected_while_running(app, fake_systemctl):
+    fake_systemctl.set_installed(system.BROKER_SERVICE)
+    fake_systemctl.set_delay(0.2)
+
+    async def run():
+        first = await request(app, "POST", "/api/restart-demo", headers=basic_auth())
+        second = await request(app, "POST", "/api/restart-demo", headers=basic_auth())
+        await app.state.jobs.latest(system.DEMO_RESTART_JOB).wait_finished()
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert first.status == 200
+    assert second.status == 503
+
+
+def test_get_job_long_poll(app, fake_systemctl):
+    fake_systemctl.set_installed(system.BROKER_SERVICE)
+    fake_systemctl.set_delay(0.2)
+
+    async def run():
+        triggered = await request(app, "POST", "/api/restart-demo", headers=basic_auth())
+        location = triggered.headers["location"]
+        current = await request(app, "GET", location, headers=basic_auth())
+        version = json.loads(current.body)["version"]
+        changed = await request(app, "GET", f"{location}?wait=10&since={version}", headers=basic_auth())
+        await app.state.jobs.latest(system.DEMO_RESTART_JOB).wait_finished()
+        missing = await request(app, "GET", "/api/jobs/unknown", headers=basic_auth())
+        return version, changed, missing
+
+    version, changed, missing = asyncio.run(run())
+
+    assert changed.status == 200
+    assert json.loads(changed.body)["version"] > version
+    assert missing.status == 404
+
+
+def test_get_tty_devices(app, tmp_path: Path):
+    by_id = tmp_path / "serial" / "by-id"
+    by_id.mkdir(parents=True)
+    (tmp_path / "ttyUSB0").touch()
+    (by_id / "usb-meter").symlink_to(tmp_path / "ttyUSB0")
+
+    async def run():
+        async with lifespan(app):
+            paths = await request(app, "GET", "/api/ttydevices")
+            details = await request(app, "GET", "/api/ttydevices?details=true", headers=basic_auth())
+            hidden = await request(app, "GET", "/api/ttydevices?details=true")
+        return paths, details, hidden
+
+    paths, details, hidden = asyncio.run(run())
+
+    assert json.loads(paths.body) == [str(by_id / "usb-meter")]
+    assert json.loads(details.body)[0]["target"] == str(tmp_path / "ttyUSB0")
+    assert hidden.status == 403
+
+
+def test_tty_device_events_are_limited(app, tmp_path: Path):
+    app.state.tty_devices = SerialDeviceIndex(str(tmp_path / "serial" / "by-id"), max_subscribers=1)
+
+    async def run():
+        async with lifespan(app):
+            unauthenticated = await request(app, "GET", "/api/ttydevices/events")
+            with app.state.tty_devices.events.subscribe():
+                rejected = await request(app, "GET", "/api/ttydevices/events", headers=basic_auth())
+        return unauthenticated, rejected
+
+    unauthenticated, rejected = asyncio.run(run())
+
+    assert unauthenticated.status == 403
+    assert rejected.status == 503
+
+
+def test_probe_rejects_unknown_ports(app):
+    async def run():
+        async with lifespan(app):
+            return await request(app, "POST", "/api/ttydevices/probe", headers=basic_auth(),
+                                 body=json.dumps({"ports": ["/etc/passwd"]}).encode())
+
+    response = asyncio.run(run())
+
+    assert response.status == 400
+
+
+def test_basic_auth_uses_verified_cache(app):
+    async def run():
+        with unittest.mock.patch.object(AuthManager, "verify_password", wraps=AuthManager.verify_password) as verify:
+            responses = [await request(app, "GET", "/api/config", headers=basic_auth()) for _ in range(3)]
+            wrong = await request(app, "GET", "/api/config", headers=basic_auth("wrong_password"))
+            return responses, wrong, verify.call_count
+
+    responses, wrong, verify_count = asyncio.run(run())
+
+    assert [response.status for response in responses] == [200, 200, 200]
+    assert wrong.status == 403
+    assert verify_count == 2
+
+
+def test_set_credentials_invalidates_cached_credentials(app):
+    async def run():
+        before = await request(app, "GET", "/api/config", headers=basic_auth())
+        changed = await request(app, "POST", "/api/credentials", headers=basic_auth(), body=b"new_password")
+        old = await request(app, "GET", "/api/config", headers=basic_auth())
+        new = await request(app, "GET", "/api/config", headers=basic_auth("new_password"))
+        return before, changed, old, new
+
+    before, changed, old, new = asyncio.run(run())
+
+    assert (before.status, changed.status, old.status, new.status) == (200, 200, 403, 200)
+
+
+def test_session_token_login_and_revocation(app):
+    def bearer(token):
+        return {"Authorization": f"Bearer {token}"}
+
+    async def run():
+        login = await request(app, "POST", "/api/login", headers=basic_auth())
+        token = json.loads(login.body)["token"]
+        renewed = await request(app, "POST", "/api/login", headers=bearer(token))
+        with unittest.mock.patch.object(AuthManager, "verify_password") as verify:
+            config = await request(app, "GET", "/api/config", headers=bearer(token))
+            tampered = await request(app, "GET", "/api/config", headers=bearer(token[:-2] + "xx"))
+            verify_count = verify.call_count
+        await request(app, "POST", "/api/credentials", headers=bearer(token), body=b"new_password")
+        revoked = await request(app, "GET", "/api/config", headers=bearer(token))
+        login = await request(app, "POST", "/api/login", headers=basic_auth("new_password"))
+        token = json.loads(login.body)["token"]
+        logout = await request(app, "POST", "/api/logout", headers=bearer(token))
+        logged_out = await request(app, "GET", "/api/config", headers=bearer(token))
+        return renewed, config, tampered, verify_count, revoked, logout, logged_out
+
+    renewed, config, tampered, verify_count, revoked, logout, logged_out = asyncio.run(run())
+
+    assert renewed.status == 403
+    assert (config.status, tampered.status, verify_count) == (200, 403, 0)
+    assert revoked.status == 403
+    assert (logout.status, logged_out.status) == (200, 403)
+
+
+def test_static_files_bypass_authentication(app):
+    async def run():
+        headers = {"Authorization": "Basic invalid!"}
+        return (await request(app, "GET", "/", headers=headers),
+                await request(app, "GET", "/api/config", headers=headers))
+
+    static, api = asyncio.run(run())
+
+    assert static.status == 200
+    assert static.body == b"<html></html>"
+    assert api.status == 400
+
+
+def test_config_section_endpoints(app):
+    config = ConfigDto(meters=[MeterDto(type=MeterType.LGE450, port="/dev/port0")])
+
+    async def run():
+        posted = await request(app, "POST", "/api/config", headers=basic_auth(), body=config.json().encode())
+        added = await request(app, "PUT", "/api/config/meters/1", headers=basic_auth(),
+                              body=b'{"type": "lge360", "port": "/dev/port1"}')
+        patched = await request(app, "PATCH", "/api/config/meters/0", headers=basic_auth(),
+                                body=b'{"port": "/dev/port9"}')
+        invalid = await request(app, "PATCH", "/api/config/meters/0", headers=basic_auth(), body=b'{"port": " "}')
+        missing = await request(app, "DELETE", "/api/config/meters/5", headers=basic_auth())
+        sink = await request(app, "PUT", "/api/config/sinks/mqtt", headers=basic_auth(), body=b'{"host": "broker"}')
+        unknown = await request(app, "PUT", "/api/config/sinks/other", headers=basic_auth(), body=b'{}')
+        current = await request(app, "GET", "/api/config", headers=basic_auth())
+        return posted, added, patched, invalid, missing, sink, unknown, current
+
+    posted, added, patched, invalid, missing, sink, unknown, current = asyncio.run(run())
+
+    assert (posted.status, added.status, patched.status, sink.status) == (200, 200, 200, 200)
+    assert (invalid.status, missing.status, unknown.status) == (400, 404, 404)
+    assert len({posted.headers["etag"], added.headers["etag"], patched.headers["etag"]}) == 3
+    assert current.headers["etag"] == sink.headers["etag"]
+    stored = ConfigDto.parse_raw(json.loads(current.body))
+    assert [meter.port for meter in stored.meters] == ["/dev/port9", "/dev/port1"]
+    assert stored.mqtt_sink.host == "broker"
+
+
+def test_apply_config_runs_as_job(app, fake_systemctl):
+    fake_systemctl.set_installed(system.DATACOL_SERVICE)
+    config = ConfigDto(meters=[MeterDto(type=MeterType.LGE450, port="/dev/port")])
+
+    async def run():
+        invalid = await request(app, "POST", "/api/config/apply", headers=basic_auth(), body=b'{"log_level": "X"}')
+        applied = await request(app, "POST", "/api/config/apply", headers=basic_auth(), body=config.json().encode())
+        await app.state.jobs.latest(apply.APPLY_JOB).wait_finished()
+        job = await request(app, "GET", applied.headers["location"], headers=basic_auth())
+        return invalid, applied, job
+
+    invalid, applied, job = asyncio.run(run())
+
+    assert invalid.status == 400
+    assert applied.status == 202
+    result = json.loads(job.body)["result"]
+    assert (result["written"], result["restarted"]) == (True, True)
@@ -0,0 +1,73 @@
+import asyncio
+from configparser import ConfigParser
+from pathlib import Path
+
+from smartmeter_datacollector_configurator import apply, configurator, system
+from smartmeter_datacollector_configurator.dto import ConfigDto, MeterDto, MeterType, MqttSinkDto
+from smartmeter_datacollector_configurator.system import Job, JobRegistry
+
+
+def _config(port: str = "/dev/ttyUSB0", ca_cert: str = "CERT") -> ConfigDto:
+    return ConfigDto(meters=[MeterDto(type=MeterType.LGE450, port=port, key="secret")],
+                     mqtt_sink=MqttSinkDto(host="broker", tls=True, ca_cert=ca_cert, password="pwd", username="u"))
+
+
+def test_diff_config_is_semantic():
+    assert configurator.diff_config(_config(), _config(ca_cert="CERT  \n")) == []
+
+    changes = configurator.diff_config(_config(), ConfigDto(
+        log_level="ERROR", meters=[MeterDto(type=MeterType.LGE450, port="/dev/ttyUSB1")]))
+
+    assert [(change.section, change.key) for change in changes] == [
+        ("logging", "level"), ("meters[0]", "port"), ("meters[0]", "key"), ("mqtt_sink", "type"),
+        ("mqtt_sink", "host"), ("mqtt_sink", "port"), ("mqtt_sink", "tls"), ("mqtt_sink", "check_hostname"),
+        ("mqtt_sink", "password"), ("mqtt_sink", "username"), ("mqtt_sink", "ca_cert_sha256")]
+    key_change = changes[2].to_dict()
+    assert (key_change["old"], key_change["new"]) == ("***", None)
+
+
+def test_diff_config_ignores_ini_formatting(tmp_path: Path):
+    configurator.write_config_from_dto(str(tmp_path), _config())
+    parser = ConfigParser()
+    parser.read(tmp_path / configurator.CONFIG_FILE_NAME)
+    parser["sink0"]["tls"] = "true"
+    parser["custom"] = {"unknown": "value"}
+    with open(tmp_path / configurator.CONFIG_FILE_NAME, "w", encoding="utf-8") as file:
+        parser.write(file)
+
+    assert configurator.diff_config(configurator.retrieve_config(str(tmp_path)), _config()) == []
+
+
+def test_apply_config_skips_unchanged(tmp_path: Path, fake_systemctl):
+    fake_systemctl.set_installed(system.DATACOL_SERVICE)
+    config_dir = str(tmp_path)
+
+    async def run():
+        first = await apply.apply_config(config_dir, _config(), Job(apply.APPLY_JOB))
+        second_job = Job(apply.APPLY_JOB)
+        second = await apply.apply_config(config_dir, _config(), second_job)
+        return first, second, second_job
+
+    first, second, second_job = asyncio.run(run())
+
+    assert (first["written"], first["restarted"]) == (True, True)
+    assert (second["written"], second["restarted"], second["changes"]) == (False, False, [])
+    assert second["etag"] == first["etag"]
+    assert [step["state"] for step in second_job.steps.values()] == [apply.DONE, apply.SKIPPED, apply.SKIPPED]
+    assert fake_systemctl.calls() == [["restart", system.DATACOL_SERVICE]]
+
+
+def test_apply_config_keeps_result_if_restart_fails(tmp_path: Path, fake_systemctl):
+    async def run():
+        jobs = JobRegistry()
+        job, created = apply.trigger_apply(jobs, str(tmp_path), _config())
+        _, created_again = apply.trigger_apply(jobs, str(tmp_path), _config())
+        await job.wait_finished()
+        return job, created, created_again
+
+    job, created, created_again = asyncio.run(run())
+
+    assert (created, created_again) == (True, False)
+    assert job.state == Job.FAILED
+    assert job.result["written"] and not job.result["restarted"]
+    assert job.steps[apply.STEP_RESTART]["state"] == apply.FAILED
@@ -1,10 +1,16 @@
+import asyncio
+import threading
+import time
 import unittest.mock
 from pathlib import Path
 
 import pytest
 
-from smartmeter_datacollector_configurator.authentication import AuthManager, SetPasswordError
+from smartmeter_datacollector_configurator import shared
+from smartmeter_datacollector_configurator.authentication import (AuthManager, SessionStore, SetPasswordError,
+                                                                  SharedSessionStore, VerifiedCredentialsCache)
 from smartmeter_datacollector_configurator.dto import CredentialsDto
+from smartmeter_datacollector_configurator.io_executor import run_io
 
 
 def test_auth_check_credentials(tmp_path: Path):
@@ -24,13 +30,15 @@ def test_auth_set_credentials(tmp_path: Path):
     manager = AuthManager(str(tmp_path))
     pwd_file = tmp_path / AuthManager.PWD_FILE_NAME
 
-    assert pwd_file.read_text(encoding='utf-8') == AuthManager.DEFAULT_PASSWORD
+    assert AuthManager.verify_password(AuthManager.DEFAULT_PASSWORD, pwd_file.read_text(encoding='utf-8'))
 
     NEW_PWD = "new_password"
     cred_dto = CredentialsDto(password=NEW_PWD)
     manager.set_new_credentials(cred_dto)
 
-    assert pwd_file.read_text(encoding='utf-8') == NEW_PWD
+    stored = pwd_file.read_text(encoding='utf-8')
+    assert NEW_PWD not in stored
+    assert AuthManager.verify_password(NEW_PWD, stored)
 
     assert not manager.check_credentials(AuthManager.USERNAME, AuthManager.DEFAULT_PASSWORD)
     assert manager.check_credentials(AuthManager.USERNAME, NEW_PWD)
@@ -41,3 +49,174 @@ def test_auth_raise_error_if_unable_to_write():
         open_mock.side_effect = OSError()
         with pytest.raises(SetPasswordError):
             manager = AuthManager("/some/path")
+
+
+def test_auth_set_credentials_async(tmp_path: Path):
+    manager = AuthManager(str(tmp_path))
+    NEW_PWD = "new_password"
+
+    asyncio.run(manager.set_new_credentials_async(CredentialsDto(password=NEW_PWD)))
+
+    assert AuthManager.verify_password(NEW_PWD, (tmp_path / AuthManager.PWD_FILE_NAME).read_text(encoding='utf-8'))
+    assert manager.check_credentials(AuthManager.USERNAME, NEW_PWD)
+
+
+def test_failed_checks_do_not_delay_file_io(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    manager = AuthManager(str(tmp_path))
+    monkeypatch.setattr(AuthManager, "verify_password",
+                        staticmethod(lambda password, password_hash: time.sleep(0.3) or False))
+
+    async def run():
+        checks = [asyncio.ensure_future(manager.check_credentials_async(AuthManager.USERNAME, f"wrong{i}"))
+                  for i in range(4)]
+        await asyncio.sleep(0.05)
+        start = time.monotonic()
+        await asyncio.gather(run_io(time.sleep, 0.01), run_io(time.sleep, 0.01))
+        io_duration = time.monotonic() - start
+        return io_duration, await asyncio.gather(*checks)
+
+    io_duration, results = asyncio.run(run())
+
+    assert io_duration < 0.2
+    assert not any(results)
+
+
+def test_password_file_edited_by_hand_is_reloaded_off_loop(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    manager = AuthManager(str(tmp_path))
+    monkeypatch.setattr(manager, "PASSWORD_CHECK_INTERVAL", 0)
+    assert manager.check_credentials(AuthManager.USERNAME, AuthManager.DEFAULT_PASSWORD, b"old")
+    (tmp_path / AuthManager.PWD_FILE_NAME).write_text("edited\n", encoding="utf-8")
+
+    # cached_user runs on the event loop and never touches the file
+    assert manager.cached_user(b"old") == AuthManager.USERNAME
+    asyncio.run(manager.reload_changed_password_async())
+
+    assert manager.cached_user(b"old") is None
+    assert manager.check_credentials(AuthManager.USERNAME, "edited")
+
+
+def test_file_watch_reports_change_until_marked_seen(tmp_path: Path):
+    path = tmp_path / "watched"
+    watch = shared.FileWatch(str(path))
+    path.write_text("a", encoding="utf-8")
+
+    assert watch.changed()
+    assert watch.changed()
+    watch.mark_seen()
+    assert not watch.changed()
+
+
+def test_auth_password_hash():
+    password_hash = AuthManager.hash_password("secret_password")
+
+    assert password_hash.startswith("scrypt$")
+    assert password_hash != AuthManager.hash_password("secret_password")
+    assert AuthManager.verify_password("secret_password", password_hash)
+    assert not AuthManager.verify_password("other_password", password_hash)
+    assert not AuthManager.verify_password("secret_password", "secret_password")
+
+
+def test_auth_migrates_plaintext_password_file(tmp_path: Path):
+    pwd_file = tmp_path / AuthManager.PWD_FILE_NAME
+    pwd_file.write_text("plain_password\n", encoding='utf-8')
+
+    manager = AuthManager(str(tmp_path))
+
+    stored = pwd_file.read_text(encoding='utf-8')
+    assert stored.startswith("scrypt$")
+    assert manager.check_credentials(AuthManager.USERNAME, "plain_password")
+    assert AuthManager(str(tmp_path)).check_credentials(AuthManager.USERNAME, "plain_password")
+
+
+def test_auth_caches_verified_credentials(tmp_path: Path):
+    manager = AuthManager(str(tmp_path))
+
+    with unittest.mock.patch.object(AuthManager, "verify_password", wraps=AuthManager.verify_password) as verify:
+        assert manager.check_credentials(AuthManager.USERNAME, AuthManager.DEFAULT_PASSWORD)
+        assert manager.check_credentials(AuthManager.USERNAME, AuthManager.DEFAULT_PASSWORD)
+        assert verify.call_count == 1
+
+        # failures are never cached
+        assert not manager.check_credentials(AuthManager.USERNAME, "incorrect_pw")
+        assert not manager.check_credentials(AuthManager.USERNAME, "incorrect_pw")
+        assert verify.call_count == 3
+
+
+def test_auth_cache_expires(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(AuthManager, "VERIFIED_CACHE_TTL", 0.0)
+    manager = AuthManager(str(tmp_path))
+
+    with unittest.mock.patch.object(AuthManager, "verify_password", wraps=AuthManager.verify_password) as verify:
+        assert manager.check_credentials(AuthManager.USERNAME, AuthManager.DEFAULT_PASSWORD)
+        assert manager.check_credentials(AuthManager.USERNAME, AuthManager.DEFAULT_PASSWORD)
+        assert verify.call_count == 2
+
+
+def test_auth_cache_invalidated_by_new_credentials(tmp_path: Path):
+    manager = AuthManager(str(tmp_path))
+    assert manager.check_credentials(AuthManager.USERNAME, AuthManager.DEFAULT_PASSWORD)
+
+    manager.set_new_credentials(CredentialsDto(password="new_password"))
+
+    assert not manager.check_credentials(AuthManager.USERNAME, AuthManager.DEFAULT_PASSWORD)
+
+
+def test_verified_credentials_cache_is_bounded():
+    cache = VerifiedCredentialsCache(max_size=2, ttl=60)
+    cache.put(b"a", "admin")
+    cache.put(b"b", "admin")
+    assert cache.get(b"a") == "admin"
+    cache.put(b"c", "admin")
+
+    assert cache.get(b"b") is None
+    assert cache.get(b"a") == cache.get(b"c") == "admin"
+
+
+def test_session_store_expiry_and_eviction():
+    store = SessionStore(max_sessions=2, lifetime=60, idle_timeout=10)
+    first = store.create("admin")
+    second = store.create("admin")
+    assert store.validate(first) == "admin"
+    assert store.validate("garbage") is None
+
+    # the least recently used session is evicted
+    third = store.create("admin")
+    assert store.validate(second) is None
+    assert store.validate(first) == "admin"
+    assert store.validate(third) == "admin"
+
+    with unittest.mock.patch("time.monotonic", return_value=time.monotonic() + 11):
+        assert store.validate(first) is None
+
+    expired = SessionStore(max_sessions=2, lifetime=-1, idle_timeout=10)
+    assert expired.validate(expired.create("admin")) is None
+
+
+def test_session_store_revoke_all():
+    store = SessionStore(max_sessions=2, lifetime=60, idle_timeout=10)
+    token = store.create("admin")
+    store.revoke_all()
+    assert store.validate(token) is None
+
+
+def test_shared_session_store_uses_files_off_loop(tmp_path: Path):
+    store = SharedSessionStore(max_sessions=2, lifetime=60, idle_timeout=10, state_dir=str(tmp_path))
+    threads = []
+    validate = store.validate
+
+    def recording_validate(token):
+        threads.append(threading.current_thread())
+        return validate(token)
+
+    async def run():
+        token = await store.create_async("admin")
+        with unittest.mock.patch.object(store, "validate", side_effect=recording_validate):
+            user = await store.validate_async(token)
+        await store.revoke_async(token)
+        return user, await store.validate_async(token)
+
+    user, revoked = asyncio.run(run())
+
+    assert user == "admin"
+    assert revoked is None
+    assert threads and threading.main_thread() not in threads
@@ -0,0 +1,35 @@
+import asyncio
+
+from benchmarks import suite
+from benchmarks.harness import REGISTRY, Benchmark, Result, compare, measure, run, select
+
+
+def test_measure_calibrates_loops():
+    calls = []
+    result = asyncio.run(measure(lambda: calls.append(1), rounds=3, min_round_time=0.001))
+
+    assert result.loops > 1
+    assert result.rounds == 3
+    assert len(calls) >= 3 * result.loops
+    assert 0 < result.min <= result.median
+
+
+def test_compare_flags_regressions():
+    baseline = {"a[1]": Result(10, 5, 1.0, 1.0), "b[1]": Result(10, 5, 1.0, 1.0), "gone[1]": Result(1, 5, 1, 1)}
+    current = {"a[1]": Result(10, 5, 1.1, 1.1), "b[1]": Result(10, 5, 1.5, 1.5), "new[1]": Result(1, 5, 1, 1)}
+
+    comparisons = compare(baseline, current)
+
+    assert [comp.id for comp in comparisons] == ["a[1]", "b[1]"]
+    assert [comp.is_regression(0.2) for comp in comparisons] == [False, True]
+
+
+def test_suite_benchmarks_run():
+    assert len({bench.id for bench in REGISTRY}) == len(REGISTRY)
+    assert [bench.id for bench in select(REGISTRY, "retrieve_cold")] == [
+        f"config.retrieve_cold[{size}]" for size in suite.CONFIG_SIZES]
+    benchmarks = [Benchmark("dto.json", 10, suite.dto_json), Benchmark("http.get_config", 1, suite.http_get_config)]
+
+    results = run(benchmarks, rounds=1, min_round_time=0.001, report=lambda line: None)
+
+    assert set(results) == {"dto.json[10]", "http.get_config[1]"}
@@ -0,0 +1,86 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+from smartmeter_datacollector_configurator import configurator
+from smartmeter_datacollector_configurator.app import build_app
+from smartmeter_datacollector_configurator.asgi_client import basic_auth, lifespan, request
+from smartmeter_datacollector_configurator.config_watch import ConfigWatch
+from smartmeter_datacollector_configurator.dto import ConfigDto
+
+
+def _write_ini(config_dir: Path, log_level: str) -> None:
+    (config_dir / configurator.CONFIG_FILE_NAME).write_text(f"[logging]\ndefault = {log_level}\n", encoding="utf-8")
+
+
+@pytest.mark.parametrize("use_inotify", [True, False])
+def test_hand_edits_publish_one_change(tmp_path: Path, use_inotify: bool):
+    _write_ini(tmp_path, "WARNING")
+    watch = ConfigWatch(str(tmp_path), debounce=0.1, use_inotify=use_inotify, poll_interval=0.05)
+
+    async def run():
+        await watch.start()
+        initial = watch.etag
+        events = []
+        with watch.events.subscribe() as changes:
+            for level in ("DEBUG", "INFO", "ERROR"):
+                _write_ini(tmp_path, level)
+            events.append(await asyncio.wait_for(changes.get(), 2))
+            await asyncio.sleep(0.3)
+            while not changes.empty():
+                events.append(changes.get_nowait())
+        watch.stop()
+        return initial, events
+
+    initial, events = asyncio.run(run())
+
+    current = configurator.retrieve_cached_config(str(tmp_path))
+    assert current.dto.log_level == "ERROR"
+    assert initial != current.etag
+    assert events == [("changed", {"etag": current.etag})]
+
+
+def test_unreadable_config_has_no_etag(tmp_path: Path):
+    _write_ini(tmp_path, "WARNING")
+    watch = ConfigWatch(str(tmp_path))
+
+    async def run():
+        await watch.start()
+        (tmp_path / configurator.CONFIG_FILE_NAME).write_text("[reader0]\ntype = unknown\n", encoding="utf-8")
+        with watch.events.subscribe() as changes:
+            await watch.refresh()
+            return watch.etag, changes.get_nowait()
+
+    etag, event = asyncio.run(run())
+
+    assert etag is None
+    assert event == ("changed", {"etag": None})
+
+
+def test_config_events_endpoint(tmp_path: Path):
+    static_dir = tmp_path / "static"
+    static_dir.mkdir()
+    app = build_app(str(tmp_path), static_dir, serial_dir=str(tmp_path / "serial"))
+    app.state.config_watch = ConfigWatch(str(tmp_path), max_subscribers=1, debounce=0.05)
+
+    async def run():
+        async with lifespan(app):
+            stream = asyncio.create_task(request(app, "GET", "/api/config/events", headers=basic_auth()))
+            while not app.state.config_watch.events.full:
+                await asyncio.sleep(0.01)
+            rejected = await request(app, "GET", "/api/config/events", headers=basic_auth())
+            posted = await request(app, "POST", "/api/config", headers=basic_auth(),
+                                   body=ConfigDto(log_level="DEBUG").json().encode())
+            while app.state.config_watch.etag != posted.headers["etag"]:
+                await asyncio.sleep(0.01)
+        return await stream, rejected, posted
+
+    streamed, rejected, posted = asyncio.run(run())
+
+    assert rejected.status == 503
+    events = [block.split("\n") for block in streamed.text.strip().split("\n\n")]
+    assert [(event, json.loads(data.removeprefix("data: "))) for event, data in events][-1] == \
+        ("event: changed", {"etag": posted.headers["etag"]})
+    assert events[0][0] == "event: current"
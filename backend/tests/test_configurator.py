@@ -1,11 +1,14 @@
+import json
+import unittest.mock
 from configparser import ConfigParser, NoOptionError
 from pathlib import Path
 from typing import Any, Dict
 
 import pytest
+from pydantic import ValidationError
 
 import smartmeter_datacollector_configurator.configurator as configurator
-from smartmeter_datacollector_configurator.dto import ConfigDto, MeterDto, MeterType, MqttSinkDto
+from smartmeter_datacollector_configurator.dto import ConfigDto, LoggerSinkDto, MeterDto, MeterType, MqttSinkDto
 
 
 @pytest.fixture
@@ -170,3 +173,206 @@ def test_write_config_with_ca_cert_to_file(cfg_with_ca: Dict[str, Any], tmp_path
     assert parser.get("sink0", "ca_file_path") == str(tmp_path / configurator.CA_FILE_NAME)
 
     assert ca_file_path.read_text(encoding='utf-8') == TEST_CA
+
+
+def test_retrieve_config_is_cached_until_file_changes(cfg_basic: Dict[str, Any], tmp_path: Path):
+    file_path = tmp_path / configurator.CONFIG_FILE_NAME
+    parser = ConfigParser()
+    parser.read_dict(cfg_basic)
+    with open(file_path, 'w', encoding="utf-8") as file:
+        parser.write(file, True)
+
+    with unittest.mock.patch.object(configurator, "_read_config_file", wraps=configurator._read_config_file) as read_mock:
+        first = configurator.retrieve_cached_config(str(tmp_path))
+        second = configurator.retrieve_cached_config(str(tmp_path))
+        assert read_mock.call_count == 1
+        assert first is second
+
+        parser["reader0"]["port"] = "/test/other_port"
+        with open(file_path, 'w', encoding="utf-8") as file:
+            parser.write(file, True)
+        third = configurator.retrieve_cached_config(str(tmp_path))
+
+        assert read_mock.call_count == 2
+        assert third.dto.meters[0].port == "/test/other_port"
+        assert third.etag != first.etag
+
+
+def test_retrieve_config_cache_invalidated_by_ca_file(cfg_with_ca: Dict[str, Any], tmp_path: Path):
+    file_path = tmp_path / configurator.CONFIG_FILE_NAME
+    ca_file_path = tmp_path / configurator.CA_FILE_NAME
+    parser = ConfigParser()
+    parser.read_dict(cfg_with_ca)
+    with open(file_path, 'w', encoding="utf-8") as file:
+        parser.write(file, True)
+
+    assert configurator.retrieve_config(str(tmp_path)).mqtt_sink.ca_cert is None
+
+    ca_file_path.write_text("CA_CERT", encoding='utf-8')
+
+    assert configurator.retrieve_config(str(tmp_path)).mqtt_sink.ca_cert == "CA_CERT"
+
+
+def test_retrieve_config_returns_independent_copy(cfg_basic: Dict[str, Any], tmp_path: Path):
+    parser = ConfigParser()
+    parser.read_dict(cfg_basic)
+    with open(tmp_path / configurator.CONFIG_FILE_NAME, 'w', encoding="utf-8") as file:
+        parser.write(file, True)
+
+    dto = configurator.retrieve_config(str(tmp_path))
+    dto.meters.clear()
+
+    assert len(configurator.retrieve_config(str(tmp_path)).meters) == 1
+
+
+def test_write_config_refreshes_cache(cfg_basic: Dict[str, Any], tmp_path: Path):
+    dto = ConfigDto.parse_obj({
+        "meters": [MeterDto.parse_obj(cfg_basic["reader0"])],
+        "log_level": "ERROR",
+    })
+
+    configurator.write_config_from_dto(str(tmp_path), dto)
+
+    with unittest.mock.patch.object(configurator, "_read_config_file") as read_mock:
+        cached = configurator.retrieve_cached_config(str(tmp_path))
+        read_mock.assert_not_called()
+    assert cached.dto == dto
+    assert json.loads(json.loads(cached.body)) == dto.dict()
+
+    configurator.invalidate_config_cache(str(tmp_path))
+    assert configurator.retrieve_cached_config(str(tmp_path)).etag == cached.etag
+
+
+def _write_ini(cfg: Dict[str, Any], tmp_path: Path) -> Path:
+    file_path = tmp_path / configurator.CONFIG_FILE_NAME
+    parser = ConfigParser()
+    parser.read_dict(cfg)
+    with open(file_path, 'w', encoding="utf-8") as file:
+        parser.write(file, True)
+    return file_path
+
+
+def test_update_meter_rewrites_section_and_preserves_unknown(cfg_basic: Dict[str, Any], tmp_path: Path):
+    cfg_basic["custom"] = {"option": "kept"}
+    file_path = _write_ini(cfg_basic, tmp_path)
+
+    configurator.patch_meter(str(tmp_path), 0, {"port": "/dev/ttyUSB7"})
+    cached = configurator.update_meter(str(tmp_path), 1, MeterDto(type=MeterType.ISKRAAM550, port="/dev/ttyUSB8"))
+
+    parser = ConfigParser()
+    parser.read(file_path)
+    assert parser.sections() == ["reader0", "sink0", "logging", "custom", "reader1"]
+    assert parser["reader0"]["port"] == "/dev/ttyUSB7"
+    assert parser["reader0"]["type"] == "lge450"
+    assert parser["custom"]["option"] == "kept"
+    assert [meter.port for meter in cached.dto.meters] == ["/dev/ttyUSB7", "/dev/ttyUSB8"]
+    configurator.invalidate_config_cache()
+    assert configurator.retrieve_cached_config(str(tmp_path)).etag == cached.etag
+
+    cached = configurator.update_meter(str(tmp_path), 0, None)
+    parser = ConfigParser()
+    parser.read(file_path)
+    assert parser.sections() == ["sink0", "logging", "custom", "reader1"]
+    assert [meter.port for meter in cached.dto.meters] == ["/dev/ttyUSB8"]
+
+
+def test_update_meter_rejects_unknown_index_and_invalid_changes(cfg_basic: Dict[str, Any], tmp_path: Path):
+    file_path = _write_ini(cfg_basic, tmp_path)
+    content = file_path.read_text(encoding="utf-8")
+
+    with pytest.raises(configurator.ConfigSectionNotFoundError):
+        configurator.patch_meter(str(tmp_path), 1, {"port": "/dev/ttyUSB1"})
+    with pytest.raises(ValidationError):
+        configurator.patch_meter(str(tmp_path), 0, {"type": "unknown"})
+    assert file_path.read_text(encoding="utf-8") == content
+
+
+def test_write_replaces_files_atomically(tmp_path: Path):
+    config = ConfigDto(mqtt_sink=MqttSinkDto(host="localhost", tls=True, ca_cert="CERT"))
+    configurator.write_config_from_dto(str(tmp_path), config)
+    ini = (tmp_path / configurator.CONFIG_FILE_NAME).read_text(encoding="utf-8")
+    changed = ConfigDto(mqtt_sink=MqttSinkDto(host="localhost", tls=True, ca_cert="OTHER CERT"), log_level="DEBUG")
+
+    original_stage = configurator._stage_file
+
+    def stage_until_full(file_path, content):
+        # the CA file is staged, the INI does not fit anymore
+        if file_path.endswith(configurator.CONFIG_FILE_NAME):
+            raise OSError("disk full")
+        return original_stage(file_path, content)
+
+    with unittest.mock.patch.object(configurator, "_stage_file", side_effect=stage_until_full):
+        with pytest.raises(configurator.ConfigWriteError):
+            configurator.write_config_from_dto(str(tmp_path), changed)
+
+    # neither the CA file nor the INI has been replaced and no temporary file is left
+    assert sorted(path.name for path in tmp_path.iterdir()) == [configurator.CA_FILE_NAME,
+                                                                 configurator.CONFIG_FILE_NAME]
+    assert (tmp_path / configurator.CONFIG_FILE_NAME).read_text(encoding="utf-8") == ini
+    assert (tmp_path / configurator.CA_FILE_NAME).read_text(encoding="utf-8") == "CERT"
+    assert configurator.retrieve_config(str(tmp_path)) == config
+
+
+def test_failed_ini_replacement_restores_ca_file(tmp_path: Path):
+    config = ConfigDto(mqtt_sink=MqttSinkDto(host="localhost", tls=True, ca_cert="CERT"))
+    configurator.write_config_from_dto(str(tmp_path), config)
+    ini = (tmp_path / configurator.CONFIG_FILE_NAME).read_text(encoding="utf-8")
+    changed = ConfigDto(mqtt_sink=MqttSinkDto(host="localhost", tls=True, ca_cert="OTHER CERT"), log_level="DEBUG")
+
+    original_replace = configurator.os.replace
+
+    def replace_ca_only(src, dst):
+        if dst.endswith(configurator.CONFIG_FILE_NAME):
+            raise OSError("read-only file system")
+        original_replace(src, dst)
+
+    with unittest.mock.patch.object(configurator.os, "replace", side_effect=replace_ca_only):
+        with pytest.raises(configurator.ConfigWriteError):
+            configurator.write_config_from_dto(str(tmp_path), changed)
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [configurator.CA_FILE_NAME,
+                                                                 configurator.CONFIG_FILE_NAME]
+    assert (tmp_path / configurator.CONFIG_FILE_NAME).read_text(encoding="utf-8") == ini
+    assert (tmp_path / configurator.CA_FILE_NAME).read_text(encoding="utf-8") == "CERT"
+
+
+def test_write_checks_if_match(tmp_path: Path):
+    config = ConfigDto(logger_sink=LoggerSinkDto())
+    etag = configurator.write_config_from_dto(str(tmp_path), config).etag
+
+    cached = configurator.write_config_from_dto(str(tmp_path), ConfigDto(), etag)
+    assert cached.etag == configurator.config_etag(ConfigDto())
+    with pytest.raises(configurator.ConfigConflictError) as error:
+        configurator.write_config_from_dto(str(tmp_path), config, etag)
+    assert error.value.etag == cached.etag
+    with pytest.raises(configurator.ConfigConflictError):
+        configurator.patch_sink(str(tmp_path), "logger", {"name": "Log"}, etag)
+
+
+def test_update_skips_unchanged_files(cfg_with_ca: Dict[str, Any], tmp_path: Path):
+    _write_ini(cfg_with_ca, tmp_path)
+    (tmp_path / configurator.CA_FILE_NAME).write_text("CERT", encoding="utf-8")
+
+    with unittest.mock.patch.object(configurator, "_stage_file", wraps=configurator._stage_file) as stage_file:
+        configurator.patch_sink(str(tmp_path), "mqtt", {"host": "localhost"})
+        stage_file.assert_not_called()
+
+        configurator.patch_sink(str(tmp_path), "mqtt", {"host": "broker"})
+        # only the INI, the CA file is unchanged
+        stage_file.assert_called_once()
+        assert stage_file.call_args.args[0] == f"{tmp_path}/{configurator.CONFIG_FILE_NAME}"
+
+
+def test_update_sink(cfg_basic: Dict[str, Any], tmp_path: Path):
+    file_path = _write_ini(cfg_basic, tmp_path)
+
+    cached = configurator.update_sink(str(tmp_path), "logger", LoggerSinkDto(name="Log"))
+    assert cached.dto.logger_sink.name == "Log"
+    cached = configurator.update_sink(str(tmp_path), "mqtt", None)
+    assert cached.dto.mqtt_sink is None
+
+    parser = ConfigParser()
+    parser.read(file_path)
+    assert parser.sections() == ["reader0", "logging", "sink1"]
+    with pytest.raises(configurator.ConfigSectionNotFoundError):
+        configurator.patch_sink(str(tmp_path), "mqtt", {"host": "broker"})
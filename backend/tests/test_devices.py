@@ -0,0 +1,92 @@
+import asyncio
+import os
+from pathlib import Path
+
+import pytest
+
+from smartmeter_datacollector_configurator.devices import SerialDevice, SerialDeviceIndex
+
+
+@pytest.fixture
+def device_tree(tmp_path: Path) -> Path:
+    """Fake /dev and /sys trees with one USB serial adapter ttyUSB0."""
+    (tmp_path / "dev").mkdir()
+    for tty in ("ttyUSB0", "ttyUSB1"):
+        (tmp_path / "dev" / tty).touch()
+        usb_device = tmp_path / "devices" / f"usb-{tty}"
+        interface = usb_device / "1-1:1.0" / tty
+        interface.mkdir(parents=True)
+        (usb_device / "idVendor").write_text("0403\n", encoding="utf-8")
+        (usb_device / "idProduct").write_text("6001\n", encoding="utf-8")
+        (usb_device / "manufacturer").write_text("FTDI\n", encoding="utf-8")
+        (usb_device / "serial").write_text(f"SERIAL-{tty}\n", encoding="utf-8")
+        (tmp_path / "sys" / tty).mkdir(parents=True)
+        (tmp_path / "sys" / tty / "device").symlink_to(interface)
+    return tmp_path
+
+
+def _plug(device_tree: Path, name: str, tty: str) -> str:
+    by_id = device_tree / "serial" / "by-id"
+    by_id.mkdir(parents=True, exist_ok=True)
+    link = by_id / name
+    link.symlink_to(device_tree / "dev" / tty)
+    return str(link)
+
+
+async def _wait_for(condition, timeout: float = 5.0) -> None:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "condition not reached in time"
+        await asyncio.sleep(0.02)
+
+
+def test_index_reads_device_attributes(device_tree: Path):
+    path = _plug(device_tree, "usb-FTDI_FT232R-if00-port0", "ttyUSB0")
+    index = SerialDeviceIndex(str(device_tree / "serial" / "by-id"), str(device_tree / "sys"))
+
+    asyncio.run(index.refresh())
+
+    assert index.paths() == [path]
+    assert index.devices() == [SerialDevice(
+        path=path,
+        target=str(device_tree / "dev" / "ttyUSB0"),
+        vendor_id="0403",
+        product_id="6001",
+        manufacturer="FTDI",
+        serial="SERIAL-ttyUSB0",
+    )]
+
+
+def test_index_without_serial_directory(device_tree: Path):
+    index = SerialDeviceIndex(str(device_tree / "serial" / "by-id"), str(device_tree / "sys"))
+
+    asyncio.run(index.refresh())
+
+    assert not index.paths()
+
+
+@pytest.mark.parametrize("use_inotify", [True, False])
+def test_index_follows_hotplug(device_tree: Path, use_inotify: bool):
+    index = SerialDeviceIndex(str(device_tree / "serial" / "by-id"), str(device_tree / "sys"),
+                              use_inotify=use_inotify, poll_interval=0.05)
+
+    async def run():
+        await index.start()
+        events = []
+        with index.events.subscribe() as updates:
+            first = _plug(device_tree, "usb-meter-a", "ttyUSB0")
+            second = _plug(device_tree, "usb-meter-b", "ttyUSB1")
+            await _wait_for(lambda: len(index.paths()) == 2)
+            os.unlink(first)
+            await _wait_for(lambda: index.paths() == [second])
+            while not updates.empty():
+                events.append(await updates.get())
+        index.stop()
+        return first, second, events
+
+    first, second, events = asyncio.run(run())
+
+    assert [event for event, _ in events] == ["added", "added", "removed"]
+    assert {data["path"] for event, data in events if event == "added"} == {first, second}
+    assert events[-1][1] == {"path": first}
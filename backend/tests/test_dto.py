@@ -1,7 +1,7 @@
 import pytest
 
 from smartmeter_datacollector_configurator.dto import (ConfigDto, CredentialsDto, LoggerSinkDto, MeterDto, MeterType,
-                                                       MqttSinkDto, SinkType)
+                                                       MqttSinkDto, ProbeRequestDto, SinkType)
 
 
 def test_meter_dto_valid():
@@ -225,3 +225,14 @@ def test_credentials_dto_invalid_pwd():
 
     with pytest.raises(ValueError):
         CredentialsDto(password="1234554321123455432112345543211")
+
+
+def test_probe_request_dto():
+    assert ProbeRequestDto.parse_obj({}).ports is None
+    assert ProbeRequestDto.parse_obj({"ports": ["/dev/port"], "budget": 5}).budget == 5
+
+    with pytest.raises(ValueError):
+        ProbeRequestDto.parse_obj({"budget": 0})
+
+    with pytest.raises(ValueError):
+        ProbeRequestDto.parse_obj({"budget": 120})
@@ -0,0 +1,130 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+from smartmeter_datacollector_configurator import configurator, history
+from smartmeter_datacollector_configurator.app import build_app
+from smartmeter_datacollector_configurator.asgi_client import basic_auth, request
+from smartmeter_datacollector_configurator.dto import ConfigDto, MeterDto, MeterType, MqttSinkDto
+from smartmeter_datacollector_configurator.history import ConfigHistory
+
+
+def _config(port: str, ca_cert: str = "CERT") -> ConfigDto:
+    return ConfigDto(meters=[MeterDto(type=MeterType.LGE450, port=port, key="secret")],
+                     mqtt_sink=MqttSinkDto(host="broker", tls=True, ca_cert=ca_cert))
+
+
+def _write(config_dir: Path, config_history: ConfigHistory, config: ConfigDto) -> history.HistoryEntry:
+    return config_history.record(configurator.write_config_from_dto(str(config_dir), config))
+
+
+def _objects(config_dir: Path):
+    return sorted(path.name for path in (config_dir / history.HISTORY_DIR_NAME / history.OBJECTS_DIR_NAME).iterdir())
+
+
+def test_record_deduplicates_snapshots_and_certificates(tmp_path: Path):
+    config_history = ConfigHistory(str(tmp_path))
+
+    first = _write(tmp_path, config_history, _config("/dev/ttyUSB0"))
+    again = _write(tmp_path, config_history, _config("/dev/ttyUSB0"))
+    second = _write(tmp_path, config_history, _config("/dev/ttyUSB1"))
+    third = _write(tmp_path, config_history, _config("/dev/ttyUSB0"))
+
+    assert again == first
+    assert third.snapshot == first.snapshot
+    assert [entry.snapshot for entry in config_history.entries()] == [first.snapshot, second.snapshot,
+                                                                      first.snapshot]
+    # two snapshots sharing one certificate
+    assert len(_objects(tmp_path)) == 3
+    assert config_history.load(second.snapshot) == _config("/dev/ttyUSB1")
+
+
+def test_record_prunes_old_entries(tmp_path: Path):
+    config_history = ConfigHistory(str(tmp_path), max_entries=2)
+
+    for i in range(4):
+        _write(tmp_path, config_history, _config(f"/dev/ttyUSB{i}", ca_cert=f"CERT{i}"))
+
+    entries = config_history.entries()
+    assert len(entries) == 2
+    assert len(_objects(tmp_path)) == 4
+    with pytest.raises(history.SnapshotNotFoundError):
+        config_history.load("0" * 64)
+
+
+def test_rollback_restores_files(tmp_path: Path):
+    config_history = ConfigHistory(str(tmp_path))
+    old = _write(tmp_path, config_history, _config("/dev/ttyUSB0", ca_cert="OLD CERT"))
+    ini = (tmp_path / configurator.CONFIG_FILE_NAME).read_text(encoding="utf-8")
+    current = _write(tmp_path, config_history, ConfigDto(log_level="DEBUG"))
+
+    with pytest.raises(configurator.ConfigConflictError):
+        config_history.rollback(old.snapshot, old.etag)
+    cached = config_history.rollback(old.snapshot, current.etag)
+
+    assert cached.etag == old.etag
+    assert (tmp_path / configurator.CONFIG_FILE_NAME).read_text(encoding="utf-8") == ini
+    assert (tmp_path / configurator.CA_FILE_NAME).read_text(encoding="utf-8") == "OLD CERT"
+    assert config_history.entries()[0].source == history.SOURCE_ROLLBACK
+    configurator.invalidate_config_cache()
+    assert configurator.retrieve_config(str(tmp_path)) == _config("/dev/ttyUSB0", ca_cert="OLD CERT")
+
+
+def test_rollback_keeps_unknown_sections(tmp_path: Path):
+    (tmp_path / configurator.CONFIG_FILE_NAME).write_text(
+        "[reader0]\ntype = lge450\nport = /dev/ttyUSB0\n\n[custom]\nanswer = 42\n", encoding="utf-8")
+    config_history = ConfigHistory(str(tmp_path))
+    meter = MeterDto(type=MeterType.LGE450, port="/dev/ttyUSB1")
+    first = config_history.record(configurator.patch_meter(str(tmp_path), 0, {"port": "/dev/ttyUSB1"}))
+    ini = (tmp_path / configurator.CONFIG_FILE_NAME).read_text(encoding="utf-8")
+    configurator.patch_meter(str(tmp_path), 0, {"port": "/dev/ttyUSB2"})
+
+    config_history.rollback(first.snapshot)
+
+    assert "[custom]" in ini
+    assert (tmp_path / configurator.CONFIG_FILE_NAME).read_text(encoding="utf-8") == ini
+    configurator.invalidate_config_cache()
+    assert configurator.retrieve_config(str(tmp_path)).meters == [meter]
+
+
+def test_rollback_succeeds_if_it_cannot_be_recorded(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    config_history = ConfigHistory(str(tmp_path))
+    old = _write(tmp_path, config_history, _config("/dev/ttyUSB0"))
+    _write(tmp_path, config_history, ConfigDto(log_level="DEBUG"))
+
+    def disk_full(*args):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(config_history, "record", disk_full)
+    cached = config_history.rollback(old.snapshot)
+
+    assert cached.etag == old.etag
+    assert len(config_history.entries()) == 2
+
+
+def test_history_endpoints(tmp_path: Path):
+    static_dir = tmp_path / "static"
+    static_dir.mkdir()
+    app = build_app(str(tmp_path), static_dir, serial_dir=str(tmp_path / "serial"))
+    old, new = _config("/dev/ttyUSB0"), _config("/dev/ttyUSB1")
+
+    async def run():
+        for config in (old, new):
+            await request(app, "POST", "/api/config", headers=basic_auth(), body=config.json().encode())
+        entries = json.loads((await request(app, "GET", "/api/config/history", headers=basic_auth())).body)
+        snapshot = entries[1]["snapshot"]
+        diff = await request(app, "GET", f"/api/config/history/{snapshot}/diff", headers=basic_auth())
+        rollback = await request(app, "POST", f"/api/config/history/{snapshot}/rollback", headers=basic_auth())
+        missing = await request(app, "POST", "/api/config/history/unknown/rollback", headers=basic_auth())
+        return entries, json.loads(diff.body), rollback, missing
+
+    entries, diff, rollback, missing = asyncio.run(run())
+
+    assert len(entries) == 2
+    assert diff == [{"section": "meters[0]", "key": "port", "old": "/dev/ttyUSB1", "new": "/dev/ttyUSB0"}]
+    assert rollback.status == 200
+    assert rollback.headers["etag"] == entries[1]["etag"]
+    assert configurator.retrieve_config(str(tmp_path)) == old
+    assert missing.status == 404
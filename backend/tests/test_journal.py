@@ -0,0 +1,143 @@
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+from smartmeter_datacollector_configurator import metrics
+from smartmeter_datacollector_configurator.app import build_app
+from smartmeter_datacollector_configurator.asgi_client import basic_auth, request
+from smartmeter_datacollector_configurator.journal import LEVELS, JournalTail, parse_line
+
+
+def _producer(script: str):
+    """Command of a fake journalctl writing JSON lines."""
+    prelude = "import json, sys, time\ndef entry(message, priority=6):\n" \
+        "    print(json.dumps({'MESSAGE': message, 'PRIORITY': str(priority)}), flush=True)\n"
+    return [sys.executable, "-c", prelude + script]
+
+
+async def _collect(events):
+    return [event async for event in events]
+
+
+def test_parse_line():
+    entry = parse_line('{"MESSAGE": [104, 105], "PRIORITY": "3", "__REALTIME_TIMESTAMP": "1700000000000000"}\n')
+    plain = parse_line("not json\n")
+
+    assert entry == {"time": 1700000000.0, "priority": 3, "message": "hi"}
+    assert (plain["priority"], plain["message"]) == (LEVELS["info"], "not json")
+
+
+def test_stream_filters_by_level():
+    tail = JournalTail(_producer("entry('error', 3)\nentry('info')\nentry('debug', 7)\nprint('plain', flush=True)"))
+
+    events = asyncio.run(_collect(tail.stream(LEVELS["info"])))
+
+    assert [data["message"] for event, data in events if event == "line"] == ["error", "info", "plain"]
+    assert events[-1] == ("end", {"exit_code": 0})
+
+
+def test_restarted_reader_does_not_repeat_lines():
+    tail = JournalTail(_producer("entry('recent')"))
+
+    async def run():
+        first = await _collect(tail.stream())
+        second = await _collect(tail.stream())
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert [data["message"] for event, data in first if event == "line"] == ["recent"]
+    assert [data["message"] for event, data in second if event == "line"] == ["recent"]
+
+
+def test_overlong_line_is_skipped():
+    tail = JournalTail(_producer("entry('before')\nentry('x' * 100000)\nentry('after')\nprint('tail', end='')"))
+
+    events = asyncio.run(asyncio.wait_for(_collect(tail.stream()), 5))
+
+    assert [data["message"] for event, data in events if event == "line"] == ["before", "after", "tail"]
+    assert events[-1] == ("end", {"exit_code": 0})
+
+
+def test_failed_reader_ends_streams(monkeypatch):
+    tail = JournalTail(_producer("entry('before')\ntime.sleep(5)"))
+
+    async def broken_stream(*args, **kwargs):
+        raise RuntimeError("pipe broken")
+
+    monkeypatch.setattr(asyncio.StreamReader, "readexactly", broken_stream)
+    monkeypatch.setattr(asyncio.StreamReader, "readuntil", broken_stream)
+
+    events = asyncio.run(asyncio.wait_for(_collect(tail.stream()), 5))
+
+    assert events == [("end", {"error": "pipe broken"})]
+
+
+def test_subscribers_share_one_reader(tmp_path: Path):
+    starts = tmp_path / "starts"
+    tail = JournalTail(_producer(f"open({str(starts)!r}, 'a').write('x')\n"
+                                 "while True:\n    entry('tick')\n    time.sleep(0.01)"))
+
+    async def read(count):
+        events = tail.stream()
+        received = [await events.__anext__() for _ in range(count)]
+        await events.aclose()
+        return received
+
+    async def run():
+        first, second = await asyncio.gather(read(5), read(10))
+        await asyncio.sleep(0.05)
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert len(first) == 5 and len(second) == 10
+    assert starts.read_text() == "x"
+    assert tail.subscriber_count == 0
+
+
+def test_slow_subscriber_gets_dropped_count():
+    tail = JournalTail(_producer("for i in range(10):\n    entry(f'line {i}')\ntime.sleep(0.3)\nentry('last')"),
+                       queue_size=2)
+    dropped_before = metrics.JOURNAL_LINES_DROPPED.value()
+
+    async def run():
+        events = tail.stream()
+        received = [await events.__anext__()]
+        while len(tail.backlog) < 10:
+            await asyncio.sleep(0.01)
+        return received + await _collect(events)
+
+    events = asyncio.run(run())
+
+    dropped = [data["count"] for event, data in events if event == "dropped"]
+    lines = [data["message"] for event, data in events if event == "line"]
+    assert len(dropped) == 1
+    assert len(lines) + dropped[0] == 11
+    assert events[-3:-1] == [("dropped", {"count": dropped[0]}), ("line", events[-2][1])]
+    assert lines[-1] == "last"
+    assert metrics.JOURNAL_LINES_DROPPED.value() - dropped_before == dropped[0]
+
+
+def test_logs_endpoint(tmp_path: Path):
+    static_dir = tmp_path / "static"
+    static_dir.mkdir()
+    app = build_app(str(tmp_path), static_dir, serial_dir=str(tmp_path / "serial"))
+    app.state.journal.command = _producer("entry('warning', 4)\nentry('info')")
+
+    async def run():
+        return (await request(app, "GET", "/api/logs?level=warning", headers=basic_auth()),
+                await request(app, "GET", "/api/logs?level=loud", headers=basic_auth()),
+                await request(app, "GET", "/api/logs"))
+
+    streamed, invalid, unauthenticated = asyncio.run(run())
+
+    assert streamed.status == 200
+    assert streamed.headers["content-type"].startswith("text/event-stream")
+    blocks = [block.split("\n") for block in streamed.text.strip().split("\n\n")]
+    assert [(event, json.loads(data.removeprefix("data: "))["message"]) for event, data in blocks[:1]] == \
+        [("event: line", "warning")]
+    assert blocks[-1][0] == "event: end"
+    assert invalid.status == 400
+    assert unauthenticated.status == 403
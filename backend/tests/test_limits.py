@@ -0,0 +1,126 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from smartmeter_datacollector_configurator import configurator
+from smartmeter_datacollector_configurator.app import build_app
+from smartmeter_datacollector_configurator.asgi_client import basic_auth, request
+from smartmeter_datacollector_configurator.dto import ConfigDto
+from smartmeter_datacollector_configurator.limits import JSON_BODY_LIMIT, BodyLimitMiddleware
+
+
+@pytest.fixture
+def app(tmp_path: Path):
+    static_dir = tmp_path / "static"
+    static_dir.mkdir()
+    return build_app(str(tmp_path), static_dir, serial_dir=str(tmp_path / "serial"))
+
+
+async def _echo_length(scope, receive, send):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            break
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": str(len(body)).encode()})
+
+
+def _scope(headers=None):
+    return {"type": "http", "method": "POST", "path": "/upload", "query_string": b"",
+            "headers": [(name.encode(), value.encode()) for name, value in (headers or {}).items()]}
+
+
+async def _call(app, receive, headers=None):
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    await app(_scope(headers), receive, send)
+    return sent[0]["status"], b"".join(message.get("body", b"") for message in sent[1:])
+
+
+def test_chunked_config_within_limit_is_accepted(app, tmp_path: Path):
+    body = ConfigDto(log_level="DEBUG").json().encode()
+    chunks = [body[i:i + 16] for i in range(0, len(body), 16)]
+
+    response = asyncio.run(request(app, "POST", "/api/config", chunks=chunks,
+                                   headers={**basic_auth(), "Content-Type": "application/json"}))
+
+    assert response.status == 200
+    assert configurator.retrieve_config(str(tmp_path)).log_level == "DEBUG"
+
+
+def test_oversized_chunked_config_is_rejected(app, tmp_path: Path):
+    chunks = [b"[" + b" " * 4096] * (JSON_BODY_LIMIT // 4096 + 2)
+
+    response = asyncio.run(request(app, "POST", "/api/config", chunks=chunks, headers=basic_auth()))
+
+    assert response.status == 413
+    assert response.headers["connection"] == "close"
+    assert not (tmp_path / configurator.CONFIG_FILE_NAME).exists()
+
+
+def test_rejects_as_soon_as_the_limit_is_crossed():
+    middleware = BodyLimitMiddleware(_echo_length, max_size=100)
+    received = []
+
+    async def receive():
+        received.append(1)
+        return {"type": "http.request", "body": b"x" * 30, "more_body": True}
+
+    status, _ = asyncio.run(_call(middleware, receive))
+
+    assert status == 413
+    assert len(received) == 4
+
+
+def test_declared_length_and_content_type_are_checked_before_reading(app):
+    async def run():
+        return await asyncio.gather(
+            request(app, "POST", "/api/config", body=b"{}",
+                    headers={**basic_auth(), "Content-Length": str(JSON_BODY_LIMIT + 1)}),
+            request(app, "POST", "/api/config", body=b"{}",
+                    headers={**basic_auth(), "Content-Type": "text/plain"}),
+            request(app, "POST", "/api/credentials", body=b"{}",
+                    headers={**basic_auth(), "Content-Type": "application/json"}),
+            request(app, "POST", "/api/credentials", body=b"x" * 2048,
+                    headers={**basic_auth(), "Content-Type": "text/plain; charset=utf-8"}))
+
+    too_long, wrong_config_type, wrong_credentials_type, long_password = asyncio.run(run())
+
+    assert too_long.status == 413
+    assert wrong_config_type.status == 415
+    assert wrong_credentials_type.status == 415
+    assert long_password.status == 413
+
+
+def test_slow_client_times_out():
+    middleware = BodyLimitMiddleware(_echo_length, max_size=100, read_timeout=0.2)
+    received = []
+
+    async def receive():
+        # one byte every 50ms, each chunk in time but the body as a whole too slow
+        received.append(1)
+        await asyncio.sleep(0.05)
+        return {"type": "http.request", "body": b"x", "more_body": True}
+
+    status, body = asyncio.run(_call(middleware, receive))
+
+    assert status == 408
+    assert body == b"Request body not received in time."
+    assert len(received) < 10
+
+
+def test_complete_body_is_passed_through():
+    middleware = BodyLimitMiddleware(_echo_length, max_size=100, content_types=["application/json"])
+    messages = [{"type": "http.request", "body": b"x" * 50, "more_body": True},
+                {"type": "http.request", "body": b"x" * 50, "more_body": False}]
+
+    async def receive():
+        return messages.pop(0)
+
+    assert asyncio.run(_call(middleware, receive, {"Content-Type": "application/json"})) == (200, b"100")
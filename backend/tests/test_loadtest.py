@@ -0,0 +1,58 @@
+import asyncio
+import contextlib
+from pathlib import Path
+
+import pytest
+from starlette.applications import Starlette
+
+from smartmeter_datacollector_configurator import configurator, loadtest
+from smartmeter_datacollector_configurator.app import build_app
+from smartmeter_datacollector_configurator.asgi_client import lifespan
+
+
+def test_percentile():
+    values = [float(i) for i in range(1, 101)]
+
+    assert loadtest.percentile(values, 50) == 50.0
+    assert loadtest.percentile(values, 99) == 99.0
+    assert loadtest.percentile([3.0], 95) == 3.0
+    assert loadtest.percentile([], 50) == 0.0
+
+
+def test_parse_mix():
+    assert loadtest.parse_mix("config=2,static") == {"config": 2, "static": 1}
+    with pytest.raises(ValueError):
+        loadtest.parse_mix("unknown=1")
+    with pytest.raises(ValueError):
+        loadtest.parse_mix("config=0")
+
+
+def test_run_load(tmp_path: Path):
+    config_dir, static_dir, serial_dir = loadtest.prepare_work_dir(str(tmp_path), meters=2)
+    app = build_app(config_dir, Path(static_dir), serial_dir=serial_dir)
+    mix = loadtest.parse_mix(loadtest.DEFAULT_MIX)
+
+    with loadtest.slow_filesystem(0.001):
+        report = asyncio.run(loadtest.run_load(app, config_dir, mix, concurrency=4, duration=0.3, seed=1))
+    summary = report.to_dict()
+
+    assert configurator._file_signature.__name__ == "_file_signature"
+    assert summary["requests"] > 0
+    assert set(summary["routes"]) == set(mix)
+    assert all(route["errors"] == 0 for route in summary["routes"].values())
+    assert summary["loop_lag"]["max"] >= summary["loop_lag"]["p50"]
+
+
+def test_lifespan_reports_failed_startup():
+    async def failing_startup(_):
+        raise OSError("no such device")
+        yield  # pylint: disable=unreachable
+
+    app = Starlette(lifespan=contextlib.asynccontextmanager(failing_startup))
+
+    async def run():
+        async with lifespan(app):
+            pass
+
+    with pytest.raises(RuntimeError, match="no such device"):
+        asyncio.run(run())
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+from pathlib import Path
+
+import pytest
+
+from smartmeter_datacollector_configurator import metrics, system
+from smartmeter_datacollector_configurator.app import build_app
+from smartmeter_datacollector_configurator.asgi_client import basic_auth, request
+from smartmeter_datacollector_configurator.metrics import Registry
+
+
+def test_counter_counts_from_many_threads():
+    counter = Registry().counter("test_total", "Test.", ("kind",))
+
+    def count():
+        for _ in range(10000):
+            counter.inc("a")
+
+    threads = [threading.Thread(target=count) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter.value("a") == 40000
+    with pytest.raises(ValueError):
+        counter.inc()
+
+
+def test_exposition_format():
+    registry = Registry()
+    registry.counter("test_requests_total", "Requests.", ("route",)).inc('/a"b')
+    histogram = registry.histogram("test_duration_seconds", "Duration.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value)
+
+    assert registry.expose().splitlines() == [
+        "# HELP test_requests_total Requests.",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{route="/a\\"b"} 1',
+        "# HELP test_duration_seconds Duration.",
+        "# TYPE test_duration_seconds histogram",
+        'test_duration_seconds_bucket{le="0.1"} 1',
+        'test_duration_seconds_bucket{le="1"} 2',
+        'test_duration_seconds_bucket{le="+Inf"} 3',
+        "test_duration_seconds_sum 5.55",
+        "test_duration_seconds_count 3",
+    ]
+
+
+def test_metrics_endpoint(tmp_path: Path, fake_systemctl):
+    fake_systemctl.set_installed(system.DATACOL_SERVICE)
+    static_dir = tmp_path / "static"
+    static_dir.mkdir()
+    app = build_app(str(tmp_path), static_dir, serial_dir=str(tmp_path / "serial"))
+    requests_before = metrics.HTTP_REQUESTS.value("/api/config", "GET", "200")
+    failures_before = metrics.AUTH_ATTEMPTS.value("basic", "failure")
+    restarts_before = metrics.SYSTEMCTL_CALLS.value("restart", system.DATACOL_SERVICE, "0")
+
+    async def run():
+        await request(app, "GET", "/api/config", headers=basic_auth())
+        await request(app, "GET", "/api/config", headers=basic_auth("wrong_password"))
+        await request(app, "POST", "/api/restart", headers=basic_auth())
+        for i in range(5):
+            await request(app, f"X{i}", "/api/config")
+        return await request(app, "GET", "/metrics"), await request(app, "GET", "/metrics", headers=basic_auth())
+
+    unauthenticated, response = asyncio.run(run())
+
+    assert unauthenticated.status == 403
+    assert response.status == 200
+    assert response.headers["content-type"] == metrics.CONTENT_TYPE
+    assert metrics.HTTP_REQUESTS.value("/api/config", "GET", "200") == requests_before + 1
+    assert metrics.AUTH_ATTEMPTS.value("basic", "failure") == failures_before + 1
+    assert metrics.SYSTEMCTL_CALLS.value("restart", system.DATACOL_SERVICE, "0") == restarts_before + 1
+    assert metrics.CONFIG_CACHE.value("miss") >= 1
+    assert 'configurator_http_request_duration_seconds_bucket{route="/api/config",method="GET",le="+Inf"}' \
+        in response.text
+    assert 'configurator_systemctl_duration_seconds_count{command="restart",service="smartmeter-datacollector"}' \
+        in response.text
+    assert 'method="X0"' not in response.text
+    assert metrics.HTTP_REQUESTS.value("/api/config", "other", "405") >= 5
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import subprocess
+import sys
+import termios
+import threading
+import time
+
+from smartmeter_datacollector_configurator import probe
+from smartmeter_datacollector_configurator.dto import MeterType
+
+# Information fields of frames as pushed by the meters (payloads shortened).
+KAMSTRUP_INFO = bytes.fromhex("e6e7000f000000000c07e40a0e030c1e00ff800000020d0a0e4b616d73747275705f563030303109060101000005ff")
+LGZ_INFO = bytes.fromhex("e6e700db084c475a6700b2c41d8201553000000b21") + bytes(range(80))
+
+
+def hdlc_frame(info: bytes) -> bytes:
+    length = 2 + 1 + 1 + 1 + 2 + len(info) + 2
+    header = bytes([0xA0 | (length >> 8), length & 0xFF, 0x2B, 0x21, 0x13])
+    header += probe.hdlc_fcs(header).to_bytes(2, "little")
+    frame = header + info
+    return b"\x7e" + frame + probe.hdlc_fcs(frame).to_bytes(2, "little") + b"\x7e"
+
+
+def test_extract_hdlc_frames():
+    frame = hdlc_frame(KAMSTRUP_INFO)
+    corrupted = bytearray(frame)
+    corrupted[20] ^= 0xFF
+    buffer = bytearray(b"\x01\x02" + frame + bytes(corrupted) + frame + frame[:10])
+
+    frames = probe.extract_hdlc_frames(buffer)
+
+    assert frames == [frame[1:-1], frame[1:-1]]
+    assert buffer == bytearray(frame[:10])
+
+
+def test_classify_frames():
+    manufacturer, guesses = probe.classify_frame(hdlc_frame(KAMSTRUP_INFO)[1:-1])
+    assert manufacturer == "KAM"
+    assert [guess.meter_type for guess in guesses] == [MeterType.KAMSTRUP_HAN]
+
+    manufacturer, guesses = probe.classify_frame(hdlc_frame(LGZ_INFO)[1:-1])
+    assert manufacturer == "LGZ"
+    assert max(guesses, key=lambda guess: guess.confidence).meter_type == MeterType.LGE450
+
+    assert probe.classify_frame(hdlc_frame(b"\xe6\xe7\x00\x0f\x01\x02")[1:-1]) == (None, [])
+
+
+class FramePlayer:
+    """Writes frames to the master side of a pseudo-terminal, like a meter pushing its data."""
+
+    def __init__(self, frame: bytes) -> None:
+        self.master, slave = os.openpty()
+        self.port = os.ttyname(slave)
+        os.close(slave)
+        self._frame = frame
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._play, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        os.close(self.master)
+
+    def _play(self) -> None:
+        while not self._stop.wait(0.05):
+            if self._frame:
+                try:
+                    os.write(self.master, self._frame)
+                except OSError:
+                    pass
+
+
+def test_probe_ports_concurrently():
+    with FramePlayer(hdlc_frame(KAMSTRUP_INFO)) as kamstrup, FramePlayer(hdlc_frame(LGZ_INFO)) as lgz, \
+            FramePlayer(b"") as silent:
+        start = time.monotonic()
+        results = asyncio.run(probe.probe_ports([kamstrup.port, lgz.port, silent.port], budget=1.5, window=0.5))
+        elapsed = time.monotonic() - start
+
+    assert elapsed < 2.5
+    kamstrup_result, lgz_result, silent_result = [result.to_dict() for result in results]
+
+    assert kamstrup_result["meter"] == {"type": "kamstrup_han", "port": kamstrup.port}
+    assert kamstrup_result["confidence"] == 1.0
+    assert kamstrup_result["frames"] >= probe.CONFIDENT_FRAMES
+
+    assert lgz_result["meter"]["type"] == "lge450"
+    assert lgz_result["manufacturer"] == "LGZ"
+    assert 0 < lgz_result["confidence"] < 1
+    assert {alternative["type"] for alternative in lgz_result["alternatives"]} == {"lge360", "lge570"}
+
+    assert silent_result["meter"] is None
+    assert silent_result["frames"] == 0
+
+
+def test_probe_inexistent_port(tmp_path):
+    result = asyncio.run(probe.probe_ports([str(tmp_path / "ttyUSB9")], budget=1))[0]
+
+    assert result.error
+    assert result.best is None
+
+
+def test_probe_restores_serial_settings():
+    with FramePlayer(hdlc_frame(KAMSTRUP_INFO)) as kamstrup:
+        fd = os.open(kamstrup.port, os.O_RDWR | os.O_NOCTTY)
+        try:
+            before = termios.tcgetattr(fd)
+            result = asyncio.run(probe.probe_ports([kamstrup.port], budget=1.5, window=0.5))[0]
+            after = termios.tcgetattr(fd)
+        finally:
+            os.close(fd)
+
+    assert result.best.meter_type == MeterType.KAMSTRUP_HAN
+    assert after == before
+
+
+def test_probe_skips_configured_and_used_ports():
+    with FramePlayer(hdlc_frame(KAMSTRUP_INFO)) as configured, FramePlayer(hdlc_frame(LGZ_INFO)) as used:
+        holder = subprocess.Popen([sys.executable, "-c", "import sys; f = open(sys.argv[1], 'rb'); sys.stdin.read()",
+                                   used.port], stdin=subprocess.PIPE)
+        try:
+            while not probe.port_in_use(used.port):
+                time.sleep(0.01)
+            results = asyncio.run(probe.probe_ports([configured.port, used.port], budget=1, window=0.5,
+                                                    skip=[configured.port]))
+        finally:
+            holder.communicate()
+
+    assert [result.error for result in results] == ["Port is configured for a meter.",
+                                                     "Port is in use by another process."]
+    assert [result.frames for result in results] == [0, 0]
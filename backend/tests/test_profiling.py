@@ -0,0 +1,90 @@
+import asyncio
+import json
+import marshal
+import time
+from pathlib import Path
+
+import pytest
+
+from smartmeter_datacollector_configurator import configurator, profiling
+from smartmeter_datacollector_configurator.app import build_app
+from smartmeter_datacollector_configurator.asgi_client import basic_auth, lifespan, request
+
+
+@pytest.fixture
+def app(tmp_path: Path):
+    static_dir = tmp_path / "static"
+    static_dir.mkdir()
+    return build_app(str(tmp_path), static_dir, serial_dir=str(tmp_path / "serial"))
+
+
+def _slow_config_read(monkeypatch):
+    original_read = configurator._read_config_file
+
+    def slow_read(*args):
+        time.sleep(0.05)
+        return original_read(*args)
+
+    monkeypatch.setattr(configurator, "_read_config_file", slow_read)
+
+
+def test_slow_requests_captured_with_profile(app, monkeypatch):
+    _slow_config_read(monkeypatch)
+    settings = {"enabled": True, "sample_rate": 1.0, "slow_request_ms": 20}
+
+    async def run():
+        configured = await request(app, "PUT", "/api/debug/profiling", headers=basic_auth(),
+                                   body=json.dumps(settings).encode())
+        await request(app, "GET", "/api/config", headers=basic_auth())
+        captures = json.loads((await request(app, "GET", "/api/debug/captures", headers=basic_auth())).body)
+        capture_id = captures[0]["id"]
+        summary = await request(app, "GET", f"/api/debug/captures/{capture_id}", headers=basic_auth())
+        profile = await request(app, "GET", f"/api/debug/captures/{capture_id}/profile", headers=basic_auth())
+        return configured, captures, summary, profile
+
+    configured, captures, summary, profile = asyncio.run(run())
+
+    assert configured.status == 200
+    assert json.loads(configured.body)["enabled"]
+    assert [(capture["kind"], capture["description"], capture["profiled"]) for capture in captures] == [
+        (profiling.KIND_REQUEST, "GET /api/config -> 200", True)]
+    assert "function calls" in summary.text
+    assert profile.headers["content-disposition"].endswith('.prof"')
+    assert marshal.loads(profile.body)
+
+
+def test_nothing_captured_while_disabled(app, monkeypatch):
+    _slow_config_read(monkeypatch)
+
+    asyncio.run(request(app, "GET", "/api/config", headers=basic_auth()))
+
+    assert app.state.profiler.captures() == []
+
+
+def test_invalid_settings_rejected(app):
+    response = asyncio.run(request(app, "PUT", "/api/debug/profiling", headers=basic_auth(),
+                                   body=json.dumps({"enabled": True, "sample_rate": 2}).encode()))
+
+    assert response.status == 400
+
+
+def _block_loop():
+    time.sleep(0.3)
+
+
+def test_loop_watchdog_captures_blocking_stack(app):
+    app.state.profiler.configure(True, loop_block_ms=50)
+
+    async def run():
+        async with lifespan(app):
+            await asyncio.sleep(0.05)
+            _block_loop()
+            await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+
+    captures = app.state.profiler.captures()
+    assert len(captures) == 1
+    assert captures[0].kind == profiling.KIND_LOOP_BLOCK
+    assert captures[0].duration >= 0.05
+    assert "_block_loop" in captures[0].summary()
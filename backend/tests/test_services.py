@@ -0,0 +1,105 @@
+import asyncio
+import json
+import time
+from pathlib import Path
+
+import pytest
+
+from smartmeter_datacollector_configurator import services, system
+from smartmeter_datacollector_configurator.app import build_app
+from smartmeter_datacollector_configurator.asgi_client import basic_auth, lifespan, request
+from smartmeter_datacollector_configurator.services import FakeServiceManager, ServiceManager
+from smartmeter_datacollector_configurator.status import StatusMonitor
+
+
+@pytest.fixture
+def fake_services():
+    manager = FakeServiceManager([system.DATACOL_SERVICE, *system.DEMO_SERVICES])
+    previous = system.set_service_manager(manager)
+    yield manager
+    system.set_service_manager(previous)
+
+
+def test_incomplete_backend_cannot_be_created():
+    class StartOnly(ServiceManager):
+        async def start(self, service: str) -> None:
+            pass
+
+    with pytest.raises(TypeError):
+        StartOnly()
+
+
+def test_demo_restart_with_fake_backend(fake_services):
+    fake_services.latency = 0.05
+
+    async def run():
+        jobs = system.JobRegistry()
+        job, _ = system.trigger_demo_restart(jobs, await system.get_installed_demo_services())
+        await job.wait_finished()
+        return job
+
+    job = asyncio.run(run())
+
+    assert job.state == system.Job.SUCCEEDED
+    calls = fake_services.calls
+    assert calls[0] == ["installed", *system.DEMO_SERVICES]
+    for service, dependencies in system.DEMO_DEPENDENCIES.items():
+        for dependency in dependencies:
+            assert calls.index(["stop", service]) < calls.index(["stop", dependency])
+            assert calls.index(["start", dependency]) < calls.index(["start", service])
+
+
+def test_demo_restart_step_timeout_with_fake_backend(fake_services):
+    fake_services.latencies[system.GRAFANA_SERVICE] = 5
+
+    async def run():
+        job = system.Job(system.DEMO_RESTART_JOB)
+        with pytest.raises(system.GeneralSystemError):
+            await system.restart_demo(system.DEMO_SERVICES, job, step_timeout=0.1)
+        return job
+
+    start = time.monotonic()
+    job = asyncio.run(run())
+
+    assert time.monotonic() - start < 2
+    assert job.steps[system.GRAFANA_SERVICE]["error"] == "Start failed: timeout"
+
+
+def test_restart_of_missing_service_fails(fake_services):
+    system.set_service_manager(FakeServiceManager())
+
+    with pytest.raises(system.NotInstalledError):
+        asyncio.run(system.restart_datacollector())
+
+
+def test_status_flow_with_fake_backend(fake_services, tmp_path: Path):
+    fake_services.fail(system.BROKER_SERVICE)
+    static_dir = tmp_path / "static"
+    static_dir.mkdir()
+    app = build_app(str(tmp_path), static_dir, serial_dir=str(tmp_path / "serial"))
+    app.state.status = StatusMonitor(fast_interval=0.01)
+
+    async def run():
+        async with lifespan(app):
+            await asyncio.sleep(0.05)
+            before = json.loads((await request(app, "GET", "/api/status", headers=basic_auth())).body)
+            await request(app, "POST", "/api/restart-demo", headers=basic_auth())
+            await app.state.jobs.latest(system.DEMO_RESTART_JOB).wait_finished()
+            await asyncio.sleep(0.05)
+            after = json.loads((await request(app, "GET", "/api/status", headers=basic_auth())).body)
+            return before, after
+
+    before, after = asyncio.run(run())
+
+    states = {service["name"]: service["active_state"] for service in before["services"]}
+    assert states[system.DATACOL_SERVICE] == "active"
+    assert states[system.BROKER_SERVICE] == "failed"
+    assert {service["active_state"] for service in after["services"]} == {"active"}
+
+
+def test_auto_backend_falls_back_to_systemctl(monkeypatch):
+    monkeypatch.setattr(services, "MessageBus", None)
+
+    assert isinstance(services.create_service_manager(), services.SystemctlServiceManager)
+    with pytest.raises(services.GeneralSystemError):
+        services.create_service_manager(services.BACKEND_DBUS)
@@ -0,0 +1,59 @@
+import json
+import os
+import subprocess
+import sys
+
+from smartmeter_datacollector_configurator import cli
+from smartmeter_datacollector_configurator.startup import cold_import, parse_importtime
+
+# Budget in seconds for a fresh interpreter to import the app, override for slow machines.
+STARTUP_BUDGET = float(os.environ.get("CONFIGURATOR_STARTUP_BUDGET", "3.0"))
+
+
+def loaded_modules(module: str):
+    code = f"import sys, {module}; print('\\n'.join(sys.modules))"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))).stdout
+    return set(output.split())
+
+
+def test_cli_does_not_import_the_web_stack():
+    modules = loaded_modules("smartmeter_datacollector_configurator.cli")
+
+    assert not {"uvicorn", "starlette", "pydantic"} & modules
+
+
+def test_app_loads_uvicorn_probe_and_profiler_lazily():
+    modules = loaded_modules("smartmeter_datacollector_configurator.app")
+
+    assert "starlette" in modules
+    assert "uvicorn" not in modules
+    assert "smartmeter_datacollector_configurator.probe" not in modules
+    assert not {"cProfile", "pstats"} & modules
+
+
+def test_load_arguments_handed_over(monkeypatch):
+    args = cli.parse_arguments(["-c", "/etc/config", "--port", "8080"])
+    monkeypatch.setenv(cli.ARGS_ENV, json.dumps(vars(args)))
+
+    assert cli.load_arguments() == args
+
+
+def test_parse_importtime():
+    output = "\n".join([
+        "import time: self [us] | cumulative | imported package",
+        "import time:       415 |       1000 |   uvicorn.config",
+        "import time:       100 |       1100 | uvicorn",
+    ])
+
+    timings = parse_importtime(output)
+
+    assert [(timing.module, timing.depth, timing.cumulative_us) for timing in timings] == [
+        ("uvicorn.config", 1, 1000), ("uvicorn", 0, 1100)]
+
+
+def test_cold_start_within_budget():
+    duration, imports = cold_import()
+
+    assert imports
+    assert duration < STARTUP_BUDGET, f"cold start took {duration:.2f} s, budget {STARTUP_BUDGET} s"
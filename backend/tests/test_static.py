@@ -0,0 +1,81 @@
+import asyncio
+import gzip
+from pathlib import Path
+
+import pytest
+
+from smartmeter_datacollector_configurator.asgi_client import request
+from smartmeter_datacollector_configurator.static import (IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL,
+                                                          PrecompressedStaticFiles, accepted_encodings,
+                                                          cache_control_for, choose_encoding)
+
+SCRIPT = b"console.log('configurator');" * 100
+
+
+@pytest.fixture
+def static_dir(tmp_path: Path) -> Path:
+    (tmp_path / "assets").mkdir()
+    (tmp_path / "index.html").write_text("<html></html>", encoding="utf-8")
+    (tmp_path / "assets" / "index-4f3a9c1e.js").write_bytes(SCRIPT)
+    (tmp_path / "assets" / "index-4f3a9c1e.js.gz").write_bytes(gzip.compress(SCRIPT))
+    (tmp_path / "assets" / "big-0badc0de.bin").write_bytes(b"\0" * 100_000)
+    return tmp_path
+
+
+def test_accepted_encodings():
+    assert accepted_encodings("gzip, deflate, br") == {"gzip", "deflate", "br"}
+    assert accepted_encodings("br;q=0, gzip;q=0.5") == {"gzip"}
+    assert accepted_encodings(None) == set()
+    assert choose_encoding("gzip, br", {"gzip": 1, "br": 2}) == "br"
+    assert choose_encoding("*", {"gzip": 1}) == "gzip"
+    assert choose_encoding("deflate", {"gzip": 1}) is None
+
+
+def test_cache_control_for():
+    assert cache_control_for("assets/index-4f3a9c1e.js") == IMMUTABLE_CACHE_CONTROL
+    assert cache_control_for("index.html") == REVALIDATE_CACHE_CONTROL
+    assert cache_control_for("favicon.ico") == REVALIDATE_CACHE_CONTROL
+
+
+@pytest.mark.parametrize("preload", [False, True])
+def test_serves_precompressed_variant(static_dir: Path, preload: bool):
+    static_files = PrecompressedStaticFiles(directory=static_dir, html=True)
+    if preload:
+        static_files.preload()
+
+    async def run():
+        compressed = await request(static_files, "GET", "/assets/index-4f3a9c1e.js",
+                                   headers={"Accept-Encoding": "gzip, deflate"})
+        plain = await request(static_files, "GET", "/assets/index-4f3a9c1e.js")
+        cached = await request(static_files, "GET", "/assets/index-4f3a9c1e.js",
+                               headers={"Accept-Encoding": "gzip", "If-None-Match": compressed.headers["etag"]})
+        return compressed, plain, cached
+
+    compressed, plain, cached = asyncio.run(run())
+
+    assert compressed.status == 200
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.headers["vary"] == "Accept-Encoding"
+    assert compressed.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    assert compressed.headers["content-type"].startswith("text/javascript")
+    assert gzip.decompress(compressed.body) == SCRIPT
+    assert "content-encoding" not in plain.headers
+    assert plain.body == SCRIPT
+    assert cached.status == 304
+
+
+def test_preload_keeps_small_files_in_memory(static_dir: Path):
+    static_files = PrecompressedStaticFiles(directory=static_dir, html=True)
+    static_files.preload()
+    (static_dir / "index.html").write_text("<html>changed</html>", encoding="utf-8")
+    (static_dir / "assets" / "big-0badc0de.bin").write_bytes(b"\1" * 10)
+
+    async def run():
+        return (await request(static_files, "GET", "/"),
+                await request(static_files, "GET", "/assets/big-0badc0de.bin"))
+
+    index, big = asyncio.run(run())
+
+    assert index.body == b"<html></html>"
+    assert index.headers["cache-control"] == REVALIDATE_CACHE_CONTROL
+    assert big.body == b"\1" * 10
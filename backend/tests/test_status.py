@@ -0,0 +1,111 @@
+import asyncio
+import json
+from pathlib import Path
+
+from smartmeter_datacollector_configurator import services, system
+from smartmeter_datacollector_configurator.app import build_app
+from smartmeter_datacollector_configurator.asgi_client import basic_auth, lifespan, request
+from smartmeter_datacollector_configurator.status import StatusMonitor
+
+
+def _show_calls(fake_systemctl):
+    return [call for call in fake_systemctl.calls() if call[0] == "show"]
+
+
+def test_refresh_queries_all_services_at_once(fake_systemctl):
+    fake_systemctl.set_installed(system.DATACOL_SERVICE, system.BROKER_SERVICE)
+    fake_systemctl.set_failed(system.BROKER_SERVICE)
+    monitor = StatusMonitor()
+
+    asyncio.run(monitor.refresh())
+
+    snapshot = json.loads(monitor.snapshot())
+    datacollector, broker = snapshot["services"]
+    assert snapshot["error"] is None
+    assert datacollector["name"] == system.DATACOL_SERVICE
+    assert (datacollector["active_state"], datacollector["sub_state"]) == ("active", "running")
+    assert 4 < datacollector["uptime"] < 60
+    assert broker == {"name": system.BROKER_SERVICE, "load_state": "loaded", "active_state": "failed",
+                      "sub_state": "failed", "uptime": None, "exit_code": 1}
+    assert len(_show_calls(fake_systemctl)) == 1
+
+
+def test_failed_query_keeps_last_snapshot(fake_systemctl, monkeypatch, tmp_path: Path):
+    fake_systemctl.set_installed(system.DATACOL_SERVICE)
+    monitor = StatusMonitor()
+    asyncio.run(monitor.refresh())
+    monkeypatch.setattr(services, "SYSCTL_BIN", str(tmp_path / "missing"))
+
+    asyncio.run(monitor.refresh())
+
+    snapshot = json.loads(monitor.snapshot())
+    assert snapshot["error"]
+    assert [service["name"] for service in snapshot["services"]] == [system.DATACOL_SERVICE]
+
+
+def test_status_endpoint_serves_snapshot(fake_systemctl, tmp_path: Path):
+    fake_systemctl.set_installed(system.DATACOL_SERVICE)
+    static_dir = tmp_path / "static"
+    static_dir.mkdir()
+    app = build_app(str(tmp_path), static_dir, serial_dir=str(tmp_path / "serial"))
+
+    async def run():
+        async with lifespan(app):
+            await app.state.status.refresh()
+            return await asyncio.gather(*(request(app, "GET", "/api/status", headers=basic_auth())
+                                          for _ in range(20)))
+
+    responses = asyncio.run(run())
+
+    assert all(response.status == 200 for response in responses)
+    assert json.loads(responses[0].body)["services"][0]["active_state"] == "active"
+    # the background refresh and the explicit one, none per request
+    assert len(_show_calls(fake_systemctl)) <= 2
+
+
+def test_boost_refreshes_at_fast_interval(fake_systemctl):
+    fake_systemctl.set_installed(system.DATACOL_SERVICE)
+    monitor = StatusMonitor(interval=60, fast_interval=0.05, fast_period=10)
+
+    async def run():
+        monitor.start()
+        await asyncio.sleep(0.3)
+        before = len(_show_calls(fake_systemctl))
+        monitor.boost()
+        await asyncio.sleep(0.6)
+        await monitor.stop()
+        return before, len(_show_calls(fake_systemctl))
+
+    before, after = asyncio.run(run())
+
+    assert before == 1
+    assert after >= 3
+
+
+def test_monitor_keeps_polling_after_unexpected_error(fake_systemctl, monkeypatch):
+    fake_systemctl.set_installed(system.DATACOL_SERVICE)
+    monitor = StatusMonitor(interval=0.05)
+    query_unit_status = system.query_unit_status
+    failures = [services.NotInstalledError("Unit not found."), RuntimeError("Bus closed.")]
+
+    async def failing_query(units):
+        if failures:
+            raise failures.pop(0)
+        return await query_unit_status(units)
+
+    monkeypatch.setattr(system, "query_unit_status", failing_query)
+
+    async def run():
+        monitor.start()
+        while not (failed := json.loads(monitor.snapshot()))["error"]:
+            await asyncio.sleep(0.01)
+        while failures or json.loads(monitor.snapshot())["error"]:
+            await asyncio.sleep(0.01)
+        await monitor.stop()
+        return failed, json.loads(monitor.snapshot())
+
+    # the monitor task has died if the snapshot stops changing
+    failed, recovered = asyncio.run(asyncio.wait_for(run(), 5))
+
+    assert failed["error"] == "Unit not found."
+    assert recovered["services"][0]["active_state"] == "active"
@@ -0,0 +1,253 @@
+import asyncio
+import json
+import time
+
+from smartmeter_datacollector_configurator import shared, system
+
+
+def test_discover_installed_demo_services_with_one_call(fake_systemctl):
+    fake_systemctl.set_installed(system.BROKER_SERVICE, system.GRAFANA_SERVICE, "other")
+
+    installed = asyncio.run(system.get_installed_demo_services())
+
+    assert installed == [system.GRAFANA_SERVICE, system.BROKER_SERVICE]
+    calls = fake_systemctl.calls()
+    assert len(calls) == 1
+    assert calls[0][0] == "list-unit-files"
+
+
+def test_discover_no_demo_services(fake_systemctl):
+    assert asyncio.run(system.get_installed_demo_services()) == []
+
+
+def test_demo_service_discovery_is_cached(fake_systemctl):
+    fake_systemctl.set_installed(system.INFLUX_SERVICE)
+
+    async def run():
+        first = await system.get_installed_demo_services()
+        second = await system.get_installed_demo_services()
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert first == second == [system.INFLUX_SERVICE]
+    assert len(fake_systemctl.calls()) == 1
+
+    system.invalidate_demo_services_cache()
+    asyncio.run(system.get_installed_demo_services())
+    assert len(fake_systemctl.calls()) == 2
+
+
+def test_demo_service_discovery_expires(fake_systemctl, monkeypatch):
+    monkeypatch.setattr(system, "DEMO_DISCOVERY_TTL", 0.0)
+
+    asyncio.run(system.get_installed_demo_services())
+    asyncio.run(system.get_installed_demo_services())
+
+    assert len(fake_systemctl.calls()) == 2
+
+
+def test_concurrent_demo_service_discovery_spawns_once(fake_systemctl):
+    fake_systemctl.set_installed(*system.DEMO_SERVICES)
+    fake_systemctl.set_delay(0.3)
+
+    async def run():
+        start = time.monotonic()
+        results = await asyncio.gather(*(system.get_installed_demo_services() for _ in range(10)))
+        return results, time.monotonic() - start
+
+    results, elapsed = asyncio.run(run())
+
+    assert all(result == system.DEMO_SERVICES for result in results)
+    assert len(fake_systemctl.calls()) == 1
+    assert elapsed < 0.3 * 2
+
+
+def _step_times(fake_systemctl):
+    return {(args[0], args[1]): (start, end) for start, end, args in fake_systemctl.timed_calls()}
+
+
+def _step_states(job):
+    return {step["name"]: step["state"] for step in job.steps.values()}
+
+
+def _run_demo_restart(services, **kwargs):
+    async def run():
+        jobs = system.JobRegistry()
+        job, _ = jobs.submit(system.DEMO_RESTART_JOB, lambda job: system.restart_demo(services, job, **kwargs))
+        await job.wait_finished()
+        return job
+
+    return asyncio.run(run())
+
+
+def test_demo_restart_respects_dependencies(fake_systemctl):
+    fake_systemctl.set_installed(*system.DEMO_SERVICES)
+    fake_systemctl.set_delay(0.1)
+
+    job = _run_demo_restart(system.DEMO_SERVICES)
+
+    assert job.state == system.Job.SUCCEEDED
+    assert set(_step_states(job).values()) == {system.DemoRestart.RUNNING}
+    steps = _step_times(fake_systemctl)
+    for service, dependencies in system.DEMO_DEPENDENCIES.items():
+        for dependency in dependencies:
+            assert steps[("stop", service)][1] <= steps[("stop", dependency)][0]
+            assert steps[("start", dependency)][1] <= steps[("start", service)][0]
+        assert steps[("stop", service)][1] <= steps[("start", service)][0]
+
+
+def test_demo_restart_runs_independent_steps_concurrently(fake_systemctl):
+    fake_systemctl.set_installed(*system.DEMO_SERVICES)
+    fake_systemctl.set_delay(0.5)
+
+    start = time.monotonic()
+    _run_demo_restart(system.DEMO_SERVICES)
+    elapsed = time.monotonic() - start
+
+    # four dependency levels instead of eight sequential steps
+    assert elapsed < 0.5 * 6
+
+
+def test_demo_restart_step_timeout(fake_systemctl):
+    fake_systemctl.set_installed(*system.DEMO_SERVICES)
+    fake_systemctl.set_unit_delay(system.GRAFANA_SERVICE, 5)
+
+    start = time.monotonic()
+    job = _run_demo_restart(system.DEMO_SERVICES, step_timeout=0.5)
+
+    assert time.monotonic() - start < 4
+    assert job.state == system.Job.FAILED
+    assert system.GRAFANA_SERVICE in job.error
+    assert job.steps[system.GRAFANA_SERVICE]["state"] == system.DemoRestart.FAILED
+    assert "timeout" in job.steps[system.GRAFANA_SERVICE]["error"]
+    assert job.steps[system.BROKER_SERVICE]["state"] == system.DemoRestart.RUNNING
+
+
+def test_demo_restart_continues_after_failure(fake_systemctl):
+    fake_systemctl.set_installed(system.TELEGRAF_SERVICE, system.BROKER_SERVICE)
+
+    job = _run_demo_restart([system.TELEGRAF_SERVICE, system.INFLUX_SERVICE, system.BROKER_SERVICE])
+
+    assert _step_states(job) == {
+        system.TELEGRAF_SERVICE: system.DemoRestart.RUNNING,
+        system.INFLUX_SERVICE: system.DemoRestart.FAILED,
+        system.BROKER_SERVICE: system.DemoRestart.RUNNING,
+    }
+
+
+def test_job_registry_deduplicates_active_jobs():
+    async def run():
+        jobs = system.JobRegistry()
+        release = asyncio.Event()
+
+        async def work(job):
+            await release.wait()
+            return 42
+
+        first, first_created = jobs.submit("work", work)
+        second, second_created = jobs.submit("work", work)
+        other, other_created = jobs.submit("work", work, key="other")
+        release.set()
+        await first.wait_finished()
+        await other.wait_finished()
+        third, third_created = jobs.submit("work", work)
+        release.set()
+        await third.wait_finished()
+        return first, first_created, second, second_created, other_created, third, third_created
+
+    first, first_created, second, second_created, other_created, third, third_created = asyncio.run(run())
+
+    assert first_created and not second_created and other_created and third_created
+    assert first is second
+    assert third is not first
+    assert first.state == system.Job.SUCCEEDED
+    assert first.result == 42
+    assert first.started_at <= first.finished_at
+
+
+def test_job_registry_records_failure():
+    async def failing(job):
+        job.set_step("step", "failed", "broken")
+        raise system.GeneralSystemError("Something went wrong.")
+
+    async def run():
+        jobs = system.JobRegistry()
+        job, _ = jobs.submit("failing", failing)
+        await job.wait_finished()
+        return jobs, job
+
+    jobs, job = asyncio.run(run())
+
+    assert job.state == system.Job.FAILED
+    assert job.error == "Something went wrong."
+    assert job.to_dict()["steps"] == [{"name": "step", "state": "failed", "error": "broken"}]
+    assert jobs.get(job.id) is job
+    assert jobs.latest("failing") is job
+
+
+def test_job_registry_retention_is_bounded():
+    async def run():
+        jobs = system.JobRegistry(max_finished=3)
+        created = []
+        for _ in range(10):
+            job, _ = jobs.submit("work", lambda job: asyncio.sleep(0))
+            await job.wait_finished()
+            created.append(job)
+        return jobs, created
+
+    jobs, created = asyncio.run(run())
+
+    assert [jobs.get(job.id) for job in created[:7]] == [None] * 7
+    assert [jobs.get(job.id) for job in created[7:]] == created[7:]
+    assert len(jobs._jobs) == 3
+
+
+def test_job_registry_coalesces_saves(tmp_path, monkeypatch):
+    writes = []
+    write_atomically = shared.write_atomically
+
+    def counting_write(path, content):
+        writes.append(path)
+        write_atomically(path, content)
+
+    monkeypatch.setattr(shared, "write_atomically", counting_write)
+
+    async def work(job: system.Job):
+        for step in range(20):
+            job.set_step(f"step {step}", "running")
+        return "result"
+
+    async def run():
+        jobs = system.JobRegistry(state_dir=str(tmp_path))
+        job, _ = jobs.submit("work", work)
+        await job.wait_finished()
+        while (await system.JobRegistry(state_dir=str(tmp_path)).get_async(job.id)).version != job.version:
+            await asyncio.sleep(0.01)
+        return job
+
+    job = asyncio.run(run())
+
+    saved = json.loads((tmp_path / f"{job.id}.json").read_text())
+    assert saved == job.to_dict()
+    assert writes.count(str(tmp_path / f"{job.id}.json")) < 10
+
+
+def test_job_wait_for_change():
+    async def run():
+        job = system.Job("work")
+        start = time.monotonic()
+        await job.wait_for_change(job.version, 0.1)
+        timed_out = time.monotonic() - start
+
+        version = job.version
+        asyncio.get_running_loop().call_later(0.05, job.set_step, "step", "running")
+        start = time.monotonic()
+        await job.wait_for_change(version, 5)
+        return timed_out, time.monotonic() - start, job.version - version
+
+    timed_out, changed, version_diff = asyncio.run(run())
+
+    assert timed_out >= 0.1
+    assert changed < 1
+    assert version_diff == 1
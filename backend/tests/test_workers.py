@@ -0,0 +1,124 @@
+import asyncio
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from smartmeter_datacollector_configurator import system
+from smartmeter_datacollector_configurator.app import build_app
+from smartmeter_datacollector_configurator.asgi_client import basic_auth, request
+from smartmeter_datacollector_configurator.authentication import AuthManager
+from smartmeter_datacollector_configurator.dto import ConfigDto
+
+BACKEND_DIR = Path(__file__).parents[1]
+
+
+@pytest.fixture
+def workers(tmp_path: Path):
+    """Two apps sharing config and state directory like two worker processes."""
+    static_dir = tmp_path / "static"
+    static_dir.mkdir()
+    state_dir = tmp_path / "state"
+    state_dir.mkdir()
+    return [build_app(str(tmp_path), static_dir, serial_dir=str(tmp_path / "serial"), state_dir=str(state_dir))
+            for _ in range(2)]
+
+
+def _bearer(token: str):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_password_change_seen_by_other_worker(workers):
+    first, second = workers
+
+    async def run():
+        login = await request(second, "POST", "/api/login", headers=basic_auth())
+        token = json.loads(login.body)["token"]
+        before = await request(second, "GET", "/api/config", headers=basic_auth())
+        changed = await request(first, "POST", "/api/credentials", headers=basic_auth(), body=b"new_password")
+        # the other worker checks the password file at most every PASSWORD_CHECK_INTERVAL
+        await asyncio.sleep(AuthManager.PASSWORD_CHECK_INTERVAL)
+        old_password = await request(second, "GET", "/api/config", headers=basic_auth())
+        new_password = await request(second, "GET", "/api/config", headers=basic_auth("new_password"))
+        old_session = await request(second, "GET", "/api/config", headers=_bearer(token))
+        return before, changed, old_password, new_password, old_session
+
+    before, changed, old_password, new_password, old_session = asyncio.run(run())
+
+    assert before.status == 200
+    assert changed.status == 200
+    assert old_password.status == 403
+    assert new_password.status == 200
+    assert old_session.status == 403
+
+
+def test_session_shared_between_workers(workers):
+    first, second = workers
+
+    async def run():
+        login = await request(first, "POST", "/api/login", headers=basic_auth())
+        token = json.loads(login.body)["token"]
+        accepted = await request(second, "GET", "/api/config", headers=_bearer(token))
+        await request(second, "POST", "/api/logout", headers=_bearer(token))
+        revoked = await request(first, "GET", "/api/config", headers=_bearer(token))
+        return accepted, revoked
+
+    accepted, revoked = asyncio.run(run())
+
+    assert accepted.status == 200
+    assert revoked.status == 403
+
+
+def test_config_written_by_other_process_is_read(workers, tmp_path: Path):
+    _, second = workers
+    before = asyncio.run(request(second, "GET", "/api/config", headers=basic_auth()))
+    write = ("from smartmeter_datacollector_configurator import configurator\n"
+             "from smartmeter_datacollector_configurator.dto import ConfigDto\n"
+             f"configurator.share_between_processes({str(tmp_path)!r}, {str(tmp_path / 'state' / 'config.lock')!r})\n"
+             f"configurator.write_config_from_dto({str(tmp_path)!r}, ConfigDto(log_level='DEBUG'))\n")
+    subprocess.run([sys.executable, "-c", write], cwd=BACKEND_DIR, check=True)
+
+    after = asyncio.run(request(second, "GET", "/api/config", headers=basic_auth()))
+
+    assert ConfigDto.parse_raw(json.loads(before.body)).log_level != "DEBUG"
+    assert ConfigDto.parse_raw(json.loads(after.body)).log_level == "DEBUG"
+    assert after.headers["etag"] != before.headers["etag"]
+
+
+def test_job_shared_between_workers(workers):
+    first, second = workers
+
+    async def run():
+        release = asyncio.Event()
+
+        async def work(job: system.Job):
+            job.set_step("step", "running")
+            await release.wait()
+            return "result"
+
+        job, created = first.state.jobs.submit("work", work)
+        await asyncio.sleep(0)
+        remote, remote_created = second.state.jobs.submit("work", work)
+        # the first worker saves the progress in the background
+        while (await second.state.jobs.get_async(job.id)).version != job.version:
+            await asyncio.sleep(0.01)
+        progress = await request(second, "GET", f"/api/jobs/{job.id}", headers=basic_auth())
+        release.set()
+        since = json.loads(progress.body)["version"]
+        finished = await request(second, "GET", f"/api/jobs/{job.id}?wait=5&since={since}", headers=basic_auth())
+        events = await request(second, "GET", f"/api/jobs/{job.id}/events", headers=basic_auth())
+        latest = second.state.jobs.latest("work")
+        return job, created, remote, remote_created, progress, finished, events, latest
+
+    job, created, remote, remote_created, progress, finished, events, latest = asyncio.run(run())
+
+    assert created
+    assert not remote_created
+    assert remote.remote and remote.id == job.id
+    assert json.loads(progress.body)["steps"] == [{"name": "step", "state": "running", "error": None}]
+    assert json.loads(finished.body)["state"] == system.Job.SUCCEEDED
+    assert json.loads(finished.body)["result"] == "result"
+    assert "event: done" in events.text
+    assert latest.id == job.id
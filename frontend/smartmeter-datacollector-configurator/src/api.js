@@ -14,13 +14,25 @@ function buildAuthHeader(auth) {
   if (!auth) {
     return {};
   }
+  if (auth.token) {
+    return { Authorization: `Bearer ${auth.token}` };
+  }
   const encoded = btoa(`${auth.username}:${auth.password}`);
   return { Authorization: `Basic ${encoded}` };
 }
 
 async function request(
   path,
-  { method = "GET", body = null, auth = null, timeout = 3000, responseType = null, contentType = null } = {},
+  {
+    method = "GET",
+    body = null,
+    auth = null,
+    timeout = 3000,
+    responseType = null,
+    contentType = null,
+    ifMatch = null,
+    withEtag = false,
+  } = {},
 ) {
   const controller = new AbortController();
   const timer = setTimeout(() => controller.abort(), timeout);
@@ -29,6 +41,9 @@ async function request(
   if (contentType) {
     headers["Content-Type"] = contentType;
   }
+  if (ifMatch) {
+    headers["If-Match"] = ifMatch;
+  }
 
   let response;
   try {
@@ -62,27 +77,102 @@ async function request(
     });
   }
 
-  return data;
+  return withEtag ? { data, etag: response.headers.get("ETag") } : data;
+}
+
+function parseEvent(block) {
+  let event = "message";
+  const dataLines = [];
+  for (const line of block.split("\n")) {
+    if (line.startsWith("event:")) {
+      event = line.slice(6).trim();
+    } else if (line.startsWith("data:")) {
+      dataLines.push(line.slice(5).trim());
+    }
+  }
+  if (dataLines.length === 0) {
+    return null;
+  }
+  return { event, data: JSON.parse(dataLines.join("\n")) };
+}
+
+async function streamEvents(path, onEvent, { auth = null, signal = null } = {}) {
+  let response;
+  try {
+    response = await fetch(`${getApiUrl()}${path}`, { headers: buildAuthHeader(auth), signal });
+  } catch {
+    throw new ApiError("Request failed.", { isResponse: false });
+  }
+  if (!response.ok) {
+    throw new ApiError(response.statusText, { status: response.status, data: await response.text(), isResponse: true });
+  }
+
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = "";
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) {
+      return;
+    }
+    buffer += value;
+    let separator;
+    while ((separator = buffer.indexOf("\n\n")) >= 0) {
+      const parsed = parseEvent(buffer.slice(0, separator));
+      buffer = buffer.slice(separator + 2);
+      if (parsed) {
+        onEvent(parsed.event, parsed.data);
+      }
+    }
+  }
 }
 
 function getTtyDevices() {
   return request("/ttydevices", { responseType: "json", timeout: 3000 });
 }
 
+function followTtyDevices(onEvent, auth, signal) {
+  return streamEvents("/ttydevices/events", onEvent, { auth, signal });
+}
+
+function login(username, password) {
+  return request("/login", { method: "POST", responseType: "json", timeout: 4000, auth: { username, password } });
+}
+
 function getConfig(auth) {
-  return request("/config", { responseType: "json", timeout: 3000, auth });
+  return request("/config", { responseType: "json", timeout: 3000, auth, withEtag: true });
 }
 
-function postConfig(configJson, auth) {
+function followConfigEvents(onEvent, auth, signal) {
+  return streamEvents("/config/events", onEvent, { auth, signal });
+}
+
+function postConfig(configJson, auth, etag = null) {
   return request("/config", {
     method: "POST",
     body: configJson,
     contentType: "application/json",
     timeout: 4000,
     auth,
+    ifMatch: etag,
   });
 }
 
+function applyConfig(configJson, auth, etag = null) {
+  return request("/config/apply", {
+    method: "POST",
+    body: configJson,
+    contentType: "application/json",
+    responseType: "json",
+    timeout: 4000,
+    auth,
+    ifMatch: etag,
+  });
+}
+
+function followJob(jobId, onEvent, auth) {
+  return streamEvents(`/jobs/${jobId}/events`, onEvent, { auth });
+}
+
 function restartDatacollector(auth) {
   return request("/restart", { method: "POST", timeout: 6000, auth });
 }
@@ -91,6 +181,10 @@ function restartDemo(auth) {
   return request("/restart-demo", { method: "POST", timeout: 8000, auth });
 }
 
+function followDemoRestart(onEvent, auth) {
+  return streamEvents("/restart-demo/progress", onEvent, { auth });
+}
+
 function changePassword(newPassword, auth) {
   return request("/credentials", {
     method: "POST",
@@ -101,4 +195,18 @@ function changePassword(newPassword, auth) {
   });
 }
 
-export { ApiError, getTtyDevices, getConfig, postConfig, restartDatacollector, restartDemo, changePassword };
+export {
+  ApiError,
+  getTtyDevices,
+  followTtyDevices,
+  login,
+  getConfig,
+  followConfigEvents,
+  postConfig,
+  applyConfig,
+  followJob,
+  restartDatacollector,
+  restartDemo,
+  followDemoRestart,
+  changePassword,
+};